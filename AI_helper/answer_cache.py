@@ -0,0 +1,276 @@
+"""
+Семантический кэш ответов.
+
+В приёмную кампанию большинство вопросов — перефразировки одних и тех же
+нескольких десятков тем. Кэш хранит готовые ответы по вектору вопроса:
+если новый вопрос близок к сохранённому (косинус ≥ threshold) и база знаний
+с тех пор не менялась (та же версия индекса), ответ отдаётся без поиска
+и без обращения к LLM.
+
+Косинусная близость e5 сжата в узкий верхний диапазон: «сроки подачи
+в магистратуру» и «сроки подачи в бакалавриат» легко дают > 0.95, хотя
+ответы у них разные. Поэтому кроме порога сверяются ключевые признаки
+вопроса (key_terms): числа и слова, от которых зависит ответ, — уровень
+образования, форма и основа обучения, категория поступающих. Если они
+не совпадают, близкий по вектору вопрос считается промахом.
+
+Вытеснение: по времени жизни (TTL) и по давности использования (LRU).
+"""
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, FrozenSet
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Начала слов, меняющих ответ, -> ключ понятия (синонимы сводятся к одному ключу)
+KEY_TERM_PREFIXES = {
+    'бакалавр': 'level:bachelor',
+    'магистр': 'level:master',
+    'специалит': 'level:specialist',
+    'аспиран': 'level:postgraduate',
+    'колледж': 'level:college',
+    'очн': 'form:full-time',
+    'заочн': 'form:extramural',
+    'дистанц': 'form:distance',
+    'бюджет': 'basis:budget',
+    'бесплатн': 'basis:budget',
+    'платн': 'basis:paid',
+    'контракт': 'basis:paid',
+    'договор': 'basis:paid',
+    'целев': 'basis:target',
+    'квот': 'category:quota',
+    'инвалид': 'category:quota',
+    'сирот': 'category:quota',
+    'иностран': 'category:foreign',
+    'иногородн': 'category:nonresident',
+    'олимпиад': 'category:olympiad',
+    'военн': 'category:military',
+}
+
+# Сокращения сравниваются целым словом («спо» — не начало «способ»)
+KEY_TERM_WORDS = {
+    'спо': 'level:college',
+    'кцп': 'basis:budget',
+    'бви': 'category:olympiad',
+}
+
+_WORD_RE = re.compile(r"[а-яёa-z]+|\d+")
+
+
+def key_terms(question: str) -> FrozenSet[str]:
+    """
+    Признаки вопроса, которые должны совпасть для попадания в кэш
+
+    Returns:
+        Числа ('num:2025') и ключи понятий из KEY_TERM_PREFIXES
+    """
+    terms = set()
+    for word in _WORD_RE.findall(question.lower()):
+        if word.isdigit():
+            terms.add(f"num:{int(word)}")
+            continue
+        if word in KEY_TERM_WORDS:
+            terms.add(KEY_TERM_WORDS[word])
+            continue
+        for prefix, term in KEY_TERM_PREFIXES.items():
+            if word.startswith(prefix):
+                terms.add(term)
+                break
+    return frozenset(terms)
+
+
+class SemanticAnswerCache:
+    """Кэш ответов с поиском ближайшего вопроса по косинусной близости"""
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_size: int = 1000,
+        ttl_seconds: Optional[float] = 6 * 3600
+    ):
+        """
+        Args:
+            threshold: Минимальная косинусная близость вопросов для попадания
+            max_size: Максимум сохранённых ответов (LRU)
+            ttl_seconds: Время жизни ответа в секундах (None — бессрочно)
+        """
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        # slot -> запись; порядок — от давно использованных к недавним
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        # Векторы вопросов по слотам (создаётся при первой записи, когда известна размерность)
+        self._vectors: Optional[np.ndarray] = None
+        self._free_slots: List[int] = []
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # Близкие по вектору вопросы, отвергнутые из-за разных ключевых признаков
+        self._key_rejects = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, embedding: List[float], index_version: int, question: str = None) -> Optional[Dict]:
+        """
+        Ищет сохранённый ответ на близкий вопрос
+
+        Args:
+            embedding: Вектор вопроса
+            index_version: Текущая версия базы знаний (VectorStore.index_version)
+            question: Текст вопроса для сверки key_terms (None — только по вектору)
+
+        Returns:
+            {'answer', 'sources', 'question', 'similarity'} или None
+        """
+        vector = self._normalize(embedding)
+        terms = key_terms(question) if question is not None else None
+        now = time.time()
+
+        with self._lock:
+            self._drop_stale(now, index_version)
+
+            if not self._entries:
+                self._misses += 1
+                return None
+
+            slots = np.fromiter(self._entries.keys(), dtype=np.int64)
+            similarities = self._vectors[slots] @ vector
+
+            # Кандидаты выше порога — от ближайшего; берётся первый с теми же признаками
+            slot = None
+            for index in np.argsort(-similarities):
+                similarity = float(similarities[index])
+                if similarity < self.threshold:
+                    break
+                candidate = int(slots[index])
+                if terms is None or self._entries[candidate]['key_terms'] == terms:
+                    slot = candidate
+                    break
+                self._key_rejects += 1
+                logger.debug(
+                    f"💾 Кэш: '{self._entries[candidate]['question']}' близок ({similarity:.3f}), "
+                    f"но признаки отличаются"
+                )
+
+            if slot is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(slot)
+            entry = self._entries[slot]
+            self._hits += 1
+
+        logger.info(f"💾 Ответ из кэша (близость {similarity:.3f}): '{entry['question']}'")
+        return {
+            'answer': entry['answer'],
+            'sources': entry['sources'],
+            'question': entry['question'],
+            'similarity': similarity
+        }
+
+    def put(
+        self,
+        embedding: List[float],
+        index_version: int,
+        question: str,
+        answer: str,
+        sources: List[Dict]
+    ) -> None:
+        """Сохраняет ответ на вопрос"""
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                self._entries.clear()
+                self._free_slots = list(range(self.max_size - 1, -1, -1))
+
+            if not self._free_slots:
+                oldest, _ = self._entries.popitem(last=False)
+                self._free_slots.append(oldest)
+                self._evictions += 1
+
+            slot = self._free_slots.pop()
+            self._vectors[slot] = vector
+            self._entries[slot] = {
+                'question': question,
+                'answer': answer,
+                'sources': sources,
+                'key_terms': key_terms(question),
+                'index_version': index_version,
+                'created': time.time()
+            }
+
+    def _drop_stale(self, now: float, index_version: int) -> None:
+        """Удаляет просроченные записи и ответы по старой версии базы знаний"""
+        stale = [
+            slot for slot, entry in self._entries.items()
+            if entry['index_version'] != index_version
+            or (self.ttl_seconds is not None and now - entry['created'] > self.ttl_seconds)
+        ]
+        for slot in stale:
+            del self._entries[slot]
+            self._free_slots.append(slot)
+        self._evictions += len(stale)
+
+    def clear(self) -> None:
+        """Очищает кэш"""
+        with self._lock:
+            self._free_slots.extend(self._entries.keys())
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        """Статистика попаданий"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 3) if total else 0.0,
+                'evictions': self._evictions,
+                'key_rejects': self._key_rejects,
+                'size': len(self._entries),
+                'max_size': self.max_size
+            }
+
+
+# === ТЕСТИРОВАНИЕ ===
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Худший случай для порога: одинаковые векторы (косинус 1.0) у разных по смыслу вопросов
+    vector = [1.0, 0.0, 0.0]
+    cases = [
+        ("сроки подачи документов в магистратуру", "сроки подачи документов в бакалавриат", False),
+        ("сколько мест на бюджет", "сколько мест на платное", False),
+        ("проходной балл 2024", "проходной балл 2025", False),
+        ("общежитие для иногородних", "общежитие для иностранцев", False),
+        ("поступление после спо", "поступление после школы", False),
+        ("сроки подачи документов в магистратуру", "когда подавать документы в магистратуру", True),
+        ("какие документы нужны для поступления", "какие документы нужны чтобы поступить", True),
+        ("способ подачи документов", "как подать документы", True),
+    ]
+
+    failed = 0
+    for cached_question, new_question, expected_hit in cases:
+        cache = SemanticAnswerCache(threshold=0.95)
+        cache.put(vector, 1, cached_question, "ответ", [])
+        hit = cache.get(vector, 1, new_question) is not None
+        status = "✅" if hit == expected_hit else "❌"
+        failed += hit != expected_hit
+        print(f"{status} '{new_question}' → '{cached_question}': {'попадание' if hit else 'промах'}")
+
+    sys.exit(1 if failed else 0)
@@ -6,7 +6,11 @@ import logging
 from typing import List, Dict, Optional
 
 from .vector_store import VectorStore
-from .llm import YandexGPT, Message
+from .reranker import CrossEncoderReranker
+from .answer_cache import SemanticAnswerCache
+from .context_builder import merge_adjacent_results
+from .timing import stage
+from .llm import BaseLLM, YandexGPT, Message
 
 logger = logging.getLogger(__name__)
 
@@ -17,20 +21,92 @@ class AIAssistant:
     def __init__(
         self,
         vector_store: VectorStore = None,
-        llm: YandexGPT = None,
-        top_k: int = 5
+        llm: BaseLLM = None,
+        top_k: int = 5,
+        search_mode: str = "dense",
+        reranker: Optional[CrossEncoderReranker] = None,
+        rerank_candidates: int = 20,
+        rerank_budget_ms: Optional[float] = 300,
+        answer_cache: Optional[SemanticAnswerCache] = None
     ):
         """
         Args:
             vector_store: Векторное хранилище (или создаст новое)
             llm: LLM модель (или создаст YandexGPT)
             top_k: Количество документов для поиска
+            search_mode: Режим поиска ("dense" или "hybrid" — векторный + BM25)
+            reranker: Кросс-энкодер для переранжирования (None — без него)
+            rerank_candidates: Размер пула кандидатов для переранжирования
+            rerank_budget_ms: Бюджет времени на переранжирование
+            answer_cache: Семантический кэш ответов (None — без него)
         """
         self.vector_store = vector_store or VectorStore()
         self.llm = llm or YandexGPT()
         self.top_k = top_k
+        self.search_mode = search_mode
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.rerank_budget_ms = rerank_budget_ms
+        self.answer_cache = answer_cache
         
-        logger.info(f"✅ AI Assistant инициализирован (top_k={top_k})")
+        logger.info(f"✅ AI Assistant инициализирован (top_k={top_k}, поиск: {search_mode})")
+    
+    def retrieve(self, query: str, variants: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Поиск документов: первый этап в VectorStore и (опционально) переранжирование
+        
+        Args:
+            query: Поисковый запрос
+            variants: Варианты формулировки запроса (QueryProcessor.variants) —
+                      ищутся одним батчем и объединяются через RRF
+            
+        Returns:
+            До top_k результатов в формате VectorStore.search
+        """
+        top_k = self.top_k if self.reranker is None else max(self.rerank_candidates, self.top_k)
+        
+        if variants and len(variants) > 1:
+            candidates = self.vector_store.search_multi(variants, top_k=top_k, mode=self.search_mode)
+        else:
+            candidates = self.vector_store.search(query, top_k=top_k, mode=self.search_mode)
+        
+        if self.reranker is None:
+            return candidates
+        
+        with stage("rerank"):
+            return self.reranker.rerank(
+                query,
+                candidates,
+                top_n=self.top_k,
+                budget_ms=self.rerank_budget_ms
+            )
+    
+    def get_cached_answer(self, query: str) -> Optional[Dict]:
+        """
+        Ответ на близкий вопрос из семантического кэша
+        
+        Вектор запроса попадает в кэш запросов VectorStore,
+        поэтому при промахе поиск не кодирует его повторно.
+        
+        Args:
+            query: Обработанный запрос
+            
+        Returns:
+            {'answer', 'sources', 'question', 'similarity'} или None
+        """
+        if self.answer_cache is None:
+            return None
+        
+        embedding = self.vector_store.embed_query(query)
+        return self.answer_cache.get(embedding, self.vector_store.index_version, query)
+    
+    def cache_answer(self, query: str, answer: str, sources: List[Dict]) -> None:
+        """Сохраняет ответ в семантический кэш (без учёта истории диалога)"""
+        if self.answer_cache is None:
+            return
+        
+        embedding = self.vector_store.embed_query(query)
+        self.answer_cache.put(embedding, self.vector_store.index_version, query, answer, sources)
     
     def ask(
         self, 
@@ -55,8 +131,18 @@ class AIAssistant:
         """
         logger.info(f"Получен вопрос: '{question}'")
         
+        # 0. КЭШ: ответ на тот же вопрос другими словами (только вне диалога)
+        if not conversation_history:
+            cached = self.get_cached_answer(question)
+            if cached is not None:
+                return {
+                    'answer': cached['answer'],
+                    'sources': cached['sources'],
+                    'context': ""
+                }
+        
         # 1. ПОИСК релевантных документов
-        search_results = self.vector_store.search(question, top_k=self.top_k)
+        search_results = self.retrieve(question)
         
         if not search_results:
             logger.warning("Не найдено релевантных документов")
@@ -66,7 +152,8 @@ class AIAssistant:
                 'context': ""
             }
         
-        # 2. ФОРМИРОВАНИЕ контекста
+        # 2. ФОРМИРОВАНИЕ контекста (перекрывающиеся чанки одной страницы — одним фрагментом)
+        search_results = merge_adjacent_results(search_results)
         context_parts = []
         sources = []
         
@@ -101,6 +188,9 @@ class AIAssistant:
         
         logger.info(f"✅ Ответ сгенерирован ({len(answer)} символов)")
         
+        if not conversation_history:
+            self.cache_answer(question, answer, sources)
+        
         return {
             'answer': answer,
             'sources': sources,
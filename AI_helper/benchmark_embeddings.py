@@ -0,0 +1,219 @@
+"""
+Бенчмарк бэкендов embeddings: PyTorch (SentenceTransformer) против ONNX int8.
+
+Каждый бэкенд запускается в отдельном процессе, чтобы честно измерить
+пиковую память. Сравниваются:
+- время загрузки модели
+- задержка одиночного запроса (p50 / p95)
+- пропускная способность батчевого кодирования (текстов/с)
+- пиковый RSS процесса (Linux/macOS — resource, Windows — psutil)
+- загружен ли torch в процессе (для ONNX должен быть нет)
+- косинусная близость ONNX-векторов к torch-векторам
+
+Запуск:
+    python -m AI_helper.benchmark_embeddings --queries 50 --texts 256
+"""
+import sys
+import json
+import time
+import queue
+import argparse
+import statistics
+import multiprocessing as mp
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SAMPLE_QUERIES = [
+    "какие документы нужны для поступления",
+    "что такое бви без вступительных испытаний",
+    "сроки подачи документов в магистратуру",
+    "контрольные цифры приёма кцп",
+    "как учитываются индивидуальные достижения",
+    "целевое обучение условия",
+    "общежитие для иногородних",
+    "минимальные баллы егэ",
+]
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Перцентиль по отсортированному списку"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Пиковый RSS текущего процесса в МБ (None — нечем измерить)"""
+    if resource is not None:
+        # ru_maxrss в Linux — в килобайтах, в macOS — в байтах
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+
+    info = psutil.Process().memory_info()
+    # В Windows psutil отдаёт пиковый рабочий набор (peak_wset)
+    return round(getattr(info, "peak_wset", info.rss) / 1024 / 1024, 1)
+
+
+def _load_corpus(limit: int) -> List[str]:
+    """Тексты чанков из базы знаний (или синтетические, если документов нет)"""
+    from AI_helper.document_loader import DocumentLoader
+
+    chunks = DocumentLoader().load_all_documents()
+    texts = [chunk.text for chunk in chunks[:limit]]
+
+    if not texts:
+        texts = [f"Пункт {i}. " + " ".join(SAMPLE_QUERIES) for i in range(limit)]
+
+    return texts
+
+
+def _run_backend(backend: str, queries: int, texts: List[str], batch_size: int, result_queue) -> None:
+    """Замеры одного бэкенда (выполняется в дочернем процессе)"""
+    from AI_helper.embeddings import EmbeddingModel
+
+    start = time.perf_counter()
+    model = EmbeddingModel(backend=backend, use_cache=False)
+    load_time = time.perf_counter() - start
+
+    # Прогрев
+    model.embed_text(SAMPLE_QUERIES[0])
+
+    latencies = []
+    for i in range(queries):
+        query = SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]
+        start = time.perf_counter()
+        model.embed_text(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    model.embed_texts(texts, batch_size=batch_size, show_progress=False)
+    batch_time = time.perf_counter() - start
+
+    reference = model.embed_texts(SAMPLE_QUERIES + texts[:32], show_progress=False)
+
+    result_queue.put({
+        'backend': backend,
+        'load_time_s': round(load_time, 2),
+        'latency_p50_ms': round(_percentile(latencies, 50), 2),
+        'latency_p95_ms': round(_percentile(latencies, 95), 2),
+        'latency_mean_ms': round(statistics.mean(latencies), 2),
+        'throughput_texts_per_s': round(len(texts) / batch_time, 1),
+        'peak_rss_mb': _peak_rss_mb(),
+        'torch_loaded': "torch" in sys.modules,
+        'vectors': reference,
+    })
+
+
+def run_benchmark(backends: List[str], queries: int, texts_limit: int, batch_size: int) -> Dict:
+    """Запускает бенчмарк всех бэкендов и сравнивает их векторы"""
+    texts = _load_corpus(texts_limit)
+    ctx = mp.get_context("spawn")
+    results = {}
+
+    for backend in backends:
+        result_queue = ctx.Queue()
+        process = ctx.Process(
+            target=_run_backend,
+            args=(backend, queries, texts, batch_size, result_queue)
+        )
+        process.start()
+
+        while True:
+            try:
+                results[backend] = result_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"Бэкенд '{backend}' завершился с ошибкой")
+
+        process.join()
+
+    report = {'texts': len(texts), 'queries': queries, 'backends': {}}
+
+    for backend, result in results.items():
+        report['backends'][backend] = {k: v for k, v in result.items() if k != 'vectors'}
+
+    if "torch" in results and "onnx" in results:
+        from AI_helper.onnx_embeddings import COSINE_TOLERANCE
+
+        torch_vectors = np.asarray(results["torch"]["vectors"], dtype=np.float32)
+        onnx_vectors = np.asarray(results["onnx"]["vectors"], dtype=np.float32)
+        cosines = (torch_vectors * onnx_vectors).sum(axis=1) / (
+            np.linalg.norm(torch_vectors, axis=1) * np.linalg.norm(onnx_vectors, axis=1)
+        )
+        report['cosine'] = {
+            'min': round(float(cosines.min()), 4),
+            'mean': round(float(cosines.mean()), 4),
+            'tolerance': COSINE_TOLERANCE,
+            'within_tolerance': bool(cosines.min() >= 1 - COSINE_TOLERANCE),
+        }
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк бэкендов embeddings")
+    parser.add_argument("--backends", default="torch,onnx", help="Список бэкендов через запятую")
+    parser.add_argument("--queries", type=int, default=50, help="Число одиночных запросов")
+    parser.add_argument("--texts", type=int, default=256, help="Число текстов для батчевого теста")
+    parser.add_argument("--batch-size", type=int, default=32, help="Размер батча")
+    parser.add_argument("--json", help="Сохранить отчёт в JSON-файл")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        backends=[b.strip() for b in args.backends.split(",") if b.strip()],
+        queries=args.queries,
+        texts_limit=args.texts,
+        batch_size=args.batch_size,
+    )
+
+    print("\n" + "=" * 70)
+    print("⏱ БЕНЧМАРК EMBEDDINGS")
+    print("=" * 70)
+    print(f"Текстов: {report['texts']}, одиночных запросов: {report['queries']}\n")
+    print(
+        f"{'Бэкенд':<8} {'загрузка, с':>12} {'p50, мс':>9} {'p95, мс':>9} "
+        f"{'текст/с':>9} {'RSS, МБ':>9} {'torch':>6}"
+    )
+    for backend, r in report['backends'].items():
+        rss = r['peak_rss_mb'] if r['peak_rss_mb'] is not None else "н/д"
+        print(
+            f"{backend:<8} {r['load_time_s']:>12} {r['latency_p50_ms']:>9} "
+            f"{r['latency_p95_ms']:>9} {r['throughput_texts_per_s']:>9} {rss:>9} "
+            f"{'да' if r['torch_loaded'] else 'нет':>6}"
+        )
+    if any(r['peak_rss_mb'] is None for r in report['backends'].values()):
+        print("ℹ️ Для замера памяти в Windows установите psutil: pip install psutil")
+
+    if 'cosine' in report:
+        cosine = report['cosine']
+        status = "✅" if cosine['within_tolerance'] else "❌"
+        print(
+            f"\n{status} Косинус torch↔onnx: min={cosine['min']}, mean={cosine['mean']} "
+            f"(допуск: ≥ {1 - cosine['tolerance']})"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\n💾 Отчёт сохранён в {args.json}")
+
+    print("=" * 70)
+
+    if 'cosine' in report and not report['cosine']['within_tolerance']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
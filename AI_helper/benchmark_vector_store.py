@@ -0,0 +1,171 @@
+"""
+Бенчмарк векторных бэкендов: ChromaDB против плоского NumPy-индекса.
+
+Оба бэкенда наполняются одними и теми же векторами (синтетическими или
+скопированными из существующей Chroma-коллекции), модель embeddings
+не загружается — измеряется только хранилище:
+- время построения индекса
+- время открытия (холодный старт процесса бота)
+- задержка запроса (p50 / p95)
+- совпадение top-k с ChromaDB (доля общих результатов)
+
+Запуск:
+    python -m AI_helper.benchmark_vector_store --synthetic 5000
+    python -m AI_helper.benchmark_vector_store --from-chroma AI_helper/data/chroma_db
+"""
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from typing import Dict, List, Tuple
+
+import numpy as np
+import chromadb
+
+from AI_helper.flat_store import FlatClient
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Перцентиль по отсортированному списку"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _synthetic_data(count: int, dim: int) -> Tuple[List[str], np.ndarray, List[str], List[Dict]]:
+    """Случайные нормализованные векторы с фиктивными текстами"""
+    rng = np.random.default_rng(42)
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"doc_{i}" for i in range(count)]
+    texts = [f"Текст чанка {i}" for i in range(count)]
+    metadatas = [{"source": "synthetic.txt", "file_name": "synthetic.txt", "page": i // 10 + 1} for i in range(count)]
+    return ids, vectors, texts, metadatas
+
+
+def _chroma_data(path: str, collection: str) -> Tuple[List[str], np.ndarray, List[str], List[Dict]]:
+    """Векторы из существующей Chroma-коллекции"""
+    source = chromadb.PersistentClient(path=path).get_collection(name=collection)
+    data = source.get(include=["embeddings", "documents", "metadatas"])
+    return data["ids"], np.asarray(data["embeddings"], dtype=np.float32), data["documents"], data["metadatas"]
+
+
+def _fill(collection, ids, vectors, texts, metadatas, batch_size: int = 100) -> float:
+    """Наполняет коллекцию и возвращает время в секундах"""
+    start = time.perf_counter()
+    for i in range(0, len(ids), batch_size):
+        collection.upsert(
+            ids=ids[i:i + batch_size],
+            embeddings=vectors[i:i + batch_size].tolist(),
+            documents=texts[i:i + batch_size],
+            metadatas=metadatas[i:i + batch_size],
+        )
+    if hasattr(collection, "persist"):
+        collection.persist()
+    return time.perf_counter() - start
+
+
+def _measure_queries(collection, queries: np.ndarray, top_k: int) -> Tuple[List[float], List[List[str]]]:
+    """Задержки запросов (мс) и найденные ID"""
+    latencies, found = [], []
+    # Прогрев
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=top_k)
+    for query in queries:
+        start = time.perf_counter()
+        result = collection.query(
+            query_embeddings=[query.tolist()],
+            n_results=top_k,
+            include=["documents", "metadatas", "distances"],
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(result["ids"][0])
+    return latencies, found
+
+
+def run_benchmark(ids, vectors, texts, metadatas, n_queries: int, top_k: int) -> Dict:
+    """Сравнивает бэкенды на одних данных"""
+    rng = np.random.default_rng(7)
+    # Запросы — зашумлённые векторы из индекса, чтобы у них были явные соседи
+    picks = rng.integers(0, len(ids), size=n_queries)
+    queries = vectors[picks] + 0.05 * rng.standard_normal((n_queries, vectors.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    report = {'documents': len(ids), 'dim': int(vectors.shape[1]), 'queries': n_queries, 'top_k': top_k, 'backends': {}}
+    found_by_backend = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        clients = {
+            "chroma": lambda: chromadb.PersistentClient(path=f"{tmp_dir}/chroma"),
+            "flat": lambda: FlatClient(path=f"{tmp_dir}/flat"),
+        }
+
+        for backend, make_client in clients.items():
+            build_time = _fill(make_client().create_collection(name="bench"), ids, vectors, texts, metadatas)
+
+            # Холодное открытие — как при старте бота
+            start = time.perf_counter()
+            collection = make_client().get_collection(name="bench")
+            collection.query(query_embeddings=[queries[0].tolist()], n_results=top_k)
+            open_time = time.perf_counter() - start
+
+            latencies, found = _measure_queries(collection, queries, top_k)
+            found_by_backend[backend] = found
+
+            report['backends'][backend] = {
+                'build_time_s': round(build_time, 2),
+                'open_time_ms': round(open_time * 1000, 1),
+                'latency_p50_ms': round(_percentile(latencies, 50), 3),
+                'latency_p95_ms': round(_percentile(latencies, 95), 3),
+                'latency_mean_ms': round(statistics.mean(latencies), 3),
+            }
+
+    overlaps = [
+        len(set(chroma_ids) & set(flat_ids)) / max(len(chroma_ids), 1)
+        for chroma_ids, flat_ids in zip(found_by_backend["chroma"], found_by_backend["flat"])
+    ]
+    report['topk_overlap'] = round(statistics.mean(overlaps), 4)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк ChromaDB против плоского NumPy-индекса")
+    parser.add_argument("--synthetic", type=int, default=5000, help="Число синтетических векторов")
+    parser.add_argument("--dim", type=int, default=1024, help="Размерность синтетических векторов")
+    parser.add_argument("--from-chroma", help="Взять векторы из существующей папки ChromaDB")
+    parser.add_argument("--collection", default="ai_knowledge", help="Название коллекции")
+    parser.add_argument("--queries", type=int, default=200, help="Число запросов")
+    parser.add_argument("--top-k", type=int, default=10, help="Сколько результатов на запрос")
+    parser.add_argument("--json", help="Сохранить отчёт в JSON-файл")
+    args = parser.parse_args()
+
+    if args.from_chroma:
+        data = _chroma_data(args.from_chroma, args.collection)
+    else:
+        data = _synthetic_data(args.synthetic, args.dim)
+
+    report = run_benchmark(*data, n_queries=args.queries, top_k=args.top_k)
+
+    print("\n" + "=" * 70)
+    print("⏱ БЕНЧМАРК ВЕКТОРНЫХ ХРАНИЛИЩ")
+    print("=" * 70)
+    print(f"Документов: {report['documents']}, размерность: {report['dim']}, "
+          f"запросов: {report['queries']}, top_k: {report['top_k']}\n")
+    print(f"{'Бэкенд':<8} {'построение, с':>14} {'открытие, мс':>13} {'p50, мс':>9} {'p95, мс':>9}")
+    for backend, r in report['backends'].items():
+        print(
+            f"{backend:<8} {r['build_time_s']:>14} {r['open_time_ms']:>13} "
+            f"{r['latency_p50_ms']:>9} {r['latency_p95_ms']:>9}"
+        )
+    print(f"\n🎯 Совпадение top-{report['top_k']} с ChromaDB: {report['topk_overlap'] * 100:.1f}%")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\n💾 Отчёт сохранён в {args.json}")
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
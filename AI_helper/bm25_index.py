@@ -0,0 +1,171 @@
+"""
+Разреженный (BM25) индекс по чанкам базы знаний.
+Дополняет векторный поиск точным совпадением терминов:
+номера пунктов ("5.9"), аббревиатуры ("КЦП"), названия документов.
+"""
+import os
+import re
+import json
+import math
+import heapq
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Номера пунктов вида 5.9 / 3.2.1 — одним токеном, остальное — по словам
+TOKEN_PATTERN = re.compile(r"\d+(?:\.\d+)+|\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на токены (нижний регистр, ё → е)"""
+    return TOKEN_PATTERN.findall(text.lower().replace("ё", "е"))
+
+
+class BM25Index:
+    """Инвертированный индекс BM25 в памяти с сохранением в JSON"""
+
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            path: Файл индекса (None — только в памяти)
+            k1: Параметр насыщения частоты терма
+            b: Параметр нормализации по длине документа
+        """
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+
+        self._lock = threading.RLock()
+        self._doc_terms: Dict[str, Dict[str, int]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+        self._mtime = None
+
+        if self.path and self.path.exists():
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, doc_id: str, text: str) -> None:
+        """Добавляет (или заменяет) документ в индексе"""
+        terms: Dict[str, int] = {}
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + 1
+
+        with self._lock:
+            if doc_id in self._doc_terms:
+                self.remove(doc_id)
+
+            self._doc_terms[doc_id] = terms
+            self._doc_len[doc_id] = sum(terms.values())
+            self._total_len += self._doc_len[doc_id]
+
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id: str) -> None:
+        """Удаляет документ из индекса"""
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+
+            self._total_len -= self._doc_len.pop(doc_id, 0)
+
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is not None:
+                    posting.pop(doc_id, None)
+                    if not posting:
+                        del self._postings[term]
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Ищет документы по BM25
+
+        Args:
+            query: Запрос
+            top_k: Количество результатов
+
+        Returns:
+            Список (doc_id, score) по убыванию score
+        """
+        with self._lock:
+            n_docs = len(self._doc_len)
+            if n_docs == 0:
+                return []
+
+            avg_len = self._total_len / n_docs
+            scores: Dict[str, float] = {}
+
+            for term in set(tokenize(query)):
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+
+                df = len(posting)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+                for doc_id, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def clear(self) -> None:
+        """Очищает индекс"""
+        with self._lock:
+            self._doc_terms.clear()
+            self._postings.clear()
+            self._doc_len.clear()
+            self._total_len = 0
+
+    def save(self) -> None:
+        """Сохраняет индекс на диск (атомарно, через временный файл)"""
+        if self.path is None:
+            return
+
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"k1": self.k1, "b": self.b, "docs": self._doc_terms}, file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._mtime = self.path.stat().st_mtime
+
+    def load(self) -> None:
+        """Загружает индекс с диска и восстанавливает инвертированные списки"""
+        with open(self.path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+
+        with self._lock:
+            self.clear()
+            self.k1 = data.get("k1", self.k1)
+            self.b = data.get("b", self.b)
+
+            for doc_id, terms in data["docs"].items():
+                self._doc_terms[doc_id] = terms
+                self._doc_len[doc_id] = sum(terms.values())
+                self._total_len += self._doc_len[doc_id]
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+
+            self._mtime = self.path.stat().st_mtime
+
+        logger.info(f"✅ BM25-индекс загружен ({len(self)} документов)")
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает индекс, если файл обновил другой процесс (например, переиндексация)"""
+        if self.path is None or not self.path.exists():
+            return False
+
+        if self.path.stat().st_mtime == self._mtime:
+            return False
+
+        self.load()
+        return True
@@ -0,0 +1,338 @@
+"""
+Сборка промпта в пределах бюджета токенов.
+
+Раньше в промпт попадали все найденные чанки целиком, поверх длинного
+SYSTEM_PROMPT и истории диалога, — размер запроса к LLM ничем не ограничивался.
+ContextBuilder считает токены (tiktoken) и жадно добавляет чанки в порядке
+ранжирования, пока они помещаются в бюджет, оставляя место под историю
+и ответ модели.
+
+Соседние чанки одной страницы перекрываются (chunk_overlap), и когда оба
+попадают в выдачу, общий текст повторялся в промпте дважды. Перед упаковкой
+merge_adjacent_results склеивает найденные чанки с перекрывающимися или
+смежными смещениями (метаданные start/end) в один фрагмент без повторов.
+
+Токенизатор cl100k_base не совпадает с токенизатором YandexGPT, поэтому
+бюджет — оценка с запасом. Если словарь tiktoken недоступен (нет сети при
+первом запуске), используется оценка по числу символов.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional
+
+from .prompts import build_full_prompt
+
+logger = logging.getLogger(__name__)
+
+
+def _offsets(result: Dict) -> Optional[tuple]:
+    """Смещения чанка (start, end) из метаданных или None для старых индексов"""
+    metadata = result.get('metadata') or {}
+    start, end = metadata.get('start'), metadata.get('end')
+    if start is None or end is None:
+        return None
+    return int(start), int(end)
+
+
+def merge_adjacent_results(results: List[Dict], max_gap: int = 1) -> List[Dict]:
+    """
+    Склеивает найденные чанки одного источника и страницы,
+    если их смещения перекрываются или идут подряд
+
+    Склеенный фрагмент встаёт на место лучшего из чанков (порядок
+    ранжирования сохраняется), score — максимальный из склеенных,
+    в 'merged_ids' — ID всех исходных чанков. Чанки без смещений
+    (проиндексированы до их появления) не меняются.
+
+    Args:
+        results: Результаты поиска (по убыванию релевантности)
+        max_gap: Сколько символов между чанками ещё считать «подряд»
+            (пробел или перевод строки, срезанный strip)
+
+    Returns:
+        Новый список результатов
+    """
+    groups: Dict[tuple, List[int]] = {}
+    for idx, result in enumerate(results):
+        if _offsets(result) is not None:
+            groups.setdefault((result.get('source'), result.get('page')), []).append(idx)
+
+    replaced: Dict[int, Dict] = {}
+    absorbed = set()
+
+    for indices in groups.values():
+        if len(indices) < 2:
+            continue
+
+        indices.sort(key=lambda i: _offsets(results[i]))
+        runs = [[indices[0]]]
+        run_end = _offsets(results[indices[0]])[1]
+
+        for idx in indices[1:]:
+            start, end = _offsets(results[idx])
+            if start <= run_end + max_gap:
+                runs[-1].append(idx)
+                run_end = max(run_end, end)
+            else:
+                runs.append([idx])
+                run_end = end
+
+        for run in runs:
+            if len(run) < 2:
+                continue
+
+            text = results[run[0]]['text']
+            start, end = _offsets(results[run[0]])
+            for idx in run[1:]:
+                next_start, next_end = _offsets(results[idx])
+                if next_end <= end:
+                    continue  # Целиком внутри уже склеенного
+                next_text = results[idx]['text']
+                if next_start >= end:
+                    text += " " + next_text if next_start > end else next_text
+                else:
+                    text += next_text[end - next_start:]
+                end = next_end
+
+            best = min(run)
+            merged = dict(results[best])
+            merged['text'] = text
+            merged['score'] = max(results[i]['score'] for i in run)
+            merged['merged_ids'] = [results[i].get('id') for i in sorted(run)]
+            merged['metadata'] = {**(results[best].get('metadata') or {}), 'start': start, 'end': end}
+
+            replaced[best] = merged
+            absorbed.update(i for i in run if i != best)
+
+    if not replaced:
+        return results
+
+    logger.info(f"🧩 Склеено соседних чанков: {len(absorbed) + len(replaced)} → {len(replaced)}")
+    return [
+        replaced.get(idx, result)
+        for idx, result in enumerate(results)
+        if idx not in absorbed
+    ]
+
+
+class TokenCounter:
+    """Подсчёт токенов через tiktoken с запасным вариантом по символам"""
+
+    # Для русского текста в cl100k_base выходит ~2.5–3 символа на токен;
+    # берём меньшее значение, чтобы оценка была с запасом
+    CHARS_PER_TOKEN = 2.5
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._loaded = False
+
+    def _get_encoding(self):
+        """Загружает словарь при первом использовании"""
+        if not self._loaded:
+            self._loaded = True
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                logger.warning(f"⚠️ tiktoken недоступен ({e}), токены оцениваются по длине текста")
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        """Количество токенов в тексте"""
+        encoding = self._get_encoding()
+        if encoding is None:
+            return int(len(text) / self.CHARS_PER_TOKEN) + 1
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезает текст до max_tokens токенов"""
+        if max_tokens <= 0:
+            return ""
+        encoding = self._get_encoding()
+        if encoding is None:
+            return text[:int(max_tokens * self.CHARS_PER_TOKEN)]
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+@dataclass
+class PackedContext:
+    """Результат сборки промпта"""
+    prompt: str
+    doc_context: str
+    results: List[Dict]                # Чанки, попавшие в промпт
+    prompt_tokens: int
+    max_tokens: int                    # Сколько токенов запрашивать на ответ
+    dropped: int = 0                   # Сколько чанков не поместилось
+    merged: int = 0                    # Сколько чанков поглощено склейкой соседних
+    history: Optional[str] = field(default=None, repr=False)
+
+
+class ContextBuilder:
+    """Жадная упаковка найденных чанков в бюджет токенов"""
+
+    def __init__(
+        self,
+        input_budget: int = 6000,
+        output_tokens: int = 1500,
+        history_tokens: int = 1000,
+        counter: TokenCounter = None,
+        merge_adjacent: bool = True
+    ):
+        """
+        Args:
+            input_budget: Максимум токенов во входном промпте
+            output_tokens: Резерв на ответ (передаётся в LLM как max_tokens)
+            history_tokens: Максимум токенов на историю диалога
+            counter: Счётчик токенов (по умолчанию tiktoken cl100k_base)
+            merge_adjacent: Склеивать перекрывающиеся чанки одной страницы
+        """
+        self.input_budget = input_budget
+        self.output_tokens = output_tokens
+        self.history_tokens = history_tokens
+        self.counter = counter or TokenCounter()
+        self.merge_adjacent = merge_adjacent
+
+    @staticmethod
+    def format_document(idx: int, result: Dict) -> str:
+        """Блок одного документа в контексте"""
+        return (
+            f"[ДОКУМЕНТ {idx}]\n"
+            f"Источник: {result['file_name']}\n"
+            f"Страница: {result.get('page', 'N/A')}\n"
+            f"Текст:\n{result['text']}\n"
+        )
+
+    def _fit_history(self, history: Optional[str]) -> Optional[str]:
+        """
+        Оставляет последние строки истории, которые помещаются в history_tokens
+
+        HistoryManager.render уже укладывает историю в этот бюджет целыми
+        репликами; обрезка по строкам — только страховка для истории,
+        собранной в обход него (теряются заголовок и метки ролей).
+        """
+        if not history:
+            return None
+
+        if self.counter.count(history) <= self.history_tokens:
+            return history
+
+        logger.warning(
+            f"⚠️ История длиннее бюджета ({self.counter.count(history)} > "
+            f"{self.history_tokens} токенов) — обрезаем по строкам"
+        )
+
+        kept, used = [], 0
+        for line in reversed(history.splitlines()):
+            tokens = self.counter.count(line) + 1
+            if used + tokens > self.history_tokens:
+                break
+            kept.append(line)
+            used += tokens
+
+        return "\n".join(reversed(kept)) or None
+
+    def build(
+        self,
+        question: str,
+        results: List[Dict],
+        conversation_history: Optional[str] = None
+    ) -> PackedContext:
+        """
+        Собирает промпт из вопроса, истории и найденных чанков
+
+        Сначала соседние чанки одной страницы склеиваются (merge_adjacent),
+        затем берутся в порядке ранжирования поиска; не помещающийся
+        пропускается, но следующие (более короткие) ещё пробуются.
+        Если не помещается даже первый — он обрезается, чтобы у модели
+        был хоть какой-то контекст.
+
+        Args:
+            question: Вопрос пользователя
+            results: Результаты поиска (по убыванию релевантности)
+            conversation_history: История диалога в виде текста
+
+        Returns:
+            PackedContext
+        """
+        history = self._fit_history(conversation_history)
+
+        found = len(results)
+        if self.merge_adjacent:
+            results = merge_adjacent_results(results)
+
+        # Всё, кроме документов: системный промпт, разметка, история, вопрос
+        base_tokens = self.counter.count(build_full_prompt(question, "", history))
+        available = self.input_budget - base_tokens
+
+        packed: List[Dict] = []
+        parts: List[str] = []
+        used = 0
+
+        for result in results:
+            block = self.format_document(len(packed) + 1, result)
+            tokens = self.counter.count(block) + 1
+
+            if used + tokens <= available:
+                packed.append(result)
+                parts.append(block)
+                used += tokens
+            elif not packed and available > 0:
+                # Первый документ целиком не помещается — берём его начало
+                header = self.format_document(1, {**result, 'text': ""})
+                text_budget = available - self.counter.count(header) - 1
+                text = self.counter.truncate(result['text'], text_budget)
+                if text:
+                    packed.append({**result, 'text': text})
+                    parts.append(self.format_document(1, {**result, 'text': text}))
+                    used += self.counter.count(parts[-1]) + 1
+
+        doc_context = "\n".join(parts)
+        prompt = build_full_prompt(question, doc_context, history)
+        prompt_tokens = self.counter.count(prompt)
+        dropped = len(results) - len(packed)
+
+        logger.info(
+            f"📦 Контекст: {len(packed)}/{len(results)} фрагментов из {found} чанков, "
+            f"~{prompt_tokens} токенов (бюджет {self.input_budget}), ответ до {self.output_tokens}"
+        )
+
+        return PackedContext(
+            prompt=prompt,
+            doc_context=doc_context,
+            results=packed,
+            prompt_tokens=prompt_tokens,
+            max_tokens=self.output_tokens,
+            dropped=dropped,
+            merged=found - len(results),
+            history=history
+        )
+
+
+# === ТЕСТИРОВАНИЕ ===
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    builder = ContextBuilder(input_budget=4500, output_tokens=1000)
+
+    fake_results = [
+        {'file_name': 'rules.pdf', 'page': i, 'score': 0.9 - i * 0.05, 'text': "Пункт правил приёма. " * 60}
+        for i in range(1, 11)
+    ]
+
+    # Два перекрывающихся чанка одной страницы
+    page_text = "Абитуриент подаёт заявление, паспорт и документ об образовании. " * 20
+    fake_results += [
+        {'id': 'a', 'source': 'rules.pdf', 'file_name': 'rules.pdf', 'page': 20, 'score': 0.95,
+         'text': page_text[0:800], 'metadata': {'start': 0, 'end': 800}},
+        {'id': 'b', 'source': 'rules.pdf', 'file_name': 'rules.pdf', 'page': 20, 'score': 0.93,
+         'text': page_text[600:1280], 'metadata': {'start': 600, 'end': 1280}},
+    ]
+
+    packed = builder.build("Какие документы нужны?", fake_results)
+
+    print(f"\n📦 Документов в промпте: {len(packed.results)} из {len(fake_results)}")
+    print(f"🧩 Склеено чанков: {packed.merged}")
+    print(f"🔢 Токенов в промпте: {packed.prompt_tokens}")
+    print(f"✍️ max_tokens ответа: {packed.max_tokens}")
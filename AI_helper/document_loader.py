@@ -3,9 +3,13 @@
 Поддерживает: PDF, DOCX, TXT
 """
 import os
+import hashlib
 import logging
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
 from dataclasses import dataclass
 
 import PyPDF2
@@ -26,6 +30,15 @@ class DocumentChunk:
 class DocumentLoader:
     """Загрузчик документов из папки ai_knowledge"""
     
+    # Размер блока при потоковом чтении TXT (символов)
+    TXT_BLOCK_SIZE = 64 * 1024
+    
+    # Сколько страниц большого PDF разбирает один процесс в параллельном режиме
+    PDF_PAGES_PER_TASK = 50
+    
+    # PDF меньше этого размера разбираются одной задачей (без подсчёта страниц)
+    PDF_SPLIT_BYTES = 10 * 1024 * 1024
+    
     def __init__(self, knowledge_dir: str = None):
         """
         Args:
@@ -43,121 +56,313 @@ class DocumentLoader:
             self.knowledge_dir.mkdir(parents=True, exist_ok=True)
             logger.info(f"Создана папка для документов: {self.knowledge_dir}")
     
-    def load_all_documents(self, chunk_size: int = 800, chunk_overlap: int = 200) -> List[DocumentChunk]:
+    def load_all_documents(
+        self,
+        chunk_size: int = 800,
+        chunk_overlap: int = 200,
+        workers: Optional[int] = None
+    ) -> List[DocumentChunk]:
         """
         Загружает все документы из папки ai_knowledge
         
+        Для больших архивов лучше использовать iter_chunks(): он не держит
+        в памяти все чанки сразу.
+        
         Args:
             chunk_size: Размер чанка в символах (увеличен до 800 для лучшего контекста)
             chunk_overlap: Перекрытие между чанками (увеличено до 200 для связности)
+            workers: Число процессов для параллельного разбора (None — последовательно)
         
         Returns:
             Список DocumentChunk
         """
-        all_chunks = []
+        all_chunks = list(self.iter_chunks(chunk_size, chunk_overlap, workers=workers))
+        logger.info(f"Всего загружено {len(all_chunks)} чанков из документов")
+        return all_chunks
+    
+    def iter_chunks(
+        self,
+        chunk_size: int = 800,
+        chunk_overlap: int = 200,
+        workers: Optional[int] = None
+    ) -> Iterator[DocumentChunk]:
+        """
+        Потоково отдаёт чанки всех документов: файлы → страницы → чанки
+        
+        В памяти одновременно находится только текущая страница (или блок текста),
+        поэтому подходит для архивов любого размера.
+        
+        Args:
+            chunk_size: Размер чанка в символах
+            chunk_overlap: Перекрытие между чанками
+            workers: Число процессов для параллельного разбора (None — последовательно).
+                     Порядок чанков тот же, что и при последовательном разборе
+        
+        Yields:
+            DocumentChunk
+        """
+        if workers and workers > 1:
+            yield from self._iter_chunks_parallel(chunk_size, chunk_overlap, workers)
+            return
         
         # Рекурсивно ищем все файлы
-        for file_path in self.knowledge_dir.rglob("*"):
-            if file_path.is_file():
+        for file_path in self.iter_files():
+            count = 0
+            try:
+                for chunk in self.iter_file_chunks(file_path, chunk_size, chunk_overlap):
+                    count += 1
+                    yield chunk
+                logger.info(f"Загружено {count} чанков из {file_path.name}")
+            except Exception as e:
+                logger.error(f"Ошибка загрузки {file_path} (после {count} чанков): {e}")
+    
+    def _iter_chunks_parallel(self, chunk_size: int, chunk_overlap: int, workers: int) -> Iterator[DocumentChunk]:
+        """
+        Разбирает файлы (и диапазоны страниц больших PDF) в пуле процессов
+        
+        Результаты отдаются строго в порядке задач, поэтому итог детерминирован.
+        Одновременно в работе не больше 2 * workers задач, чтобы память
+        не росла, если потребитель медленнее парсеров. Ошибка в одном файле
+        не останавливает разбор остальных.
+        
+        Диапазоны страниц разделённого PDF копятся и отдаются только после
+        успешного разбора последнего: если упал хоть один, чанки файла
+        отбрасываются целиком. Иначе в индекс попала бы часть документа
+        с отпечатком file_hash, и sync_documents счёл бы файл готовым.
+        """
+        logger.info(f"Параллельный разбор: {workers} процессов")
+        
+        failed_files = set()
+        file_hashes: Dict[str, str] = {}
+        split_chunks: Dict[str, List[DocumentChunk]] = {}
+        
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            task_iter = self._iter_parse_tasks(pool, chunk_size, chunk_overlap)
+            
+            for task in itertools.islice(task_iter, workers * 2):
+                pending.append((task, pool.submit(_parse_task, task)))
+            
+            while pending:
+                task, future = pending.popleft()
+                next_task = next(task_iter, None)
+                if next_task is not None:
+                    pending.append((next_task, pool.submit(_parse_task, next_task)))
+                
+                file_path = Path(task[0])
+                source = str(file_path)
+                
                 try:
-                    chunks = self._load_file(file_path, chunk_size, chunk_overlap)
-                    all_chunks.extend(chunks)
-                    logger.info(f"Загружено {len(chunks)} чанков из {file_path.name}")
+                    chunks = future.result()
+                    if source in failed_files:
+                        continue
+                    
+                    # Диапазон страниц большого PDF — ждём остальные диапазоны
+                    if task[3] is not None:
+                        split_chunks.setdefault(source, []).extend(chunks)
+                        if task[3][1] < task[4]:
+                            continue
+                        chunks = split_chunks.pop(source)
+                    
+                    if chunks and source not in file_hashes:
+                        file_hashes[source] = self.file_fingerprint(file_path)
                 except Exception as e:
-                    logger.error(f"Ошибка загрузки {file_path}: {e}")
+                    if source not in failed_files:
+                        failed_files.add(source)
+                        dropped = len(split_chunks.pop(source, []))
+                        logger.error(
+                            f"Ошибка загрузки {file_path}: {e}"
+                            + (f" (отброшено {dropped} чанков уже разобранных страниц)" if dropped else "")
+                        )
+                    continue
+                
+                for chunk in chunks:
+                    chunk.metadata = {**(chunk.metadata or {}), "file_hash": file_hashes[source]}
+                    yield chunk
+                
+                logger.info(f"Загружено {len(chunks)} чанков из {file_path.name}")
+    
+    def _iter_parse_tasks(
+        self,
+        pool: ProcessPoolExecutor,
+        chunk_size: int,
+        chunk_overlap: int
+    ) -> Iterator[Tuple]:
+        """
+        Задачи разбора: (путь, chunk_size, chunk_overlap, диапазон страниц, всего страниц)
         
-        logger.info(f"Всего загружено {len(all_chunks)} чанков из документов")
-        return all_chunks
+        Каждый файл — одна задача. Только PDF больше PDF_SPLIT_BYTES делятся
+        на диапазоны по PDF_PAGES_PER_TASK страниц; число страниц для них
+        сразу считают процессы пула (параллельно, а не здесь по очереди),
+        а задачи выдаются лениво — по мере того, как пул готов их принять.
+        """
+        files = self.iter_files()
+        page_counts = {
+            file_path: pool.submit(_count_pdf_pages, str(file_path))
+            for file_path in files
+            if file_path.suffix.lower() == ".pdf" and file_path.stat().st_size > self.PDF_SPLIT_BYTES
+        }
+        
+        for file_path in files:
+            total_pages = 0
+            if file_path in page_counts:
+                try:
+                    total_pages = page_counts[file_path].result()
+                except Exception:
+                    # Ошибку покажет сам разбор файла одной задачей
+                    total_pages = 0
+            
+            if total_pages > self.PDF_PAGES_PER_TASK:
+                for first_page in range(1, total_pages + 1, self.PDF_PAGES_PER_TASK):
+                    last_page = min(first_page + self.PDF_PAGES_PER_TASK - 1, total_pages)
+                    yield (str(file_path), chunk_size, chunk_overlap, (first_page, last_page), total_pages)
+            else:
+                yield (str(file_path), chunk_size, chunk_overlap, None, total_pages)
+    
+    def iter_files(self) -> List[Path]:
+        """Возвращает все файлы из папки ai_knowledge в стабильном порядке"""
+        return sorted(
+            file_path for file_path in self.knowledge_dir.rglob("*")
+            if file_path.is_file()
+        )
+    
+    @staticmethod
+    def file_fingerprint(file_path: Path) -> str:
+        """
+        Отпечаток содержимого файла (sha256)
+        
+        Используется для инкрементальной переиндексации:
+        если отпечаток не изменился, файл не нужно парсить заново.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def load_file(self, file_path: Path, chunk_size: int = 800, chunk_overlap: int = 200) -> List[DocumentChunk]:
+        """
+        Загружает один файл и помечает чанки отпечатком файла
+        
+        Args:
+            file_path: Путь к файлу
+            chunk_size: Размер чанка в символах
+            chunk_overlap: Перекрытие между чанками
+        
+        Returns:
+            Список DocumentChunk (metadata содержит file_hash)
+        """
+        return list(self.iter_file_chunks(file_path, chunk_size, chunk_overlap))
     
-    def _load_file(self, file_path: Path, chunk_size: int, chunk_overlap: int) -> List[DocumentChunk]:
+    def iter_file_chunks(
+        self,
+        file_path: Path,
+        chunk_size: int = 800,
+        chunk_overlap: int = 200
+    ) -> Iterator[DocumentChunk]:
+        """Потоково отдаёт чанки одного файла (metadata содержит file_hash)"""
+        file_path = Path(file_path)
+        file_hash = None
+        
+        for chunk in self._iter_file(file_path, chunk_size, chunk_overlap):
+            if file_hash is None:
+                file_hash = self.file_fingerprint(file_path)
+            chunk.metadata = {**(chunk.metadata or {}), "file_hash": file_hash}
+            yield chunk
+    
+    def _iter_file(self, file_path: Path, chunk_size: int, chunk_overlap: int) -> Iterator[DocumentChunk]:
         """Загружает один файл в зависимости от расширения"""
         
         suffix = file_path.suffix.lower()
         
         if suffix == ".pdf":
-            return self._load_pdf(file_path, chunk_size, chunk_overlap)
+            return self._iter_pdf(file_path, chunk_size, chunk_overlap)
         elif suffix == ".docx":
-            return self._load_docx(file_path, chunk_size, chunk_overlap)
+            return self._iter_docx(file_path, chunk_size, chunk_overlap)
         elif suffix == ".txt":
-            return self._load_txt(file_path, chunk_size, chunk_overlap)
+            return self._iter_txt(file_path, chunk_size, chunk_overlap)
         else:
             logger.warning(f"Неподдерживаемый формат: {suffix}")
-            return []
+            return iter(())
     
-    def _load_pdf(self, file_path: Path, chunk_size: int, chunk_overlap: int) -> List[DocumentChunk]:
-        """Загружает PDF файл"""
-        chunks = []
+    def _iter_pdf(
+        self,
+        file_path: Path,
+        chunk_size: int,
+        chunk_overlap: int,
+        page_range: Optional[Tuple[int, int]] = None
+    ) -> Iterator[DocumentChunk]:
+        """
+        Загружает PDF файл постранично
         
+        Args:
+            page_range: (первая, последняя) страница включительно, нумерация с 1.
+                        По умолчанию — весь файл
+        """
         with open(file_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
+            total_pages = len(pdf_reader.pages)
+            first_page, last_page = page_range or (1, total_pages)
             
-            for page_num, page in enumerate(pdf_reader.pages, start=1):
-                text = page.extract_text()
+            for page_num in range(first_page, last_page + 1):
+                text = pdf_reader.pages[page_num - 1].extract_text()
                 
                 if text.strip():
-                    # Разбиваем страницу на чанки
-                    page_chunks = self._split_text(text, chunk_size, chunk_overlap)
-                    
-                    for chunk_text in page_chunks:
-                        chunks.append(DocumentChunk(
+                    # Разбиваем страницу на чанки (смещения — внутри страницы)
+                    for chunk_text, start, end in self._iter_split_spans([text], chunk_size, chunk_overlap):
+                        yield DocumentChunk(
                             text=chunk_text,
                             source=str(file_path),
                             page=page_num,
                             metadata={
                                 "file_name": file_path.name,
                                 "file_type": "pdf",
-                                "total_pages": len(pdf_reader.pages)
+                                "total_pages": total_pages,
+                                "start": start,
+                                "end": end
                             }
-                        ))
-        
-        return chunks
+                        )
     
-    def _load_docx(self, file_path: Path, chunk_size: int, chunk_overlap: int) -> List[DocumentChunk]:
+    def _iter_docx(self, file_path: Path, chunk_size: int, chunk_overlap: int) -> Iterator[DocumentChunk]:
         """Загружает DOCX файл"""
-        chunks = []
-        
         doc = Document(file_path)
         
-        # Собираем весь текст
-        full_text = "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
-        
-        # Разбиваем на чанки
-        text_chunks = self._split_text(full_text, chunk_size, chunk_overlap)
+        # Абзацы идут в разбивку потоком, без склейки всего текста в одну строку
+        paragraphs = (para.text for para in doc.paragraphs if para.text.strip())
+        blocks = (
+            text if idx == 0 else "\n" + text
+            for idx, text in enumerate(paragraphs)
+        )
         
-        for chunk_text in text_chunks:
-            chunks.append(DocumentChunk(
+        for chunk_text, start, end in self._iter_split_spans(blocks, chunk_size, chunk_overlap):
+            yield DocumentChunk(
                 text=chunk_text,
                 source=str(file_path),
                 metadata={
                     "file_name": file_path.name,
                     "file_type": "docx",
-                    "total_paragraphs": len(doc.paragraphs)
+                    "total_paragraphs": len(doc.paragraphs),
+                    "start": start,
+                    "end": end
                 }
-            ))
-        
-        return chunks
+            )
     
-    def _load_txt(self, file_path: Path, chunk_size: int, chunk_overlap: int) -> List[DocumentChunk]:
-        """Загружает TXT файл"""
-        chunks = []
-        
+    def _iter_txt(self, file_path: Path, chunk_size: int, chunk_overlap: int) -> Iterator[DocumentChunk]:
+        """Загружает TXT файл блоками"""
         with open(file_path, 'r', encoding='utf-8') as file:
-            text = file.read()
-        
-        # Разбиваем на чанки
-        text_chunks = self._split_text(text, chunk_size, chunk_overlap)
-        
-        for chunk_text in text_chunks:
-            chunks.append(DocumentChunk(
-                text=chunk_text,
-                source=str(file_path),
-                metadata={
-                    "file_name": file_path.name,
-                    "file_type": "txt"
-                }
-            ))
-        
-        return chunks
+            blocks = iter(lambda: file.read(self.TXT_BLOCK_SIZE), "")
+            
+            for chunk_text, start, end in self._iter_split_spans(blocks, chunk_size, chunk_overlap):
+                yield DocumentChunk(
+                    text=chunk_text,
+                    source=str(file_path),
+                    metadata={
+                        "file_name": file_path.name,
+                        "file_type": "txt",
+                        "start": start,
+                        "end": end
+                    }
+                )
     
     def _split_text(self, text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
         """
@@ -171,31 +376,120 @@ class DocumentLoader:
         Returns:
             Список чанков
         """
-        chunks = []
+        return list(self._iter_split_blocks([text], chunk_size, chunk_overlap))
+    
+    def _iter_split_blocks(
+        self,
+        blocks: Iterable[str],
+        chunk_size: int,
+        chunk_overlap: int
+    ) -> Iterator[str]:
+        """
+        Разбивает поток блоков текста на чанки с перекрытием
+        
+        Результат совпадает с разбиением склеенного текста целиком,
+        но в памяти держится только необработанный хвост.
+        
+        Args:
+            blocks: Блоки текста (страница, абзацы, куски файла)
+            chunk_size: Размер чанка в символах
+            chunk_overlap: Перекрытие в символах
+        
+        Yields:
+            Чанки текста
+        """
+        for chunk_text, _, _ in self._iter_split_spans(blocks, chunk_size, chunk_overlap):
+            yield chunk_text
+    
+    def _iter_split_spans(
+        self,
+        blocks: Iterable[str],
+        chunk_size: int,
+        chunk_overlap: int
+    ) -> Iterator[Tuple[str, int, int]]:
+        """
+        То же, что _iter_split_blocks, но вместе с позицией чанка
+        
+        Yields:
+            (текст чанка, начало, конец) — смещения в символах от начала
+            склеенного текста; text == весь_текст[начало:конец]
+        """
+        buffer = ""
+        base = 0  # Смещение начала буфера в склеенном тексте
         start = 0
         
-        while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end]
+        for block in blocks:
+            buffer += block
             
-            # Пытаемся разорвать на границе предложения
-            if end < len(text):
-                # Ищем ближайшую точку
-                last_period = chunk.rfind(". ")
-                if last_period > chunk_size // 2:  # Если точка не слишком далеко
-                    end = start + last_period + 1
-                    chunk = text[start:end]
+            # Пока за концом чанка ещё есть текст, разрыв определяется так же,
+            # как для целого текста
+            while start + chunk_size < len(buffer):
+                end = self._chunk_end(buffer, start, chunk_size)
+                span = self._strip_span(buffer, start, end, base)
+                if span is not None:
+                    yield span
+                
+                # Сдвигаемся с учетом перекрытия
+                start = end - chunk_overlap
             
-            if chunk.strip():
-                chunks.append(chunk.strip())
+            # Отбрасываем уже обработанный текст
+            buffer = buffer[start:]
+            base += start
+            start = 0
+        
+        # Хвост текста
+        while start < len(buffer):
+            end = self._chunk_end(buffer, start, chunk_size)
+            span = self._strip_span(buffer, start, end, base)
+            if span is not None:
+                yield span
             
-            # Сдвигаемся с учетом перекрытия
             start = end - chunk_overlap
             
-            if start >= len(text):
+            if start >= len(buffer):
                 break
+    
+    @staticmethod
+    def _strip_span(buffer: str, start: int, end: int, base: int) -> Optional[Tuple[str, int, int]]:
+        """Чанк без пробелов по краям и его смещения (None, если чанк пустой)"""
+        chunk = buffer[start:end]
+        stripped = chunk.strip()
+        if not stripped:
+            return None
+        
+        chunk_start = base + start + len(chunk) - len(chunk.lstrip())
+        return stripped, chunk_start, chunk_start + len(stripped)
+    
+    @staticmethod
+    def _chunk_end(text: str, start: int, chunk_size: int) -> int:
+        """Конец чанка: по возможности — на границе предложения"""
+        end = start + chunk_size
+        
+        if end < len(text):
+            # Ищем ближайшую точку
+            last_period = text[start:end].rfind(". ")
+            if last_period > chunk_size // 2:  # Если точка не слишком далеко
+                end = start + last_period + 1
         
-        return chunks
+        return end
+
+
+def _count_pdf_pages(file_path: str) -> int:
+    """Число страниц PDF (в процессе-обработчике, см. DocumentLoader._iter_parse_tasks)"""
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def _parse_task(task: Tuple) -> List[DocumentChunk]:
+    """Разбор одной задачи в процессе-обработчике (см. DocumentLoader._iter_parse_tasks)"""
+    file_path, chunk_size, chunk_overlap, page_range, _ = task
+    file_path = Path(file_path)
+    loader = DocumentLoader(knowledge_dir=file_path.parent)
+    
+    if page_range is not None:
+        return list(loader._iter_pdf(file_path, chunk_size, chunk_overlap, page_range))
+    
+    return list(loader._iter_file(file_path, chunk_size, chunk_overlap))
 
 
 # === ТЕСТИРОВАНИЕ ===
@@ -0,0 +1,243 @@
+"""
+Кэши embeddings.
+- EmbeddingCache: дисковый кэш векторов чанков. Ключ — (название модели,
+  хэш нормализованного текста), поэтому неизменившиеся чанки не прогоняются
+  через модель повторно.
+- QueryEmbeddingCache: LRU-кэш векторов поисковых запросов в памяти.
+"""
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Dict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Дисковый кэш векторов на SQLite с ограничением размера (LRU-вытеснение)"""
+
+    def __init__(self, db_path: str = None, max_entries: int = 200_000):
+        """
+        Args:
+            db_path: Путь к файлу кэша (по умолчанию ./data/embedding_cache.db)
+            max_entries: Максимум записей; при превышении вытесняются
+                         давно не использованные
+        """
+        if db_path is None:
+            data_dir = Path(__file__).parent / "data"
+            data_dir.mkdir(parents=True, exist_ok=True)
+            db_path = data_dir / "embedding_cache.db"
+
+        self.db_path = str(db_path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._init_db()
+
+    def _init_db(self):
+        """Создание таблицы кэша"""
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model_name TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Нормализует текст перед хэшированием (пробелы, края строки)"""
+        return re.sub(r"\s+", " ", text).strip()
+
+    @classmethod
+    def make_key(cls, model_name: str, text: str) -> str:
+        """Ключ кэша: sha256 от модели и нормализованного текста"""
+        payload = f"{model_name}\x00{cls.normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Достаёт векторы из кэша
+
+        Args:
+            model_name: Название модели
+            texts: Список текстов
+
+        Returns:
+            Список той же длины: вектор или None (промах)
+        """
+        keys = [self.make_key(model_name, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            # SQLite ограничивает число параметров в запросе
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+        results = [found.get(key) for key in keys]
+        hits = sum(1 for vector in results if vector is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model_name: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """Сохраняет векторы в кэш и при необходимости вытесняет старые записи"""
+        if not texts:
+            return
+
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            array = np.asarray(vector, dtype=np.float32)
+            rows.append((
+                self.make_key(model_name, text),
+                model_name,
+                int(array.shape[0]),
+                array.tobytes(),
+                now
+            ))
+
+        with self._lock:
+            self._conn.executemany("""
+                INSERT OR REPLACE INTO embeddings (key, model_name, dim, vector, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Удаляет самые давно использованные записи сверх лимита"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+
+        self._conn.execute("""
+            DELETE FROM embeddings WHERE key IN (
+                SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?
+            )
+        """, (overflow,))
+        self.evictions += overflow
+        logger.info(f"🧹 Вытеснено {overflow} записей из кэша embeddings")
+
+    def get_stats(self) -> Dict:
+        """Статистика кэша: попадания, промахи, размер"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'evictions': self.evictions,
+            'size': size,
+            'max_entries': self.max_entries
+        }
+
+    def clear(self) -> None:
+        """Полностью очищает кэш"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+        logger.info("✅ Кэш embeddings очищен")
+
+    def close(self) -> None:
+        """Закрывает соединение с БД кэша"""
+        with self._lock:
+            self._conn.close()
+
+
+class QueryEmbeddingCache:
+    """Ограниченный LRU-кэш векторов запросов в памяти (с опциональным TTL)"""
+
+    def __init__(self, max_size: int = 256, ttl_seconds: Optional[float] = None):
+        """
+        Args:
+            max_size: Максимум запросов в кэше
+            ttl_seconds: Время жизни записи в секундах (None — без ограничения)
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, query: str) -> Optional[List[float]]:
+        """Возвращает вектор запроса или None (промах или запись устарела)"""
+        with self._lock:
+            item = self._items.get(query)
+
+            if item is not None:
+                vector, created_at = item
+                if self.ttl_seconds is not None and time.monotonic() - created_at > self.ttl_seconds:
+                    del self._items[query]
+                    item = None
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(query)
+            self.hits += 1
+            return vector
+
+    def put(self, query: str, vector: List[float]) -> None:
+        """Сохраняет вектор запроса, вытесняя самый старый при переполнении"""
+        with self._lock:
+            self._items[query] = (vector, time.monotonic())
+            self._items.move_to_end(query)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        """Статистика кэша: попадания, промахи, доля попаданий"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'size': len(self._items),
+            'max_size': self.max_size
+        }
+
+    def clear(self) -> None:
+        """Очищает кэш"""
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,197 @@
+"""
+Динамическое микробатчирование embeddings запросов.
+
+Когда несколько сотрудников спрашивают одновременно, каждый embed_text
+запускает отдельный прогон модели с батчем из одного текста. Диспетчер
+собирает параллельные запросы в течение max_wait_ms (или до max_batch
+штук), кодирует их одним батчем и раздаёт результаты через Future.
+
+Метрики (размер батча, ожидание в очереди, время кодирования) помогают
+подобрать max_batch / max_wait_ms: больше ожидание — крупнее батчи и
+выше пропускная способность, но дольше ответ при низкой нагрузке.
+"""
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Dict
+
+from .embeddings import EmbeddingModel
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingDispatcher:
+    """Фоновый поток, объединяющий одновременные запросы в батчи"""
+
+    # Сколько последних батчей учитывать в перцентилях
+    METRICS_WINDOW = 1000
+
+    def __init__(self, embedder: EmbeddingModel, max_batch: int = 16, max_wait_ms: float = 5.0):
+        """
+        Args:
+            embedder: Модель embeddings
+            max_batch: Максимальный размер батча
+            max_wait_ms: Сколько ждать попутных запросов после первого
+        """
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=self.METRICS_WINDOW)
+        self._queue_waits_ms = deque(maxlen=self.METRICS_WINDOW)
+        self._encode_ms = deque(maxlen=self.METRICS_WINDOW)
+        self._requests = 0
+        self._batches = 0
+
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="embedding-dispatcher", daemon=True)
+        self._thread.start()
+
+        logger.info(f"✅ Диспетчер embeddings запущен (батч до {max_batch}, ожидание {max_wait_ms} мс)")
+
+    def submit(self, text: str) -> Future:
+        """Ставит текст в очередь и возвращает Future с вектором"""
+        if self._closed:
+            raise RuntimeError("Диспетчер embeddings остановлен")
+
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """Вектор одного текста (блокирует до готовности батча)"""
+        return self.submit(text).result()
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Векторы нескольких текстов — попадают в тот же батч, что и чужие запросы"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def _collect(self) -> List:
+        """Ждёт первый запрос, затем добирает попутные до max_batch или max_wait_ms"""
+        first = self._queue.get()
+        if first is None:
+            return []
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Остановка: дообработаем собранное, поток завершится на следующем круге
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _run(self) -> None:
+        """Цикл фонового потока"""
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+
+            # Отменённые ожидания не кодируем
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+
+            try:
+                vectors = self.embedder.embed_texts(
+                    texts,
+                    batch_size=len(texts),
+                    show_progress=False,
+                    use_cache=False
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка кодирования батча запросов: {e}", exc_info=True)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            encode_ms = (time.perf_counter() - started) * 1000
+
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+            with self._stats_lock:
+                self._requests += len(batch)
+                self._batches += 1
+                self._batch_sizes.append(len(batch))
+                self._encode_ms.append(encode_ms)
+                self._queue_waits_ms.extend((started - enqueued) * 1000 for _, _, enqueued in batch)
+
+    @staticmethod
+    def _percentile(values: List[float], percent: float) -> float:
+        """Перцентиль по отсортированному списку"""
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def get_stats(self) -> Dict:
+        """Метрики батчирования (перцентили — по последним METRICS_WINDOW значениям)"""
+        with self._stats_lock:
+            sizes = list(self._batch_sizes)
+            waits = list(self._queue_waits_ms)
+            encodes = list(self._encode_ms)
+            requests, batches = self._requests, self._batches
+
+        return {
+            'requests': requests,
+            'batches': batches,
+            'avg_batch_size': round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+            'max_batch_size': max(sizes) if sizes else 0,
+            'queue_wait_p50_ms': round(self._percentile(waits, 50), 2),
+            'queue_wait_p95_ms': round(self._percentile(waits, 95), 2),
+            'encode_p50_ms': round(self._percentile(encodes, 50), 2),
+            'encode_p95_ms': round(self._percentile(encodes, 95), 2),
+            'queue_size': self._queue.qsize(),
+        }
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Останавливает поток после обработки уже поставленных запросов"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+        logger.info("Диспетчер embeddings остановлен")
+
+
+# === ТЕСТИРОВАНИЕ ===
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    logging.basicConfig(level=logging.INFO)
+
+    dispatcher = EmbeddingDispatcher(EmbeddingModel(use_cache=False), max_batch=16, max_wait_ms=5)
+
+    questions = [f"Какие документы нужны для поступления, вариант {i}?" for i in range(64)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        vectors = list(pool.map(dispatcher.embed, questions))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n⚡ {len(vectors)} запросов за {elapsed:.2f} с")
+    print(f"📊 Метрики: {dispatcher.get_stats()}")
+
+    dispatcher.close()
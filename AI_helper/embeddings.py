@@ -1,10 +1,14 @@
 """
 Модуль для создания embeddings (векторных представлений) текста.
 Использует sentence-transformers для русского языка.
+Опционально — квантованную ONNX-модель (EMBEDDING_BACKEND=onnx,
+зависимости: pip install -r requirements-onnx.txt).
 """
+import os
 import logging
-from typing import List
-from sentence_transformers import SentenceTransformer
+from typing import List, Optional
+
+from .embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
@@ -12,17 +16,48 @@ logger = logging.getLogger(__name__)
 class EmbeddingModel:
     """Класс для создания embeddings текста"""
     
-    def __init__(self, model_name: str = "intfloat/multilingual-e5-large"):
+    def __init__(
+        self,
+        model_name: str = "intfloat/multilingual-e5-large",
+        cache: Optional[EmbeddingCache] = None,
+        use_cache: bool = True,
+        backend: str = None
+    ):
         """
         Args:
             model_name: Название модели из HuggingFace
                        Варианты:
                        - "intfloat/multilingual-e5-large" (рекомендуется, 560MB)
                        - "sentence-transformers/paraphrase-multilingual-mpnet-base-v2" (легче, 278MB)
+            cache: Дисковый кэш embeddings (по умолчанию создаётся ./data/embedding_cache.db)
+            use_cache: Использовать ли кэш в embed_texts
+            backend: "torch" (SentenceTransformer) или "onnx" (onnxruntime, int8).
+                     По умолчанию берётся из переменной окружения EMBEDDING_BACKEND
         """
-        logger.info(f"Загрузка модели embeddings: {model_name}")
-        self.model = SentenceTransformer(model_name)
-        logger.info(f"✅ Модель загружена. Размерность: {self.model.get_sentence_embedding_dimension()}")
+        self.model_name = model_name
+        self.backend = (backend or os.getenv("EMBEDDING_BACKEND", "torch")).lower()
+        
+        logger.info(f"Загрузка модели embeddings: {model_name} (бэкенд: {self.backend})")
+        
+        if self.backend == "torch":
+            # Импорт здесь: в режиме onnx torch и transformers-модель не загружаются
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(model_name)
+            self.onnx = None
+            # Векторы разных бэкендов чуть отличаются, поэтому кэшируем их раздельно
+            self.cache_namespace = model_name
+        elif self.backend == "onnx":
+            from .onnx_embeddings import OnnxEmbeddingBackend
+            self.model = None
+            self.onnx = OnnxEmbeddingBackend(model_name)
+            self.cache_namespace = f"{model_name}@onnx-int8"
+        else:
+            raise ValueError(f"Неизвестный бэкенд embeddings: {self.backend}")
+        
+        if cache is None and use_cache:
+            cache = EmbeddingCache()
+        self.cache = cache
+        logger.info(f"✅ Модель загружена. Размерность: {self.get_dimension()}")
     
     def embed_text(self, text: str) -> List[float]:
         """
@@ -34,35 +69,81 @@ class EmbeddingModel:
         Returns:
             Список float (вектор)
         """
+        if self.onnx is not None:
+            return self.onnx.encode([text])[0].tolist()
+        
         embedding = self.model.encode(text, convert_to_numpy=True)
         return embedding.tolist()
     
-    def embed_texts(self, texts: List[str], batch_size: int = 32, show_progress: bool = True) -> List[List[float]]:
+    def embed_texts(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        show_progress: bool = True,
+        use_cache: bool = True
+    ) -> List[List[float]]:
         """
-        Создаёт embeddings для списка текстов (батчами для скорости)
+        Создаёт embeddings для списка текстов (батчами для скорости).
+        Тексты, которые уже есть в кэше, через модель не прогоняются.
         
         Args:
             texts: Список текстов
             batch_size: Размер батча
             show_progress: Показывать прогресс-бар
+            use_cache: Использовать дисковый кэш (для запросов не нужен —
+                       у VectorStore свой LRU-кэш в памяти)
         
         Returns:
             Список векторов
         """
         logger.info(f"Создание embeddings для {len(texts)} текстов...")
         
+        if self.cache is None or not use_cache:
+            embeddings = self._encode(texts, batch_size, show_progress)
+            logger.info(f"✅ Создано {len(embeddings)} embeddings")
+            return embeddings
+        
+        embeddings = self.cache.get_many(self.cache_namespace, texts)
+        missing_idx = [i for i, vector in enumerate(embeddings) if vector is None]
+        
+        if missing_idx:
+            missing_texts = [texts[i] for i in missing_idx]
+            new_embeddings = self._encode(missing_texts, batch_size, show_progress)
+            self.cache.put_many(self.cache_namespace, missing_texts, new_embeddings)
+            
+            for i, vector in zip(missing_idx, new_embeddings):
+                embeddings[i] = vector
+        
+        logger.info(
+            f"✅ Создано {len(embeddings)} embeddings "
+            f"(из кэша: {len(texts) - len(missing_idx)}, вычислено: {len(missing_idx)})"
+        )
+        return embeddings
+    
+    def _encode(self, texts: List[str], batch_size: int, show_progress: bool) -> List[List[float]]:
+        """Прогоняет тексты через модель"""
+        if not texts:
+            return []
+        
+        if self.onnx is not None:
+            return self.onnx.encode(texts, batch_size=batch_size).tolist()
+        
         embeddings = self.model.encode(
             texts,
             batch_size=batch_size,
             show_progress_bar=show_progress,
             convert_to_numpy=True
         )
-        
-        logger.info(f"✅ Создано {len(embeddings)} embeddings")
         return embeddings.tolist()
     
+    def get_cache_stats(self) -> Optional[dict]:
+        """Статистика дискового кэша (None, если кэш отключён)"""
+        return self.cache.get_stats() if self.cache else None
+    
     def get_dimension(self) -> int:
         """Возвращает размерность вектора"""
+        if self.onnx is not None:
+            return self.onnx.get_dimension()
         return self.model.get_sentence_embedding_dimension()
 
 
@@ -85,4 +166,5 @@ if __name__ == "__main__":
     
     print(f"\n📊 Размерность векторов: {embedder.get_dimension()}")
     print(f"📝 Создано {len(embeddings)} embeddings")
-    print(f"📄 Пример вектора (первые 10 чисел): {embeddings[0][:10]}")
\ No newline at end of file
+    print(f"📄 Пример вектора (первые 10 чисел): {embeddings[0][:10]}")
+    print(f"💾 Кэш: {embedder.get_cache_stats()}")
\ No newline at end of file
@@ -0,0 +1,351 @@
+"""
+Плоский векторный индекс на NumPy — лёгкая альтернатива ChromaDB.
+
+Для базы в несколько тысяч чанков полный перебор одной матричной
+операцией быстрее и проще, чем SQLite + HNSW:
+- нормализованные embeddings хранятся в float16-матрице .npy,
+  которая открывается через memory map (страницы подгружаются ОС по требованию)
+- тексты и метаданные лежат рядом в JSONL
+- поиск: одно скалярное произведение + argpartition
+
+FlatClient / FlatCollection повторяют ту часть API ChromaDB, которую
+использует VectorStore, поэтому бэкенд выбирается одним параметром.
+
+Формат distances совпадает с ChromaDB (квадрат L2-расстояния), поэтому
+score = 1 - distance в VectorStore не меняется. Для нормализованных
+векторов distance = 2 - 2 * cos.
+
+Файлы версионируются (embeddings-<N>.npy, records-<N>.jsonl + manifest.json):
+новая версия записывается рядом, а читающий процесс (бот) переключается
+на неё при следующем запросе. Это работает и в Windows, где открытый
+через mmap файл нельзя перезаписать.
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FlatCollection:
+    """Коллекция векторов в memory-mapped .npy с метаданными в JSONL"""
+
+    # Сколько строк матрицы приводить к float32 за раз при поиске
+    QUERY_BLOCK_ROWS = 8192
+
+    def __init__(self, name: str, directory: Path):
+        """
+        Args:
+            name: Название коллекции
+            directory: Папка коллекции
+        """
+        self.name = name
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._version = 0
+        self._manifest_mtime = None
+        self._dirty = False
+
+        self._ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._texts: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._matrix: Optional[np.ndarray] = None
+        # Буфер с запасом строк при добавлении; _matrix — его заполненная часть
+        self._buffer: Optional[np.ndarray] = None
+
+        self._load()
+
+    # === Чтение с диска ===
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.directory / "manifest.json"
+
+    def _load(self) -> None:
+        """Загружает текущую версию коллекции (матрица — через mmap)"""
+        with self._lock:
+            if not self._manifest_path.exists():
+                return
+
+            with open(self._manifest_path, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+
+            version = manifest["version"]
+            matrix_path = self.directory / f"embeddings-{version}.npy"
+            records_path = self.directory / f"records-{version}.jsonl"
+
+            ids, texts, metadatas = [], [], []
+            with open(records_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    record = json.loads(line)
+                    ids.append(record["id"])
+                    texts.append(record["text"])
+                    metadatas.append(record["metadata"])
+
+            self._ids = ids
+            self._texts = texts
+            self._metadatas = metadatas
+            self._index = {doc_id: i for i, doc_id in enumerate(ids)}
+            self._matrix = np.load(matrix_path, mmap_mode="r") if ids else None
+            self._buffer = None
+            self._version = version
+            self._manifest_mtime = self._manifest_path.stat().st_mtime
+            self._dirty = False
+
+    def reload_if_changed(self) -> bool:
+        """Переключается на новую версию, если её записал другой процесс"""
+        if self._dirty or not self._manifest_path.exists():
+            return False
+
+        if self._manifest_path.stat().st_mtime == self._manifest_mtime:
+            return False
+
+        self._load()
+        logger.info(f"🔄 Плоский индекс '{self.name}' перезагружен ({len(self._ids)} документов)")
+        return True
+
+    # === Запись ===
+
+    def persist(self) -> None:
+        """Записывает накопленные изменения новой версией файлов"""
+        with self._lock:
+            if not self._dirty:
+                return
+
+            version = self._version + 1
+            matrix_path = self.directory / f"embeddings-{version}.npy"
+            records_path = self.directory / f"records-{version}.jsonl"
+
+            matrix = self._matrix if self._matrix is not None else np.zeros((0, 0), dtype=np.float16)
+            np.save(matrix_path, np.ascontiguousarray(matrix, dtype=np.float16))
+
+            with open(records_path, "w", encoding="utf-8") as file:
+                for doc_id, text, metadata in zip(self._ids, self._texts, self._metadatas):
+                    file.write(json.dumps({"id": doc_id, "text": text, "metadata": metadata}, ensure_ascii=False))
+                    file.write("\n")
+
+            tmp_manifest = self._manifest_path.with_suffix(".tmp")
+            with open(tmp_manifest, "w", encoding="utf-8") as file:
+                json.dump({"version": version, "count": len(self._ids)}, file)
+            os.replace(tmp_manifest, self._manifest_path)
+
+            old_version = self._version
+            self._load()
+            self._remove_version(old_version)
+
+    def _remove_version(self, version: int) -> None:
+        """Удаляет файлы старой версии (если их ещё держит другой процесс — оставляем)"""
+        for path in (
+            self.directory / f"embeddings-{version}.npy",
+            self.directory / f"records-{version}.jsonl",
+        ):
+            try:
+                path.unlink()
+            except (FileNotFoundError, PermissionError):
+                pass
+
+    def _writable_matrix(self) -> Optional[np.ndarray]:
+        """Переводит матрицу из read-only mmap в обычный массив перед изменением"""
+        if isinstance(self._matrix, np.memmap):
+            self._matrix = np.array(self._matrix, dtype=np.float16)
+            self._buffer = self._matrix
+        return self._matrix
+
+    def _append_rows(self, rows: np.ndarray) -> None:
+        """
+        Дописывает строки в конец матрицы
+
+        Ёмкость буфера растёт вдвое, поэтому потоковая загрузка батчами
+        копирует матрицу O(log n) раз, а не на каждом батче.
+        """
+        count = 0 if self._matrix is None else len(self._matrix)
+        needed = count + len(rows)
+
+        buffer = self._buffer
+        if buffer is None or len(buffer) < needed or buffer.shape[1] != rows.shape[1]:
+            buffer = np.empty((max(needed, 2 * count), rows.shape[1]), dtype=np.float16)
+            if count:
+                buffer[:count] = self._matrix
+            self._buffer = buffer
+
+        buffer[count:needed] = rows
+        self._matrix = buffer[:needed]
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        """L2-нормализация строк"""
+        array = np.asarray(vectors, dtype=np.float32)
+        if array.ndim == 1:
+            array = array[None, :]
+        norms = np.linalg.norm(array, axis=1, keepdims=True)
+        return array / np.clip(norms, 1e-12, None)
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict]) -> None:
+        """Добавляет или заменяет записи"""
+        vectors = self._normalize(embeddings).astype(np.float16)
+
+        with self._lock:
+            matrix = self._writable_matrix()
+            new_rows = []
+
+            for doc_id, vector, text, metadata in zip(ids, vectors, documents, metadatas):
+                row = self._index.get(doc_id)
+                if row is not None:
+                    matrix[row] = vector
+                    self._texts[row] = text
+                    self._metadatas[row] = dict(metadata or {})
+                else:
+                    self._index[doc_id] = len(self._ids)
+                    self._ids.append(doc_id)
+                    self._texts.append(text)
+                    self._metadatas.append(dict(metadata or {}))
+                    new_rows.append(vector)
+
+            if new_rows:
+                self._append_rows(np.stack(new_rows))
+
+            self._dirty = True
+
+    add = upsert
+
+    def update(self, ids: List[str], metadatas: List[Dict] = None, **kwargs) -> None:
+        """Обновляет метаданные существующих записей"""
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas or []):
+                row = self._index.get(doc_id)
+                if row is not None:
+                    self._metadatas[row] = dict(metadata or {})
+            self._dirty = True
+
+    def delete(self, ids: List[str] = None, **kwargs) -> None:
+        """Удаляет записи по ID"""
+        with self._lock:
+            rows = {self._index[doc_id] for doc_id in ids or [] if doc_id in self._index}
+            if not rows:
+                return
+
+            keep = [i for i in range(len(self._ids)) if i not in rows]
+            matrix = self._writable_matrix()
+
+            self._ids = [self._ids[i] for i in keep]
+            self._texts = [self._texts[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._index = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            self._matrix = matrix[keep] if keep else None
+            self._buffer = self._matrix
+            self._dirty = True
+
+    # === Чтение ===
+
+    def count(self) -> int:
+        """Количество записей"""
+        self.reload_if_changed()
+        return len(self._ids)
+
+    def get(
+        self,
+        ids: List[str] = None,
+        include: List[str] = None,
+        limit: int = None,
+        offset: int = None,
+        **kwargs
+    ) -> Dict:
+        """Возвращает записи по ID или постранично (формат ChromaDB)"""
+        self.reload_if_changed()
+        include = include or ["documents", "metadatas"]
+
+        with self._lock:
+            if ids is not None:
+                rows = [self._index[doc_id] for doc_id in ids if doc_id in self._index]
+            else:
+                start = offset or 0
+                end = len(self._ids) if limit is None else start + limit
+                rows = list(range(start, min(end, len(self._ids))))
+
+            result = {"ids": [self._ids[i] for i in rows]}
+            if "documents" in include:
+                result["documents"] = [self._texts[i] for i in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [self._metadatas[i] for i in rows]
+            if "embeddings" in include:
+                result["embeddings"] = [self._matrix[i].astype(np.float32).tolist() for i in rows]
+
+        return result
+
+    def query(self, query_embeddings, n_results: int = 10, include: List[str] = None, **kwargs) -> Dict:
+        """
+        Полный перебор: скалярное произведение со всей матрицей + argpartition
+
+        Returns:
+            Словарь в формате ChromaDB (списки по каждому запросу)
+        """
+        self.reload_if_changed()
+        queries = self._normalize(query_embeddings)
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        with self._lock:
+            total = len(self._ids)
+
+            if total == 0:
+                for _ in range(len(queries)):
+                    for key in result:
+                        result[key].append([])
+                return result
+
+            # Матрица в float16 — считаем блоками, приводя к float32
+            sims = np.empty((len(queries), total), dtype=np.float32)
+            for start in range(0, total, self.QUERY_BLOCK_ROWS):
+                block = np.asarray(self._matrix[start:start + self.QUERY_BLOCK_ROWS], dtype=np.float32)
+                sims[:, start:start + len(block)] = queries @ block.T
+
+            k = min(n_results, total)
+
+            for row_sims in sims:
+                top = np.argpartition(-row_sims, k - 1)[:k] if k < total else np.arange(total)
+                top = top[np.argsort(-row_sims[top])]
+
+                result["ids"].append([self._ids[i] for i in top])
+                result["documents"].append([self._texts[i] for i in top])
+                result["metadatas"].append([self._metadatas[i] for i in top])
+                result["distances"].append([float(2 - 2 * row_sims[i]) for i in top])
+
+        return result
+
+
+class FlatClient:
+    """Клиент плоских коллекций (совместим с используемой частью chromadb.PersistentClient)"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Папка для хранения коллекций
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _collection_dir(self, name: str) -> Path:
+        return self.path / f"{name}.flat"
+
+    def get_collection(self, name: str) -> FlatCollection:
+        """Открывает существующую коллекцию"""
+        directory = self._collection_dir(name)
+        if not directory.exists():
+            raise ValueError(f"Коллекция {name} не существует")
+        return FlatCollection(name, directory)
+
+    def create_collection(self, name: str) -> FlatCollection:
+        """Создаёт новую коллекцию"""
+        return FlatCollection(name, self._collection_dir(name))
+
+    def delete_collection(self, name: str) -> None:
+        """Удаляет коллекцию с диска"""
+        shutil.rmtree(self._collection_dir(name), ignore_errors=True)
@@ -0,0 +1,251 @@
+"""
+Сжатие истории диалога.
+
+Раньше в промпт каждый раз уходили последние 6 сообщений целиком (включая
+многоабзацные ответы ассистента), а в FSM хранилось до 10 сообщений на
+пользователя — промпт рос с каждым вопросом, а хранилище с каждым диалогом.
+
+HistoryManager держит дословно только последние recent_turns пар
+«вопрос — ответ». Более старые пары сворачиваются в короткие факты
+(вопрос + суть ответа), а факты урезаются по бюджету токенов — так размер
+истории в промпте и в FSM не зависит от длины диалога.
+
+Сжатие извлекающее (без обращения к LLM): из ответа берётся строка
+«Ответ:» из структуры SYSTEM_PROMPT или первые предложения.
+"""
+import re
+import logging
+from typing import List, Dict, Optional, Tuple
+
+from .context_builder import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+ROLE_NAMES = {'user': "Пользователь", 'assistant': "Ассистент"}
+
+
+class HistoryManager:
+    """Последние реплики дословно, старые — сжатыми фактами"""
+
+    # Разметка, которую модель ставит в ответах (Markdown / HTML)
+    MARKUP_RE = re.compile(r"</?[a-zA-Z][^>]*>|[*_#`>]+")
+    SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+    def __init__(
+        self,
+        max_tokens: int = 1000,
+        recent_turns: int = 2,
+        fact_chars: int = 240,
+        counter: TokenCounter = None
+    ):
+        """
+        Args:
+            max_tokens: Бюджет токенов на всю историю в промпте
+            recent_turns: Сколько последних пар «вопрос — ответ» хранить дословно
+            fact_chars: Максимальная длина одного сжатого факта в символах
+            counter: Счётчик токенов (по умолчанию tiktoken cl100k_base)
+        """
+        self.max_tokens = max_tokens
+        self.recent_turns = recent_turns
+        self.fact_chars = fact_chars
+        self.counter = counter or TokenCounter()
+
+    # === Сжатие ===
+
+    def _clean(self, text: str) -> str:
+        """Убирает разметку и лишние пробелы"""
+        return " ".join(self.MARKUP_RE.sub(" ", text).split())
+
+    def _shorten(self, text: str, limit: int) -> str:
+        """Целые предложения, пока помещаются в limit символов"""
+        text = self._clean(text)
+        if len(text) <= limit:
+            return text
+
+        result = ""
+        for sentence in self.SENTENCE_END_RE.split(text):
+            candidate = f"{result} {sentence}".strip()
+            if len(candidate) > limit:
+                break
+            result = candidate
+
+        # Даже первое предложение длиннее лимита — режем по словам
+        if not result:
+            result = text[:limit].rsplit(" ", 1)[0]
+        return result + "…"
+
+    def _shorten_to_tokens(self, text: str, max_tokens: int, min_chars: int = 0) -> str:
+        """Самый длинный _shorten(text), помещающийся в max_tokens (не короче min_chars)"""
+        if self.counter.count(text) <= max_tokens:
+            return text
+
+        low, high = min_chars, len(self._clean(text))
+        best = min_chars
+        while low <= high:
+            middle = (low + high) // 2
+            if self.counter.count(self._shorten(text, middle)) <= max_tokens:
+                best, low = middle, middle + 1
+            else:
+                high = middle - 1
+        return self._shorten(text, best)
+
+    def _key_answer(self, answer: str) -> str:
+        """Суть ответа: строка «Ответ:» или начало текста"""
+        for line in answer.splitlines():
+            cleaned = self._clean(line)
+            if cleaned.lower().startswith(("ответ:", "решение:")):
+                return cleaned.split(":", 1)[1].strip() or cleaned
+        return answer
+
+    def summarize_turn(self, question: str, answer: str) -> str:
+        """Сворачивает пару «вопрос — ответ» в один короткий факт"""
+        question_part = self._shorten(question, self.fact_chars // 3)
+        answer_part = self._shorten(self._key_answer(answer), self.fact_chars - len(question_part))
+        return f"{question_part} → {answer_part}"
+
+    # === Хранение ===
+
+    def _collapse_oldest(self, history: List[Dict], facts: List[str]) -> None:
+        """Переносит самую старую пару из дословной истории в факты (на месте)"""
+        question = history.pop(0)['content'] if history and history[0]['role'] == 'user' else ""
+        answer = history.pop(0)['content'] if history and history[0]['role'] == 'assistant' else ""
+        if question or answer:
+            facts.append(self.summarize_turn(question, answer))
+
+    def _render_facts(self, facts: List[str]) -> str:
+        return "Ранее в диалоге:\n" + "\n".join(f"- {fact}" for fact in facts) + "\n"
+
+    @staticmethod
+    def _render_turns(history: List[Dict]) -> str:
+        return "".join(
+            f"{ROLE_NAMES.get(msg['role'], msg['role'])}: {msg['content']}\n"
+            for msg in history
+        )
+
+    def _trim_facts(self, facts: List[str], budget: int) -> List[str]:
+        """Оставляет самые свежие факты, помещающиеся в budget токенов"""
+        kept, used = [], self.counter.count(self._render_facts([]))
+        for fact in reversed(facts):
+            tokens = self.counter.count(fact) + 2
+            if used + tokens > budget:
+                break
+            kept.append(fact)
+            used += tokens
+        return list(reversed(kept))
+
+    def add_turn(
+        self,
+        history: List[Dict],
+        facts: List[str],
+        question: str,
+        answer: str
+    ) -> Tuple[List[Dict], List[str]]:
+        """
+        Добавляет пару «вопрос — ответ» и сжимает то, что вышло за окно
+
+        Args:
+            history: Дословные сообщения [{'role', 'content'}, ...] (из FSM)
+            facts: Сжатые факты о более ранних репликах (из FSM)
+            question: Вопрос пользователя
+            answer: Ответ ассистента
+
+        Returns:
+            (history, facts) — новые значения для FSM
+        """
+        history = list(history) + [
+            {'role': 'user', 'content': question},
+            {'role': 'assistant', 'content': answer}
+        ]
+        facts = list(facts)
+
+        while len(history) > self.recent_turns * 2:
+            self._collapse_oldest(history, facts)
+
+        # Дословная часть в приоритете, факты — в оставшийся бюджет
+        recent_tokens = self.counter.count(self._render_turns(history))
+        facts = self._trim_facts(facts, max(self.max_tokens - recent_tokens, self.max_tokens // 4))
+
+        return history, facts
+
+    def render(self, history: List[Dict], facts: List[str]) -> Optional[str]:
+        """
+        Текст истории для промпта в пределах max_tokens
+
+        Если последние реплики целиком не помещаются, самые старые из них
+        тоже сворачиваются в факты. Если не помещается и последняя пара,
+        реплики укорачиваются по предложениям (сначала вопрос, но не короче
+        сжатого факта, затем ответ). В конце отбрасываются самые старые факты.
+        Результат всегда укладывается в max_tokens целыми репликами с метками
+        ролей — обрезать его по строкам дальше не нужно.
+
+        Returns:
+            Текст «ИСТОРИЯ ДИАЛОГА: ...» или None, если истории нет
+        """
+        if not history and not facts:
+            return None
+
+        history, facts = [dict(msg) for msg in history], list(facts)
+        header = "ИСТОРИЯ ДИАЛОГА:\n"
+
+        while True:
+            recent = self._render_turns(history)
+            recent_tokens = self.counter.count(header + recent)
+            if recent_tokens <= self.max_tokens or len(history) <= 2:
+                break
+            self._collapse_oldest(history, facts)
+
+        # Последняя пара сама длиннее бюджета (обычно длинный ответ) —
+        # укорачиваем реплики от старой к новой: сначала не короче факта,
+        # затем, если бюджет совсем мал, сколько потребуется
+        for min_chars in (self.fact_chars, 0):
+            for msg in history:
+                overflow = recent_tokens - self.max_tokens
+                if overflow <= 0:
+                    break
+                msg_tokens = self.counter.count(msg['content'])
+                msg['content'] = self._shorten_to_tokens(msg['content'], msg_tokens - overflow, min_chars)
+                recent = self._render_turns(history)
+                recent_tokens = self.counter.count(header + recent)
+
+        facts = self._trim_facts(facts, self.max_tokens - recent_tokens)
+        text = header + (self._render_facts(facts) if facts else "") + recent
+
+        # Оценка _trim_facts приблизительна — досчитываем по готовому тексту
+        while facts and self.counter.count(text) > self.max_tokens:
+            facts.pop(0)
+            text = header + (self._render_facts(facts) if facts else "") + recent
+
+        logger.debug(
+            f"🗂 История: {len(history)} реплик дословно, {len(facts)} фактов, "
+            f"~{self.counter.count(text)} токенов"
+        )
+        return text
+
+
+# === ТЕСТИРОВАНИЕ ===
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    manager = HistoryManager(max_tokens=600, recent_turns=2)
+
+    history, facts = [], []
+    for i in range(1, 11):
+        answer = (
+            f"**Ответ:** Документы по вопросу {i} подаются до 25 июля, это указано в п. 5.{i}. "
+            "Список включает паспорт, аттестат и фотографии.\n\n"
+            + "**Детали:** подробное пояснение к ответу. " * 15
+        )
+        history, facts = manager.add_turn(history, facts, f"Вопрос номер {i} про документы?", answer)
+        text = manager.render(history, facts)
+        print(f"Шаг {i}: {len(history)} реплик, {len(facts)} фактов, ~{manager.counter.count(text)} токенов")
+
+    print("\n" + text)
+
+    # Последний ответ сам длиннее бюджета — история всё равно укладывается
+    long_answer = "**Ответ:** Общежитие предоставляется иногородним студентам. " + (
+        "Заселение проходит по графику, который публикуется на сайте. " * 120
+    )
+    history, facts = manager.add_turn(history, facts, "Дают ли общежитие?", long_answer)
+    text = manager.render(history, facts)
+    print(f"\nДлинный ответ: ~{manager.counter.count(text)} токенов из {manager.max_tokens}")
+    print(text[:300] + "…")
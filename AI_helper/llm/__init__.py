@@ -1,11 +1,16 @@
 """
 LLM модели для AI-помощника.
 """
-from .base import BaseLLM, Message
+from .base import BaseLLM, Message, LLMError, LLMUnavailableError
 from .yandex_gpt import YandexGPT
+from .resilience import ResilientLLM, CircuitBreaker
 
 __all__ = [
     'BaseLLM',
     'Message',
+    'LLMError',
+    'LLMUnavailableError',
     'YandexGPT',
+    'ResilientLLM',
+    'CircuitBreaker',
 ]
\ No newline at end of file
@@ -2,8 +2,10 @@
 Базовый абстрактный класс для LLM.
 Позволяет легко менять модели (YandexGPT → OpenAI → Claude и т.д.)
 """
+import asyncio
+import functools
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, AsyncIterator
 from dataclasses import dataclass
 
 
@@ -14,6 +16,38 @@ class Message:
     content: str
 
 
+class LLMError(Exception):
+    """Ошибка обращения к LLM"""
+    
+    def __init__(
+        self,
+        message: str,
+        status: Optional[int] = None,
+        retryable: bool = False,
+        retry_after: Optional[float] = None
+    ):
+        """
+        Args:
+            message: Описание ошибки
+            status: HTTP-код ответа (None — сетевая ошибка или таймаут)
+            retryable: Имеет ли смысл повторить запрос (429, 5xx, сеть)
+            retry_after: Рекомендованная пауза перед повтором (заголовок Retry-After)
+        """
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class LLMUnavailableError(LLMError):
+    """LLM временно недоступна: повторы исчерпаны или разомкнут circuit breaker"""
+    
+    USER_MESSAGE = (
+        "⏳ Сервис генерации ответов сейчас перегружен или недоступен. "
+        "Попробуйте задать вопрос через минуту."
+    )
+
+
 class BaseLLM(ABC):
     """Базовый класс для всех LLM"""
     
@@ -37,6 +71,65 @@ class BaseLLM(ABC):
         """
         pass
     
+    def generate_stream(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> Iterator[str]:
+        """
+        Генерирует ответ по частям
+        
+        Каждое значение — весь текст, сгенерированный к этому моменту
+        (а не только новый фрагмент). По умолчанию модель без потокового
+        API отдаёт готовый ответ одним куском.
+        
+        Args:
+            messages: История диалога
+            temperature: Креативность
+            max_tokens: Максимум токенов в ответе
+            
+        Yields:
+            Накопленный текст ответа
+        """
+        yield self.generate(messages, temperature, max_tokens)
+    
+    async def agenerate(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> str:
+        """
+        Асинхронная генерация для обработчиков бота
+        
+        По умолчанию синхронный generate выполняется в пуле потоков;
+        модели с асинхронным клиентом переопределяют метод.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(self.generate, messages, temperature, max_tokens)
+        )
+    
+    async def agenerate_stream(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> AsyncIterator[str]:
+        """
+        Асинхронная потоковая генерация (по умолчанию — один кусок из agenerate)
+        
+        Yields:
+            Накопленный текст ответа
+        """
+        yield await self.agenerate(messages, temperature, max_tokens)
+    
+    async def aclose(self) -> None:
+        """Освобождает сетевые ресурсы (сессии, пулы соединений)"""
+        pass
+    
     @abstractmethod
     def generate_with_context(
         self,
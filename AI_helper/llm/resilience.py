@@ -0,0 +1,473 @@
+"""
+Устойчивость вызовов LLM: повторы, хеджирование, circuit breaker.
+
+ResilientLLM оборачивает любую BaseLLM:
+- повторяет запросы при временных ошибках (429, 5xx, сеть) с экспоненциальной
+  задержкой и случайным разбросом, учитывая Retry-After
+- (асинхронно) отправляет дублирующий запрос, если первый не ответил за p95
+  обычного времени ответа, и берёт тот, что пришёл раньше; для потоковой
+  генерации то же делается по времени до первого фрагмента
+- (асинхронно) обрывает поток, не приславший первый фрагмент за
+  first_chunk_timeout, и повторяет его как временную ошибку
+- размыкает цепь после серии неудач (включая ошибки авторизации и квоты)
+  и сразу отвечает LLMUnavailableError, пока провайдер не восстановится
+  (проверяется одним пробным запросом)
+
+Так хвост задержек и доля ошибок остаются ограниченными при деградации API.
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import List, Optional, Tuple, Iterator, AsyncIterator, Callable
+
+from .base import BaseLLM, Message, LLMError, LLMUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Ошибки настройки доступа (ключ, оплата, права): повтор не поможет,
+# но и провайдер для нас фактически недоступен
+AUTH_ERROR_STATUSES = (401, 402, 403)
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: closed → open (после серии ошибок) → half-open (пробный запрос)"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Сколько ошибок подряд размыкают цепь
+            recovery_timeout: Через сколько секунд пропустить пробный запрос
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+
+            # Полуоткрытое состояние: пропускаем один пробный запрос
+            if self._trial_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("✅ LLM снова отвечает, цепь замкнута")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release(self) -> None:
+        """Снимает отметку пробного запроса, если он завершился без вердикта (отмена)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(
+                        f"⚡ Цепь LLM разомкнута после {self._failures} ошибок "
+                        f"на {self.recovery_timeout:.0f} с"
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResilientLLM(BaseLLM):
+    """Обёртка над LLM с повторами, хеджированием и circuit breaker"""
+
+    def __init__(
+        self,
+        llm: BaseLLM,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        hedge_min_delay: float = 0.5,
+        first_chunk_timeout: Optional[float] = None,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        """
+        Args:
+            llm: Исходная модель (например, YandexGPT)
+            max_retries: Сколько раз повторять после временной ошибки
+            backoff_base: Базовая задержка перед повтором (удваивается с каждой попыткой)
+            backoff_max: Максимальная задержка перед повтором
+            hedge: Отправлять дублирующий запрос при медленном ответе или первом
+                   фрагменте потока (только async)
+            hedge_quantile: Квантиль времени ответа (для потока — времени до первого
+                            фрагмента), после которого отправляется дубль
+            hedge_min_samples: Сколько ответов накопить, прежде чем хеджировать
+            hedge_min_delay: Минимальная задержка перед дублем в секундах
+            first_chunk_timeout: Сколько секунд ждать первый фрагмент потока
+                                 (только async; None — до таймаута клиента)
+            breaker: Circuit breaker (по умолчанию 5 ошибок подряд / 30 с)
+        """
+        self.llm = llm
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.first_chunk_timeout = first_chunk_timeout
+        self.breaker = breaker or CircuitBreaker()
+
+        # Время полного ответа и время до первого фрагмента потока — разные
+        # распределения, поэтому и задержки дублей считаются по ним отдельно
+        self._latencies = deque(maxlen=200)
+        self._first_chunk_latencies = deque(maxlen=200)
+        self._latencies_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Остальные атрибуты (model, model_uri, ...) — от исходной модели
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    # === Вспомогательное ===
+
+    def _backoff(self, attempt: int, error: LLMError) -> float:
+        """Пауза перед повтором: Retry-After или экспонента с полным разбросом"""
+        if error.retry_after is not None:
+            return min(error.retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _record_latency(self, seconds: float) -> None:
+        with self._latencies_lock:
+            self._latencies.append(seconds)
+
+    def _record_first_chunk(self, seconds: float) -> None:
+        with self._latencies_lock:
+            self._first_chunk_latencies.append(seconds)
+
+    def _hedge_delay(self, stream: bool = False) -> Optional[float]:
+        """Задержка перед дублирующим запросом (None — пока мало данных)"""
+        samples = self._first_chunk_latencies if stream else self._latencies
+        with self._latencies_lock:
+            if not self.hedge or len(samples) < self.hedge_min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(self.hedge_quantile * len(ordered)))
+        return max(self.hedge_min_delay, ordered[index])
+
+    def _check_breaker(self) -> None:
+        if not self.breaker.allow():
+            raise LLMUnavailableError("LLM недоступна: цепь разомкнута", retryable=False)
+
+    def _handle_error(self, error: LLMError, attempt: int, received: bool = False) -> float:
+        """
+        Учитывает ошибку в circuit breaker и решает, повторять ли запрос
+
+        Returns:
+            Пауза перед повтором в секундах
+
+        Raises:
+            Исходную ошибку (не временная) или LLMUnavailableError (повторы исчерпаны)
+        """
+        if not error.retryable:
+            if error.status in AUTH_ERROR_STATUSES:
+                # Ключ или квота: пока настройку не исправят, все запросы будут падать
+                self.breaker.record_failure()
+            else:
+                # Ошибка конкретного запроса (например, 400): провайдер доступен,
+                # но это не успех — счётчик ошибок не сбрасывается
+                self.breaker.release()
+            raise error
+
+        self.breaker.record_failure()
+        if received or attempt >= self.max_retries:
+            raise self._unavailable(error)
+
+        delay = self._backoff(attempt, error)
+        logger.warning(f"🔁 Повтор запроса к LLM через {delay:.1f} с (попытка {attempt + 2}): {error}")
+        return delay
+
+    @staticmethod
+    def _unavailable(error: LLMError) -> LLMUnavailableError:
+        return LLMUnavailableError(
+            f"LLM недоступна: {error}",
+            status=error.status,
+            retryable=False,
+            retry_after=error.retry_after
+        )
+
+    # === Синхронные вызовы ===
+
+    def _call(self, func: Callable[[], str]) -> str:
+        """Синхронный вызов с повторами и circuit breaker"""
+        attempt = 0
+        while True:
+            self._check_breaker()
+            start = time.perf_counter()
+            try:
+                result = func()
+            except LLMError as e:
+                time.sleep(self._handle_error(e, attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+
+            self.breaker.record_success()
+            self._record_latency(time.perf_counter() - start)
+            return result
+
+    def generate(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> str:
+        return self._call(lambda: self.llm.generate(messages, temperature, max_tokens))
+
+    def generate_with_context(
+        self,
+        query: str,
+        context: str,
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> str:
+        return self._call(lambda: self.llm.generate_with_context(query, context, temperature, max_tokens))
+
+    def generate_stream(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> Iterator[str]:
+        """Потоковая генерация: повтор возможен, пока не получен первый фрагмент"""
+        attempt = 0
+        while True:
+            self._check_breaker()
+            received = False
+            start = time.perf_counter()
+            try:
+                for text in self.llm.generate_stream(messages, temperature, max_tokens):
+                    if not received:
+                        received = True
+                        self._record_first_chunk(time.perf_counter() - start)
+                    yield text
+            except LLMError as e:
+                time.sleep(self._handle_error(e, attempt, received))
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+
+            self.breaker.record_success()
+            return
+
+    # === Асинхронные вызовы ===
+
+    async def _attempt_with_hedge(self, make_call: Callable):
+        """Одна попытка: при медленном ответе параллельно отправляется дубль"""
+        delay = self._hedge_delay()
+        first = asyncio.ensure_future(make_call())
+        pending = {first}
+
+        # Отмена (/cancel, остановка обработчика) во время любого ожидания
+        # снимает и незавершённые запросы — в том числе ещё до дубля
+        try:
+            if delay is None:
+                return await first
+
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result()
+
+            logger.info(f"🪞 LLM не ответила за {delay:.1f} с, отправлен дублирующий запрос")
+            pending.add(asyncio.ensure_future(make_call()))
+            error = None
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    async def _acall(self, make_call: Callable) -> str:
+        """Асинхронный вызов с повторами, хеджированием и circuit breaker"""
+        attempt = 0
+        while True:
+            self._check_breaker()
+            start = time.perf_counter()
+            try:
+                result = await self._attempt_with_hedge(make_call)
+            except LLMError as e:
+                await asyncio.sleep(self._handle_error(e, attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+
+            self.breaker.record_success()
+            self._record_latency(time.perf_counter() - start)
+            return result
+
+    async def agenerate(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> str:
+        return await self._acall(lambda: self.llm.agenerate(messages, temperature, max_tokens))
+
+    async def _first_chunk(self, make_stream: Callable) -> Tuple[Optional[str], AsyncIterator[str]]:
+        """
+        Открывает поток и ждёт первый фрагмент
+
+        Если фрагмента нет дольше p95 обычного времени до первого фрагмента,
+        параллельно открывается второй поток; остаётся тот, что ответил раньше,
+        другой закрывается.
+
+        Returns:
+            (первый фрагмент или None, если поток пуст; поток для продолжения)
+
+        Raises:
+            LLMError: оба потока завершились ошибкой или первый фрагмент
+                      не пришёл за first_chunk_timeout (временная ошибка)
+        """
+        delay = self._hedge_delay(stream=True)
+        deadline = None if self.first_chunk_timeout is None else time.monotonic() + self.first_chunk_timeout
+
+        streams = {}
+        stream = make_stream()
+        streams[asyncio.ensure_future(stream.__anext__())] = stream
+        hedged = delay is None
+        error = None
+
+        try:
+            while streams:
+                timeouts = []
+                if not hedged:
+                    timeouts.append(delay)
+                if deadline is not None:
+                    timeouts.append(deadline - time.monotonic())
+                timeout = max(0.0, min(timeouts)) if timeouts else None
+
+                done, _ = await asyncio.wait(
+                    set(streams), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise LLMError(
+                            f"Нет первого фрагмента ответа за {self.first_chunk_timeout:.1f} с",
+                            retryable=True
+                        )
+                    hedged = True
+                    logger.info(
+                        f"🪞 LLM не прислала первый фрагмент за {delay:.1f} с, "
+                        f"открыт дублирующий поток"
+                    )
+                    stream = make_stream()
+                    streams[asyncio.ensure_future(stream.__anext__())] = stream
+                    continue
+
+                for task in done:
+                    stream = streams.pop(task)
+                    if task.exception() is None:
+                        return task.result(), stream
+                    if isinstance(task.exception(), StopAsyncIteration):
+                        return None, stream
+                    error = task.exception()
+                    await stream.aclose()
+
+            raise error
+        finally:
+            # Проигравший поток (или все — при ошибке) закрываем вместе с соединением
+            for task, other in streams.items():
+                task.cancel()
+                try:
+                    await task
+                except BaseException:
+                    pass
+                await other.aclose()
+
+    async def agenerate_stream(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация: повтор возможен, пока не получен первый фрагмент.
+        Хеджирование — только до первого фрагмента: дальше читается один поток.
+        """
+        attempt = 0
+        while True:
+            self._check_breaker()
+            received = False
+            stream = None
+            start = time.perf_counter()
+            try:
+                first, stream = await self._first_chunk(
+                    lambda: self.llm.agenerate_stream(messages, temperature, max_tokens)
+                )
+                if first is not None:
+                    received = True
+                    self._record_first_chunk(time.perf_counter() - start)
+                    yield first
+                    async for text in stream:
+                        yield text
+            except LLMError as e:
+                await asyncio.sleep(self._handle_error(e, attempt, received))
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            finally:
+                if stream is not None:
+                    await stream.aclose()
+
+            self.breaker.record_success()
+            return
+
+    async def aclose(self) -> None:
+        await self.llm.aclose()
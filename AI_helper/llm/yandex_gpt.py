@@ -1,13 +1,20 @@
 """
 Интеграция с YandexGPT API.
+
+Синхронные вызовы идут через requests.Session, асинхронные — через
+долгоживущую aiohttp.ClientSession: в обоих случаях соединение
+переиспользуется (keep-alive), без TCP+TLS рукопожатия на каждый ответ.
 """
 import os
+import json
+import asyncio
 import logging
 import requests
-from typing import List, Optional
+import aiohttp
+from typing import List, Optional, Iterator, AsyncIterator
 from dotenv import load_dotenv
 
-from .base import BaseLLM, Message
+from .base import BaseLLM, Message, LLMError
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -22,13 +29,21 @@ class YandexGPT(BaseLLM):
         self, 
         api_key: str = None, 
         folder_id: str = None,
-        model: str = "yandexgpt-lite"
+        model: str = "yandexgpt-lite",
+        pool_size: int = 10,
+        keepalive_timeout: float = 60,
+        timeout: float = 30
     ):
         """
         Args:
             api_key: API ключ (или из .env)
             folder_id: ID каталога (или из .env)
             model: Модель ("yandexgpt-lite" или "yandexgpt")
+            pool_size: Максимум одновременных соединений с API
+            keepalive_timeout: Сколько секунд держать простаивающее соединение
+            timeout: Таймаут в секундах: для обычного запроса — на весь ответ,
+                     для потокового — на соединение и на паузу между фрагментами
+                     (длинный ответ, который идёт без пауз, не обрывается)
         """
         self.api_key = api_key or os.getenv("YANDEX_API_KEY")
         self.folder_id = folder_id or os.getenv("YANDEX_FOLDER_ID")
@@ -40,6 +55,25 @@ class YandexGPT(BaseLLM):
             raise ValueError("YANDEX_FOLDER_ID не найден в .env!")
         
         self.model_uri = f"gpt://{self.folder_id}/{self.model}/latest"
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        
+        # Заголовки не меняются — собираем один раз
+        self.headers = {
+            "Authorization": f"Api-Key {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        # Пул соединений для синхронных вызовов
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        
+        # Асинхронная сессия создаётся при первом вызове внутри event loop
+        self._async_session: Optional[aiohttp.ClientSession] = None
+        
         logger.info(f"✅ YandexGPT инициализирован. Модель: {self.model}")
     
     def generate(
@@ -51,35 +85,15 @@ class YandexGPT(BaseLLM):
         """
         Генерирует ответ на основе истории сообщений
         """
-        # Формируем запрос
-        yandex_messages = [
-            {"role": msg.role, "text": msg.content}
-            for msg in messages
-        ]
-        
-        payload = {
-            "modelUri": self.model_uri,
-            "completionOptions": {
-                "stream": False,
-                "temperature": temperature,
-                "maxTokens": str(max_tokens)
-            },
-            "messages": yandex_messages
-        }
-        
-        headers = {
-            "Authorization": f"Api-Key {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        payload = self._build_payload(messages, temperature, max_tokens, stream=False)
         
         logger.info(f"Отправка запроса к YandexGPT ({len(messages)} сообщений)...")
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.API_URL, 
                 json=payload, 
-                headers=headers,
-                timeout=30
+                timeout=self.timeout
             )
             
             # Логирование ошибки
@@ -96,7 +110,193 @@ class YandexGPT(BaseLLM):
             
         except requests.exceptions.RequestException as e:
             logger.error(f"❌ Ошибка при запросе к YandexGPT: {e}")
-            raise
+            raise self._to_llm_error(e) from e
+    
+    def generate_stream(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> Iterator[str]:
+        """
+        Генерирует ответ по частям (completionOptions.stream = true)
+        
+        API присылает по строке JSON на каждое обновление, в каждой —
+        весь текст ответа на данный момент.
+        
+        Yields:
+            Накопленный текст ответа
+        """
+        payload = self._build_payload(messages, temperature, max_tokens, stream=True)
+        
+        logger.info(f"Отправка потокового запроса к YandexGPT ({len(messages)} сообщений)...")
+        
+        answer = ""
+        try:
+            with self.session.post(
+                self.API_URL,
+                json=payload,
+                timeout=self.timeout,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    logger.error(f"Ответ API (код {response.status_code}): {response.text}")
+                
+                response.raise_for_status()
+                
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    
+                    result = json.loads(line)
+                    text = result["result"]["alternatives"][0]["message"]["text"]
+                    if text != answer:
+                        answer = text
+                        yield answer
+            
+            logger.info(f"✅ Получен потоковый ответ от YandexGPT ({len(answer)} символов)")
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Ошибка при потоковом запросе к YandexGPT: {e}")
+            raise self._to_llm_error(e) from e
+    
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        """Долгоживущая aiohttp-сессия с пулом keep-alive соединений"""
+        if self._async_session is None or self._async_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            # Таймауты задаются на каждый запрос: у обычных и потоковых они разные
+            self._async_session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers
+            )
+        return self._async_session
+    
+    async def agenerate(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> str:
+        """
+        Асинхронно генерирует ответ (не блокирует event loop бота)
+        """
+        payload = self._build_payload(messages, temperature, max_tokens, stream=False)
+        
+        logger.info(f"Отправка запроса к YandexGPT ({len(messages)} сообщений)...")
+        
+        try:
+            async with self._get_async_session().post(
+                self.API_URL, json=payload, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            ) as response:
+                if response.status != 200:
+                    logger.error(f"Ответ API (код {response.status}): {await response.text()}")
+                
+                response.raise_for_status()
+                
+                result = await response.json()
+                answer = result["result"]["alternatives"][0]["message"]["text"]
+            
+            logger.info(f"✅ Получен ответ от YandexGPT ({len(answer)} символов)")
+            return answer
+            
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"❌ Ошибка при запросе к YandexGPT: {e!r}")
+            raise self._to_llm_error(e) from e
+    
+    async def agenerate_stream(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> AsyncIterator[str]:
+        """
+        Асинхронная потоковая генерация
+        
+        Yields:
+            Накопленный текст ответа
+        """
+        payload = self._build_payload(messages, temperature, max_tokens, stream=True)
+        
+        logger.info(f"Отправка потокового запроса к YandexGPT ({len(messages)} сообщений)...")
+        
+        # Без общего лимита: поток ограничен паузой между фрагментами (sock_read)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        
+        answer = ""
+        try:
+            async with self._get_async_session().post(self.API_URL, json=payload, timeout=timeout) as response:
+                if response.status != 200:
+                    logger.error(f"Ответ API (код {response.status}): {await response.text()}")
+                
+                response.raise_for_status()
+                
+                async for line in response.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    
+                    result = json.loads(line)
+                    text = result["result"]["alternatives"][0]["message"]["text"]
+                    if text != answer:
+                        answer = text
+                        yield answer
+            
+            logger.info(f"✅ Получен потоковый ответ от YandexGPT ({len(answer)} символов)")
+            
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"❌ Ошибка при потоковом запросе к YandexGPT: {e!r}")
+            raise self._to_llm_error(e) from e
+    
+    async def aclose(self) -> None:
+        """Закрывает соединения (вызывать при остановке бота)"""
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self.session.close()
+    
+    @staticmethod
+    def _to_llm_error(error: Exception) -> LLMError:
+        """Приводит ошибку HTTP-клиента к LLMError с признаком повторяемости"""
+        status, headers = None, None
+        
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            status, headers = error.response.status_code, error.response.headers
+        elif isinstance(error, aiohttp.ClientResponseError):
+            status, headers = error.status, error.headers
+        
+        retry_after = None
+        if headers and headers.get("Retry-After"):
+            try:
+                retry_after = float(headers["Retry-After"])
+            except ValueError:
+                pass
+        
+        # Сетевые ошибки и таймауты (status=None), 429 и 5xx — временные
+        retryable = status is None or status == 429 or status >= 500
+        return LLMError(f"YandexGPT: {error!r}", status=status, retryable=retryable, retry_after=retry_after)
+    
+    def _build_payload(
+        self,
+        messages: List[Message],
+        temperature: float,
+        max_tokens: int,
+        stream: bool
+    ) -> dict:
+        """Тело запроса к API"""
+        return {
+            "modelUri": self.model_uri,
+            "completionOptions": {
+                "stream": stream,
+                "temperature": temperature,
+                "maxTokens": str(max_tokens)
+            },
+            "messages": [
+                {"role": msg.role, "text": msg.content}
+                for msg in messages
+            ]
+        }
     
     def generate_with_context(
         self,
@@ -167,4 +367,13 @@ if __name__ == "__main__":
     query = "Какие документы нужны для поступления?"
     
     response = llm.generate_with_context(query, test_context)
-    print(f"Ответ: {response}")
\ No newline at end of file
+    print(f"Ответ: {response}")
+    
+    # Тест 3: Потоковая генерация
+    print("\n" + "="*50)
+    print("ТЕСТ 3: Потоковая генерация")
+    print("="*50)
+    
+    for partial in llm.generate_stream(messages):
+        print(f"... {len(partial)} символов")
+    print(f"Ответ: {partial}")
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+Архив старых записей ai_logs.db.
+
+ai_requests хранит вопрос, ответ и JSON с источниками для каждого запроса,
+поэтому без очистки база и её индексы растут бесконечно. Записи старше
+срока хранения переносятся в помесячные архивы (AILogger.archive_old_requests):
+- ai_logs_YYYY-MM.db — SQLite с той же таблицей ai_requests (по умолчанию)
+- ai_logs_YYYY-MM.jsonl.gz — сжатый JSONL (компактнее, только для чтения подряд)
+
+Агрегаты статистики (ai_rollups и др.) остаются в основной базе, поэтому
+get_stats по-прежнему видит всю историю, а AILogger.iter_requests читает
+архивы, если запрошено окно длиннее срока хранения.
+
+Запуск вручную:
+    python -m AI_helper.log_archive --days 90
+    python -m AI_helper.log_archive --days 90 --format jsonl.gz
+    python -m AI_helper.log_archive --list
+"""
+import os
+import re
+import gzip
+import json
+import sqlite3
+import argparse
+from pathlib import Path
+from typing import List, Dict, Iterator, Optional, Tuple
+
+ARCHIVE_FORMATS = ("sqlite", "jsonl.gz")
+
+_SUFFIXES = {"sqlite": ".db", "jsonl.gz": ".jsonl.gz"}
+_NAME_RE = re.compile(r"^ai_logs_(\d{4}-\d{2})\.(db|jsonl\.gz)$")
+
+
+class LogArchive:
+    """Помесячные архивы таблицы ai_requests"""
+
+    def __init__(self, archive_dir: str, archive_format: str = "sqlite"):
+        """
+        Args:
+            archive_dir: Папка с архивами
+            archive_format: Формат новых архивов: 'sqlite' или 'jsonl.gz'
+        """
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Неизвестный формат архива: {archive_format}")
+
+        self.archive_dir = Path(archive_dir)
+        self.archive_format = archive_format
+
+    def path(self, month: str, archive_format: Optional[str] = None) -> Path:
+        """Файл архива за месяц 'YYYY-MM'"""
+        return self.archive_dir / f"ai_logs_{month}{_SUFFIXES[archive_format or self.archive_format]}"
+
+    def months(self) -> List[str]:
+        """Месяцы, за которые есть архивы (по возрастанию)"""
+        if not self.archive_dir.exists():
+            return []
+        found = {
+            match.group(1)
+            for match in (_NAME_RE.match(path.name) for path in self.archive_dir.iterdir())
+            if match
+        }
+        return sorted(found)
+
+    # === Запись ===
+
+    def write(self, month: str, columns: List[str], rows: List[tuple]) -> None:
+        """
+        Дописывает строки ai_requests в архив месяца
+
+        Повторная запись тех же ID (после сбоя до удаления из основной
+        базы) в SQLite игнорируется, в JSONL отсекается при чтении.
+        """
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+
+        if self.archive_format == "sqlite":
+            self._write_sqlite(self.path(month), columns, rows)
+        else:
+            with gzip.open(self.path(month), "at", encoding="utf-8") as file:
+                for row in rows:
+                    file.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _write_sqlite(path: Path, columns: List[str], rows: List[tuple]) -> None:
+        conn = sqlite3.connect(str(path))
+        try:
+            other_columns = [column for column in columns if column != "id"]
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_requests (id INTEGER PRIMARY KEY, "
+                + ", ".join(other_columns) + ")"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON ai_requests(timestamp)")
+
+            # Колонки, появившиеся в основной базе после создания архива
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(ai_requests)")}
+            for column in other_columns:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE ai_requests ADD COLUMN {column}")
+
+            conn.executemany(
+                f"INSERT OR IGNORE INTO ai_requests ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})",
+                rows
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    # === Обратная связь ===
+
+    def update_feedback(
+        self,
+        request_id: int,
+        feedback: int,
+        feedback_time: str
+    ) -> Optional[Tuple[str, Optional[int]]]:
+        """
+        Записывает оценку в архивную запись (ищет с самого нового месяца)
+
+        Returns:
+            (timestamp, прежняя оценка) найденной записи или None
+        """
+        for month in reversed(self.months()):
+            found = None
+
+            sqlite_path = self.path(month, "sqlite")
+            if sqlite_path.exists():
+                conn = sqlite3.connect(str(sqlite_path))
+                try:
+                    row = conn.execute(
+                        "SELECT timestamp, feedback FROM ai_requests WHERE id = ?", (request_id,)
+                    ).fetchone()
+                    if row is not None:
+                        conn.execute(
+                            "UPDATE ai_requests SET feedback = ?, feedback_time = ? WHERE id = ?",
+                            (feedback, feedback_time, request_id)
+                        )
+                        conn.commit()
+                        found = row
+                finally:
+                    conn.close()
+
+            # JSONL только дописывается — переписываем файл месяца целиком
+            # (оценки старых ответов редки, а архив одного месяца невелик)
+            jsonl_path = self.path(month, "jsonl.gz")
+            if jsonl_path.exists():
+                with gzip.open(jsonl_path, "rt", encoding="utf-8") as file:
+                    rows = [json.loads(line) for line in file if line.strip()]
+                matched = [row for row in rows if row.get("id") == request_id]
+                if matched:
+                    found = found or (matched[0].get("timestamp"), matched[0].get("feedback"))
+                    for row in matched:
+                        row["feedback"], row["feedback_time"] = feedback, feedback_time
+
+                    temp_path = jsonl_path.with_name(jsonl_path.name + ".tmp")
+                    with gzip.open(temp_path, "wt", encoding="utf-8") as file:
+                        for row in rows:
+                            file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    os.replace(temp_path, jsonl_path)
+
+            if found is not None:
+                return found
+        return None
+
+    # === Чтение ===
+
+    def iter_rows(self, month: str, since: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Записи архива за месяц (оба формата), по возрастанию ID
+
+        Args:
+            month: Месяц 'YYYY-MM'
+            since: Только записи с timestamp >= since
+        """
+        sqlite_path = self.path(month, "sqlite")
+        if sqlite_path.exists():
+            conn = sqlite3.connect(str(sqlite_path))
+            conn.row_factory = sqlite3.Row
+            try:
+                cursor = conn.execute(
+                    "SELECT * FROM ai_requests WHERE timestamp >= ? ORDER BY id",
+                    (since or "",)
+                )
+                for row in cursor:
+                    yield dict(row)
+            finally:
+                conn.close()
+
+        jsonl_path = self.path(month, "jsonl.gz")
+        if jsonl_path.exists():
+            with gzip.open(jsonl_path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    if since is None or (row.get("timestamp") or "") >= since:
+                        yield row
+
+    def get_summary(self) -> List[Dict]:
+        """Размер архивов по месяцам"""
+        summary = []
+        for month in self.months():
+            size = sum(
+                self.path(month, archive_format).stat().st_size
+                for archive_format in ARCHIVE_FORMATS
+                if self.path(month, archive_format).exists()
+            )
+            summary.append({'month': month, 'size_bytes': size})
+        return summary
+
+
+def main():
+    from AI_helper.logger import AILogger
+
+    parser = argparse.ArgumentParser(description="Перенос старых записей ai_logs.db в помесячные архивы")
+    parser.add_argument("--days", type=int, default=90, help="Сколько дней хранить в основной базе")
+    parser.add_argument("--format", choices=ARCHIVE_FORMATS, default="sqlite", help="Формат архива")
+    parser.add_argument("--db", help="Путь к ai_logs.db (по умолчанию AI_helper/data/ai_logs.db)")
+    parser.add_argument("--list", action="store_true", help="Только показать существующие архивы")
+    args = parser.parse_args()
+
+    ai_logger = AILogger(db_path=args.db, archive_format=args.format)
+
+    try:
+        if not args.list:
+            result = ai_logger.archive_old_requests(retention_days=args.days)
+            print(f"\n📦 Перенесено в архив: {result['archived']} записей (старше {result['cutoff']})")
+            for month, count in sorted(result['by_month'].items()):
+                print(f"   {month}: {count}")
+
+        print(f"\n🗄 Архивы в {ai_logger.archive.archive_dir}:")
+        for item in ai_logger.archive.get_summary():
+            print(f"   {item['month']}: {item['size_bytes'] / 1024 / 1024:.2f} МБ")
+    finally:
+        ai_logger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,136 @@
 """
 Логирование запросов и ответов AI для аналитики.
+
+Запись идёт через одно долгоживущее соединение в режиме WAL: вызовы
+из обработчиков только ставят операцию в очередь, а фоновый поток
+выполняет накопившиеся операции одной транзакцией (group commit)
+и возвращает ID запроса через Future. С synchronous=NORMAL в WAL коммит
+не ждёт fsync, поэтому логирование почти не добавляет задержки к ответу.
+Чтение (статистика) — через отдельное соединение, которое не блокируется
+пишущим потоком.
+
+Для аналитики поддерживаются агрегаты, которые обновляются в той же
+транзакции, что и сама запись: ai_rollups (по часам и по дням — число
+запросов, суммы времени ответа и релевантности, кэш, оценки),
+ai_latency_histogram (гистограмма времени ответа) и ai_question_freq
+(частота нормализованных вопросов по дням). get_stats и
+get_popular_questions читают только их, поэтому отвечают за время,
+не зависящее от размера ai_requests.
+
+Записи старше срока хранения переносятся в помесячные архивы
+(archive_old_requests, см. log_archive.py); агрегаты остаются, а
+iter_requests при длинном окне и get_low_relevance_requests при нехватке
+свежих записей читают и архивы.
+
+Длительности этапов запроса (timing.StageTimer) пишутся в дочернюю
+таблицу ai_request_stages и, в той же транзакции, в гистограмму
+ai_stage_histogram (логарифмические корзины по часам и по дням);
+get_stage_stats считает p50/p95/p99 по гистограмме, поэтому не зависит
+от размера лога и видит и заархивированные запросы.
 """
+import re
 import sqlite3
 import json
-from datetime import datetime
+import queue
+import bisect
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable, Tuple, Iterator
+
+from .log_archive import LogArchive
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы времени ответа (мс); последняя корзина — «больше»
+LATENCY_BINS_MS = (250, 500, 1000, 2000, 3000, 5000, 8000, 13000, 20000, 30000)
+
+# Верхние границы корзин гистограммы этапов (мс): от 0.5 мс до ~1 мин с шагом ×1.2,
+# т.е. перцентиль этапа известен с точностью до 20%
+STAGE_BINS_MS = tuple(round(0.5 * 1.2 ** i, 2) for i in range(65))
+
+# Ниже этой максимальной релевантности ответ считается «не найдено» (как в боте)
+LOW_RELEVANCE_THRESHOLD = 0.6
+
+# Колонки ai_rollups, которые суммируются при обновлении
+ROLLUP_COLUMNS = (
+    "requests", "response_time_sum", "relevance_sum", "cache_hits",
+    "cached_response_time_sum", "low_relevance", "positive_feedback", "negative_feedback"
+)
+
+_ROLLUP_UPSERT = f"""
+    INSERT INTO ai_rollups (period, bucket, {", ".join(ROLLUP_COLUMNS)})
+    VALUES (?, ?, {", ".join("?" for _ in ROLLUP_COLUMNS)})
+    ON CONFLICT(period, bucket) DO UPDATE SET
+    {", ".join(f"{column} = {column} + excluded.{column}" for column in ROLLUP_COLUMNS)}
+"""
+
+_HISTOGRAM_UPSERT = """
+    INSERT INTO ai_latency_histogram (period, bucket, bin, count) VALUES (?, ?, ?, ?)
+    ON CONFLICT(period, bucket, bin) DO UPDATE SET count = count + excluded.count
+"""
+
+_STAGE_HISTOGRAM_UPSERT = """
+    INSERT INTO ai_stage_histogram (period, bucket, stage, bin, count, duration_sum)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(period, bucket, stage, bin) DO UPDATE SET
+    count = count + excluded.count, duration_sum = duration_sum + excluded.duration_sum
+"""
+
+_QUESTION_UPSERT = """
+    INSERT INTO ai_question_freq (day, normalized, question, count) VALUES (?, ?, ?, ?)
+    ON CONFLICT(day, normalized) DO UPDATE SET count = count + excluded.count
+"""
+
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+
+
+def normalize_question(question: str) -> str:
+    """Ключ для подсчёта частоты: нижний регистр, без пунктуации и лишних пробелов"""
+    return " ".join(_NON_WORD_RE.sub(" ", question.lower().replace("ё", "е")).split())
+
+
+def _now() -> str:
+    """Текущее время UTC в формате CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _buckets(timestamp: str) -> List[Tuple[str, str]]:
+    """Часовая и дневная корзины для метки времени 'YYYY-MM-DD HH:MM:SS'"""
+    return [("hour", timestamp[:13] + ":00:00"), ("day", timestamp[:10])]
+
+
+def _latency_bin(response_time_ms: Optional[int]) -> int:
+    return bisect.bisect_left(LATENCY_BINS_MS, response_time_ms or 0)
+
+
+def _stage_bin(duration_ms: float) -> int:
+    return bisect.bisect_left(STAGE_BINS_MS, duration_ms)
 
 
 class AILogger:
     """Логирование работы AI-помощника"""
     
-    def __init__(self, db_path: str = None):
+    # Часовые агрегаты нужны только для окон до 31 дня — более старые удаляются при архивации
+    HOURLY_ROLLUP_DAYS = 32
+    
+    def __init__(
+        self,
+        db_path: str = None,
+        batch_size: int = 100,
+        archive_dir: str = None,
+        archive_format: str = "sqlite"
+    ):
+        """
+        Args:
+            db_path: Путь к БД (по умолчанию AI_helper/data/ai_logs.db)
+            batch_size: Максимум операций в одной транзакции фонового потока
+            archive_dir: Папка помесячных архивов (по умолчанию archive/ рядом с БД)
+            archive_format: Формат новых архивов: 'sqlite' или 'jsonl.gz'
+        """
         if db_path is None:
             # БД рядом с ChromaDB
             current_dir = Path(__file__).parent
@@ -23,11 +142,34 @@ class AILogger:
             db_path = data_dir / "ai_logs.db"
     
         self.db_path = str(db_path)
+        self.batch_size = batch_size
+        self.archive = LogArchive(archive_dir or Path(self.db_path).parent / "archive", archive_format)
+        
+        # Соединение для записи используется только фоновым потоком (после _init_db)
+        self._write_conn = self._connect()
         self._init_db()
+        
+        self._read_conn = self._connect()
+        self._read_lock = threading.Lock()
+        
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="ai-logger-writer", daemon=True)
+        self._thread.start()
+        
+        # Дописываем очередь и при выходе без on_shutdown (скрипты, Ctrl+C)
+        atexit.register(self.close)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Долгоживущее соединение в режиме WAL"""
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
     
     def _init_db(self):
         """Создание таблиц"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._write_conn
         cursor = conn.cursor()
         
         # Таблица запросов
@@ -54,19 +196,419 @@ class AILogger:
                 -- Метаданные
                 sources TEXT,  -- JSON со списком источников
                 context_length INTEGER,
-                tokens_used INTEGER
+                tokens_used INTEGER,
+                
+                -- Ответ взят из семантического кэша (1) или сгенерирован (0)
+                cache_hit INTEGER DEFAULT 0
             )
         """)
         
+        # Миграция: в базах, созданных до появления кэша ответов, колонки нет
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(ai_requests)")}
+        if "cache_hit" not in columns:
+            cursor.execute("ALTER TABLE ai_requests ADD COLUMN cache_hit INTEGER DEFAULT 0")
+        
         # Индексы для быстрого поиска
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON ai_requests(user_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON ai_requests(timestamp)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_feedback ON ai_requests(feedback)")
         
+        # Агрегаты для статистики
+        tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS ai_rollups (
+                period TEXT NOT NULL,   -- 'hour' или 'day'
+                bucket TEXT NOT NULL,   -- 'YYYY-MM-DD HH:00:00' или 'YYYY-MM-DD' (UTC)
+                {", ".join(f"{column} REAL NOT NULL DEFAULT 0" for column in ROLLUP_COLUMNS)},
+                PRIMARY KEY (period, bucket)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ai_latency_histogram (
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                bin INTEGER NOT NULL,   -- индекс корзины в LATENCY_BINS_MS
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, bucket, bin)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ai_question_freq (
+                day TEXT NOT NULL,
+                normalized TEXT NOT NULL,
+                question TEXT NOT NULL,   -- первая формулировка, для показа
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, normalized)
+            )
+        """)
+        
+        # Длительности этапов конвейера (timing.StageTimer)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ai_request_stages (
+                request_id INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                duration_ms REAL NOT NULL,
+                timestamp DATETIME NOT NULL,
+                PRIMARY KEY (request_id, stage)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stages_timestamp ON ai_request_stages(timestamp)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ai_stage_histogram (
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                bin INTEGER NOT NULL,   -- индекс корзины в STAGE_BINS_MS
+                count INTEGER NOT NULL DEFAULT 0,
+                duration_sum REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, bucket, stage, bin)
+            )
+        """)
+        
         conn.commit()
-        conn.close()
+        
+        # Миграция: агрегаты появились позже — заполняем их по уже накопленным запросам
+        if "ai_rollups" not in tables:
+            self._rebuild_rollups(conn)
+            conn.commit()
+        elif "ai_stage_histogram" not in tables:
+            self._rebuild_stage_histogram(conn)
+            conn.commit()
     
-    def log_request(
+    # === Агрегаты ===
+    
+    @staticmethod
+    def _rollup_values(
+        response_time_ms: Optional[int],
+        avg_relevance: Optional[float],
+        max_relevance: Optional[float],
+        cache_hit: bool,
+        feedback: Optional[int] = None
+    ) -> Tuple:
+        """Вклад одного запроса в колонки ROLLUP_COLUMNS"""
+        response_time_ms = response_time_ms or 0
+        return (
+            1,
+            response_time_ms,
+            avg_relevance or 0,
+            int(bool(cache_hit)),
+            response_time_ms if cache_hit else 0,
+            int(not cache_hit and (max_relevance or 0) < LOW_RELEVANCE_THRESHOLD),
+            int(feedback == 1),
+            int(feedback == -1),
+        )
+    
+    def _rebuild_rollups(self, conn: sqlite3.Connection, batch_size: int = 5000) -> None:
+        """Пересчитывает все агрегаты по ai_requests (разово, при миграции)"""
+        conn.execute("DELETE FROM ai_rollups")
+        conn.execute("DELETE FROM ai_latency_histogram")
+        conn.execute("DELETE FROM ai_question_freq")
+        
+        rollups: Dict[Tuple[str, str], List] = {}
+        histogram: Dict[Tuple[str, str, int], int] = {}
+        questions: Dict[Tuple[str, str], List] = {}
+        total = 0
+        
+        cursor = conn.execute("""
+            SELECT timestamp, question, response_time_ms, avg_relevance,
+                   max_relevance, cache_hit, feedback
+            FROM ai_requests
+        """)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for timestamp, question, response_time_ms, avg_rel, max_rel, cache_hit, feedback in rows:
+                total += 1
+                values = self._rollup_values(response_time_ms, avg_rel, max_rel, cache_hit, feedback)
+                latency_bin = _latency_bin(response_time_ms)
+                for period, bucket in _buckets(timestamp):
+                    sums = rollups.setdefault((period, bucket), [0] * len(ROLLUP_COLUMNS))
+                    for i, value in enumerate(values):
+                        sums[i] += value
+                    histogram[(period, bucket, latency_bin)] = histogram.get((period, bucket, latency_bin), 0) + 1
+                
+                key = (timestamp[:10], normalize_question(question))
+                if key in questions:
+                    questions[key][1] += 1
+                else:
+                    questions[key] = [question, 1]
+        
+        conn.executemany(_ROLLUP_UPSERT, [(*key, *sums) for key, sums in rollups.items()])
+        conn.executemany(_HISTOGRAM_UPSERT, [(*key, count) for key, count in histogram.items()])
+        conn.executemany(_QUESTION_UPSERT, [(*key, q, count) for key, (q, count) in questions.items()])
+        
+        if total:
+            logger.info(f"📊 Агрегаты статистики пересчитаны по {total} запросам")
+        
+        self._rebuild_stage_histogram(conn)
+    
+    @staticmethod
+    def _rebuild_stage_histogram(conn: sqlite3.Connection) -> None:
+        """Пересчитывает гистограмму этапов по ai_request_stages"""
+        conn.execute("DELETE FROM ai_stage_histogram")
+        
+        histogram: Dict[Tuple[str, str, str, int], List] = {}
+        for name, duration_ms, timestamp in conn.execute(
+            "SELECT stage, duration_ms, timestamp FROM ai_request_stages"
+        ):
+            stage_bin = _stage_bin(duration_ms)
+            for period, bucket in _buckets(timestamp):
+                sums = histogram.setdefault((period, bucket, name, stage_bin), [0, 0.0])
+                sums[0] += 1
+                sums[1] += duration_ms
+        
+        conn.executemany(_STAGE_HISTOGRAM_UPSERT, [(*key, *sums) for key, sums in histogram.items()])
+    
+    def rebuild_rollups(self) -> None:
+        """Пересчитывает агрегаты заново (после ручной правки ai_requests)"""
+        self._submit(self._rebuild_rollups).result()
+    
+    # === Фоновая запись ===
+    
+    def _submit(self, op: Optional[Callable[[sqlite3.Connection], object]]) -> Future:
+        """Ставит операцию op(conn) в очередь записи (None — метка для flush)"""
+        if self._closed:
+            raise RuntimeError("AILogger закрыт")
+        
+        future = Future()
+        self._queue.put((op, future))
+        return future
+    
+    def _run(self) -> None:
+        """Цикл пишущего потока: всё, что накопилось за время коммита, — одной транзакцией"""
+        stopping = False
+        try:
+            while not stopping:
+                item = self._queue.get()
+                if item is None:
+                    return
+                
+                batch = [item]
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                
+                self._write_batch(batch)
+        finally:
+            # Соединение закрывает только его владелец — после последнего пакета
+            self._write_conn.close()
+    
+    def _write_batch(self, batch: List) -> None:
+        """
+        Выполняет операции и коммитит их одной транзакцией
+        
+        Ошибка самой SQLite (диск заполнен, ошибка ввода-вывода, база
+        заблокирована) откатывает весь пакет и передаётся всем его Future —
+        пишущий поток продолжает работу, ожидающие не зависают.
+        """
+        conn = self._write_conn
+        done = []
+        
+        try:
+            if not conn.in_transaction:
+                # IMMEDIATE: блокировка записи берётся сразу, с ожиданием timeout.
+                # При отложенном BEGIN операция «прочитать, потом записать»
+                # (log_feedback, _archive_chunk) получает SQLITE_BUSY без ожидания,
+                # если между чтением и записью коммитит другой процесс
+                # (например, python -m AI_helper.log_archive рядом с ботом)
+                conn.execute("BEGIN IMMEDIATE")
+            
+            for op, future in batch:
+                if op is None:
+                    done.append((future, None))
+                    continue
+                # Точка сохранения: ошибка одной операции не откатывает остальные
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = op(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    logger.error(f"❌ Ошибка записи в лог AI: {e}")
+                    self._deliver(future, exception=e)
+                    continue
+                conn.execute("RELEASE op")
+                done.append((future, result))
+            
+            conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи пакета лога AI ({len(batch)} операций): {e}", exc_info=True)
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            for _, future in batch:
+                if not future.done():
+                    self._deliver(future, exception=e)
+            return
+        
+        for future, result in done:
+            self._deliver(future, result=result)
+    
+    @staticmethod
+    def _deliver(future: Future, result=None, exception: Exception = None) -> None:
+        """Отдаёт результат, если ожидание не отменили (запись выполняется в любом случае)"""
+        if not future.set_running_or_notify_cancel():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    
+    def flush(self, timeout: float = None) -> None:
+        """Ждёт, пока всё поставленное в очередь будет записано"""
+        if not self._closed:
+            self._submit(None).result(timeout=timeout)
+    
+    def close(self, timeout: float = 10.0) -> None:
+        """Дописывает очередь и закрывает соединения"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+        
+        if self._thread.is_alive():
+            # Например, идёт порция архивации: поток допишет очередь и закроет
+            # соединение сам (или завершится вместе с процессом)
+            logger.warning(
+                f"⚠️ Запись лога AI не завершилась за {timeout:g} с, "
+                f"в очереди ~{self._queue.qsize()} операций"
+            )
+        
+        with self._read_lock:
+            self._read_conn.close()
+    
+    def _read(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Запрос на чтение через отдельное соединение"""
+        with self._read_lock:
+            return self._read_conn.execute(sql, params).fetchall()
+    
+    # === Архив ===
+    
+    def _archive_chunk(self, conn: sqlite3.Connection, cutoff: str, chunk_size: int) -> Dict[str, int]:
+        """Переносит в архив до chunk_size записей старше cutoff (в пишущем потоке)"""
+        cursor = conn.execute(
+            "SELECT * FROM ai_requests WHERE timestamp < ? ORDER BY id LIMIT ?",
+            (cutoff, chunk_size)
+        )
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        if not rows:
+            return {}
+        
+        # Этапы запроса уходят в архив вместе с ним — JSON в колонке stages
+        ids = {row[0] for row in rows}
+        stages: Dict[int, Dict[str, float]] = {}
+        for request_id, name, duration_ms in conn.execute(
+            "SELECT request_id, stage, duration_ms FROM ai_request_stages WHERE request_id BETWEEN ? AND ?",
+            (rows[0][0], rows[-1][0])
+        ):
+            if request_id in ids:
+                stages.setdefault(request_id, {})[name] = duration_ms
+        
+        columns = columns + ["stages"]
+        rows = [row + (json.dumps(stages[row[0]]) if row[0] in stages else None,) for row in rows]
+        
+        by_month: Dict[str, List[tuple]] = {}
+        timestamp_index = columns.index("timestamp")
+        for row in rows:
+            by_month.setdefault(str(row[timestamp_index])[:7], []).append(row)
+        
+        # Сначала архив (со своим коммитом), потом удаление: при сбое между
+        # ними записи окажутся в обоих местах, но не потеряются
+        for month, month_rows in by_month.items():
+            self.archive.write(month, columns, month_rows)
+        
+        conn.executemany("DELETE FROM ai_requests WHERE id = ?", [(row[0],) for row in rows])
+        conn.executemany("DELETE FROM ai_request_stages WHERE request_id = ?", [(row[0],) for row in rows])
+        return {month: len(month_rows) for month, month_rows in by_month.items()}
+    
+    def _prune_hourly_rollups(self, conn: sqlite3.Connection) -> None:
+        """Удаляет часовые агрегаты старше HOURLY_ROLLUP_DAYS (дневные остаются)"""
+        cutoff = self._window_start(self.HOURLY_ROLLUP_DAYS, "hour")
+        conn.execute("DELETE FROM ai_rollups WHERE period = 'hour' AND bucket < ?", (cutoff,))
+        conn.execute("DELETE FROM ai_latency_histogram WHERE period = 'hour' AND bucket < ?", (cutoff,))
+        conn.execute("DELETE FROM ai_stage_histogram WHERE period = 'hour' AND bucket < ?", (cutoff,))
+    
+    def archive_old_requests(self, retention_days: float = 90, chunk_size: int = 2000) -> Dict:
+        """
+        Переносит записи старше retention_days в помесячные архивы
+        
+        Работает порциями через очередь записи, поэтому текущие запросы
+        логируются между порциями без долгой блокировки.
+        
+        Returns:
+            {'archived': всего записей, 'by_month': {'YYYY-MM': n}, 'cutoff': граница}
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+        by_month: Dict[str, int] = {}
+        
+        while True:
+            moved = self._submit(lambda conn: self._archive_chunk(conn, cutoff, chunk_size)).result()
+            if not moved:
+                break
+            for month, count in moved.items():
+                by_month[month] = by_month.get(month, 0) + count
+        
+        self._submit(self._prune_hourly_rollups).result()
+        
+        archived = sum(by_month.values())
+        if archived:
+            logger.info(f"🗄 В архив перенесено {archived} записей старше {cutoff}")
+        return {'archived': archived, 'by_month': by_month, 'cutoff': cutoff}
+    
+    def iter_requests(self, days: Optional[float] = None, chunk_size: int = 1000) -> Iterator[Dict]:
+        """
+        Записи ai_requests за последние N дней (None — за всё время),
+        включая архивы, в хронологическом порядке
+        
+        Yields:
+            Словари с колонками ai_requests
+        """
+        since = None
+        if days is not None:
+            since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        
+        # Архивы: только месяцы, пересекающиеся с окном
+        seen_ids = set()
+        for month in self.archive.months():
+            if since is not None and month < since[:7]:
+                continue
+            for row in self.archive.iter_rows(month, since):
+                if row['id'] not in seen_ids:
+                    seen_ids.add(row['id'])
+                    yield row
+        
+        # Основная таблица — порциями по ID, не держа соединение между ними
+        last_id = 0
+        while True:
+            with self._read_lock:
+                cursor = self._read_conn.execute(
+                    "SELECT * FROM ai_requests WHERE id > ? AND timestamp >= ? ORDER BY id LIMIT ?",
+                    (last_id, since or "", chunk_size)
+                )
+                columns = [column[0] for column in cursor.description]
+                rows = cursor.fetchall()
+            
+            if not rows:
+                return
+            for row in rows:
+                if row[0] not in seen_ids:
+                    yield dict(zip(columns, row))
+            last_id = rows[-1][0]
+    
+    # === Запись ===
+    
+    def submit_request(
         self,
         user_id: int,
         username: str,
@@ -74,130 +616,289 @@ class AILogger:
         answer: str,
         sources: List[Dict],
         response_time_ms: int,
-        context_length: int = 0
-    ) -> int:
+        context_length: int = 0,
+        cache_hit: bool = False,
+        stages: Optional[Dict[str, float]] = None
+    ) -> Future:
         """
-        Логирует запрос
+        Ставит запрос в очередь записи, не дожидаясь диска
+        
+        Args:
+            cache_hit: Ответ взят из семантического кэша (без поиска и LLM)
+            stages: Длительности этапов {этап: мс} (StageTimer.as_dict())
         
         Returns:
-            request_id для последующего обновления
+            Future с request_id (в asyncio — через asyncio.wrap_future)
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # Вычисляем метрики релевантности
         relevances = [s['score'] for s in sources if 'score' in s]
         avg_relevance = sum(relevances) / len(relevances) if relevances else 0
         max_relevance = max(relevances) if relevances else 0
         min_relevance = min(relevances) if relevances else 0
         
-        cursor.execute("""
-            INSERT INTO ai_requests (
-                user_id, username, question, answer,
-                response_time_ms, documents_found,
+        timestamp = _now()
+        sources_json = json.dumps(sources, ensure_ascii=False)
+        
+        def insert(conn: sqlite3.Connection) -> int:
+            cursor = conn.execute("""
+                INSERT INTO ai_requests (
+                    user_id, username, question, answer, timestamp,
+                    response_time_ms, documents_found,
+                    avg_relevance, max_relevance, min_relevance,
+                    sources, context_length, cache_hit
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                user_id, username, question, answer, timestamp,
+                response_time_ms, len(sources),
                 avg_relevance, max_relevance, min_relevance,
-                sources, context_length
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            user_id, username, question, answer,
-            response_time_ms, len(sources),
-            avg_relevance, max_relevance, min_relevance,
-            json.dumps(sources, ensure_ascii=False), context_length
-        ))
-        
-        request_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+                sources_json, context_length, int(cache_hit)
+            ))
+            
+            values = self._rollup_values(response_time_ms, avg_relevance, max_relevance, cache_hit)
+            latency_bin = _latency_bin(response_time_ms)
+            for period, bucket in _buckets(timestamp):
+                conn.execute(_ROLLUP_UPSERT, (period, bucket, *values))
+                conn.execute(_HISTOGRAM_UPSERT, (period, bucket, latency_bin, 1))
+            conn.execute(_QUESTION_UPSERT, (timestamp[:10], normalize_question(question), question, 1))
+            
+            request_id = cursor.lastrowid
+            if stages:
+                conn.executemany(
+                    "INSERT INTO ai_request_stages (request_id, stage, duration_ms, timestamp) VALUES (?, ?, ?, ?)",
+                    [(request_id, name, duration_ms, timestamp) for name, duration_ms in stages.items()]
+                )
+                conn.executemany(_STAGE_HISTOGRAM_UPSERT, [
+                    (period, bucket, name, _stage_bin(duration_ms), 1, duration_ms)
+                    for name, duration_ms in stages.items()
+                    for period, bucket in _buckets(timestamp)
+                ])
+            
+            return request_id
+        
+        return self._submit(insert)
+    
+    def log_request(
+        self,
+        user_id: int,
+        username: str,
+        question: str,
+        answer: str,
+        sources: List[Dict],
+        response_time_ms: int,
+        context_length: int = 0,
+        cache_hit: bool = False,
+        stages: Optional[Dict[str, float]] = None
+    ) -> int:
+        """
+        Логирует запрос и ждёт записи (для скриптов; в боте — submit_request)
+        
+        Args:
+            cache_hit: Ответ взят из семантического кэша (без поиска и LLM)
         
-        return request_id
+        Returns:
+            request_id для последующего обновления
+        """
+        return self.submit_request(
+            user_id, username, question, answer, sources,
+            response_time_ms, context_length, cache_hit, stages
+        ).result()
     
-    def log_feedback(self, request_id: int, feedback: int):
+    def log_feedback(self, request_id: int, feedback: int) -> Future:
         """
-        Логирует обратную связь пользователя
+        Логирует обратную связь пользователя (без ожидания записи)
+        
+        Если запрос уже перенесён в архив, оценка записывается в архив
+        месяца, а агрегаты обновляются для исходной корзины запроса.
         
         Args:
             request_id: ID запроса
             feedback: 1 (👍) или -1 (👎)
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE ai_requests 
-            SET feedback = ?, feedback_time = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (feedback, request_id))
+        def update(conn: sqlite3.Connection) -> None:
+            row = conn.execute(
+                "SELECT timestamp, feedback FROM ai_requests WHERE id = ?", (request_id,)
+            ).fetchone()
+            if row is not None:
+                timestamp, previous = row
+                conn.execute("""
+                    UPDATE ai_requests 
+                    SET feedback = ?, feedback_time = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (feedback, request_id))
+            else:
+                row = self.archive.update_feedback(request_id, feedback, _now())
+                if row is None:
+                    logger.warning(f"⚠️ Оценка для запроса {request_id} не сохранена: запрос не найден ни в базе, ни в архиве")
+                    return
+                timestamp, previous = row
+                logger.info(f"🗄 Оценка для запроса {request_id} записана в архив")
+            
+            # Повторная оценка заменяет прежнюю и в агрегатах
+            positive = int(feedback == 1) - int(previous == 1)
+            negative = int(feedback == -1) - int(previous == -1)
+            if positive or negative:
+                for period, bucket in _buckets(timestamp):
+                    conn.execute("""
+                        UPDATE ai_rollups
+                        SET positive_feedback = positive_feedback + ?,
+                            negative_feedback = negative_feedback + ?
+                        WHERE period = ? AND bucket = ?
+                    """, (positive, negative, period, bucket))
         
-        conn.commit()
-        conn.close()
+        return self._submit(update)
     
-    def get_stats(self, days: int = 7) -> Dict:
-        """Статистика за последние N дней"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @staticmethod
+    def _window_start(days: float, period: str) -> str:
+        """Первая корзина окна «последние N дней» (с точностью до корзины)"""
+        start = datetime.now(timezone.utc) - timedelta(days=days)
+        return start.strftime("%Y-%m-%d %H:00:00" if period == "hour" else "%Y-%m-%d")
+    
+    @staticmethod
+    def _histogram_percentile(counts: List[int], percent: float, bins: Tuple = LATENCY_BINS_MS) -> float:
+        """Верхняя граница корзины, в которую попадает перцентиль"""
+        total = sum(counts)
+        if not total:
+            return 0
+        threshold = total * percent / 100
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= threshold:
+                break
+        return bins[min(index, len(bins) - 1)]
+    
+    def get_stats(self, days: float = 7) -> Dict:
+        """
+        Статистика за последние N дней (по агрегатам, без чтения ai_requests)
         
-        cursor.execute(f"""
-            SELECT 
-                COUNT(*) as total_requests,
-                AVG(response_time_ms) as avg_response_time,
-                AVG(avg_relevance) as avg_relevance,
-                SUM(CASE WHEN feedback = 1 THEN 1 ELSE 0 END) as positive_feedback,
-                SUM(CASE WHEN feedback = -1 THEN 1 ELSE 0 END) as negative_feedback,
-                SUM(CASE WHEN feedback IS NOT NULL THEN 1 ELSE 0 END) as total_feedback
-            FROM ai_requests
-            WHERE timestamp >= datetime('now', '-{days} days')
-        """)
+        До 31 дня окно считается по часовым корзинам, дальше — по дневным.
+        """
+        period = "hour" if days <= 31 else "day"
+        window_start = self._window_start(days, period)
+        
+        row = self._read(f"""
+            SELECT {", ".join(f"SUM({column})" for column in ROLLUP_COLUMNS)}
+            FROM ai_rollups
+            WHERE period = ? AND bucket >= ?
+        """, (period, window_start))[0]
+        totals = dict(zip(ROLLUP_COLUMNS, (value or 0 for value in row)))
+        
+        histogram = [0] * (len(LATENCY_BINS_MS) + 1)
+        for latency_bin, count in self._read("""
+            SELECT bin, SUM(count) FROM ai_latency_histogram
+            WHERE period = ? AND bucket >= ?
+            GROUP BY bin
+        """, (period, window_start)):
+            histogram[latency_bin] = count
         
-        row = cursor.fetchone()
+        total = int(totals['requests'])
+        positive = int(totals['positive_feedback'])
+        negative = int(totals['negative_feedback'])
+        cache_hits = int(totals['cache_hits'])
         
         stats = {
-            'total_requests': row[0] or 0,
-            'avg_response_time_ms': round(row[1] or 0, 2),
-            'avg_relevance': round(row[2] or 0, 3),
-            'positive_feedback': row[3] or 0,
-            'negative_feedback': row[4] or 0,
-            'total_feedback': row[5] or 0,
-            'feedback_rate': round((row[5] or 0) / (row[0] or 1) * 100, 1)
+            'total_requests': total,
+            'avg_response_time_ms': round(totals['response_time_sum'] / (total or 1), 2),
+            'avg_relevance': round(totals['relevance_sum'] / (total or 1), 3),
+            'positive_feedback': positive,
+            'negative_feedback': negative,
+            'total_feedback': positive + negative,
+            'feedback_rate': round((positive + negative) / (total or 1) * 100, 1),
+            'cache_hits': cache_hits,
+            'cache_hit_rate': round(cache_hits / (total or 1) * 100, 1),
+            'avg_cached_response_time_ms': round(totals['cached_response_time_sum'] / (cache_hits or 1), 2),
+            'low_relevance': int(totals['low_relevance']),
+            'response_time_p50_ms': self._histogram_percentile(histogram, 50),
+            'response_time_p95_ms': self._histogram_percentile(histogram, 95),
+            # Число запросов по корзинам: до 250 мс, до 500 мс, ..., больше последней границы
+            'latency_histogram': histogram
         }
         
-        conn.close()
         return stats
     
-    def get_popular_questions(self, limit: int = 10) -> List[Dict]:
-        """Самые частые вопросы"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_stage_stats(self, days: float = 7) -> Dict[str, Dict]:
+        """
+        Перцентили длительности этапов за последние N дней (по ai_stage_histogram)
         
-        cursor.execute("""
-            SELECT question, COUNT(*) as count
-            FROM ai_requests
-            WHERE timestamp >= datetime('now', '-30 days')
-            GROUP BY LOWER(question)
-            ORDER BY count DESC
+        Перцентиль — верхняя граница корзины STAGE_BINS_MS (точность ~20%),
+        среднее — точное. Окно как в get_stats: до 31 дня по часам, дальше по дням.
+        
+        Returns:
+            {этап: {'count', 'avg_ms', 'p50_ms', 'p95_ms', 'p99_ms'}}, этапы по убыванию p95
+        """
+        period = "hour" if days <= 31 else "day"
+        
+        histograms: Dict[str, List[int]] = {}
+        duration_sums: Dict[str, float] = {}
+        for name, stage_bin, count, duration_sum in self._read("""
+            SELECT stage, bin, SUM(count), SUM(duration_sum) FROM ai_stage_histogram
+            WHERE period = ? AND bucket >= ?
+            GROUP BY stage, bin
+        """, (period, self._window_start(days, period))):
+            histogram = histograms.setdefault(name, [0] * (len(STAGE_BINS_MS) + 1))
+            histogram[stage_bin] = count
+            duration_sums[name] = duration_sums.get(name, 0.0) + duration_sum
+        
+        stats = {}
+        for name, histogram in histograms.items():
+            count = sum(histogram)
+            stats[name] = {
+                'count': count,
+                'avg_ms': round(duration_sums[name] / count, 1),
+                'p50_ms': self._histogram_percentile(histogram, 50, STAGE_BINS_MS),
+                'p95_ms': self._histogram_percentile(histogram, 95, STAGE_BINS_MS),
+                'p99_ms': self._histogram_percentile(histogram, 99, STAGE_BINS_MS),
+            }
+        
+        return dict(sorted(stats.items(), key=lambda item: item[1]['p95_ms'], reverse=True))
+    
+    def get_popular_questions(self, limit: int = 10, days: int = 30) -> List[Dict]:
+        """Самые частые вопросы (с точностью до регистра и пунктуации)"""
+        rows = self._read("""
+            SELECT MIN(question), SUM(count) as total
+            FROM ai_question_freq
+            WHERE day >= ?
+            GROUP BY normalized
+            ORDER BY total DESC
             LIMIT ?
-        """, (limit,))
+        """, (self._window_start(days, "day"), limit))
         
         questions = [
             {'question': row[0], 'count': row[1]}
-            for row in cursor.fetchall()
+            for row in rows
         ]
         
-        conn.close()
         return questions
     
     def get_low_relevance_requests(self, threshold: float = 0.6, limit: int = 20) -> List[Dict]:
-        """Запросы с низкой релевантностью (проблемные)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """
+        Запросы с низкой релевантностью (проблемные), от новых к старым
         
-        cursor.execute("""
+        Если в основной таблице их меньше limit, дочитываются архивы —
+        от последнего месяца к первому.
+        """
+        rows = self._read("""
             SELECT id, question, avg_relevance, answer
             FROM ai_requests
             WHERE max_relevance < ?
-            ORDER BY timestamp DESC
+            ORDER BY timestamp DESC, id DESC
             LIMIT ?
         """, (threshold, limit))
         
+        seen_ids = {row[0] for row in rows}
+        for month in reversed(self.archive.months()):
+            if len(rows) >= limit:
+                break
+            matches = [
+                row for row in self.archive.iter_rows(month)
+                if row.get('max_relevance') is not None and row['max_relevance'] < threshold
+                and row['id'] not in seen_ids
+            ]
+            matches.sort(key=lambda row: (row['timestamp'], row['id']), reverse=True)
+            for row in matches[:limit - len(rows)]:
+                seen_ids.add(row['id'])
+                rows.append((row['id'], row['question'], row['avg_relevance'], row['answer']))
+        
         requests = [
             {
                 'id': row[0],
@@ -205,10 +906,9 @@ class AILogger:
                 'relevance': row[2],
                 'answer': row[3][:100] + '...'
             }
-            for row in cursor.fetchall()
+            for row in rows
         ]
         
-        conn.close()
         return requests
 
 
@@ -236,6 +936,7 @@ if __name__ == "__main__":
     logger.log_feedback(request_id, feedback=1)
     print("✅ Добавлен фидбек")
     
-    # Статистика
+    # Статистика (дожидаемся записи фидбека)
+    logger.flush()
     stats = logger.get_stats(days=7)
     print(f"\n📊 Статистика:\n{json.dumps(stats, indent=2, ensure_ascii=False)}")
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+ONNX Runtime бэкенд для embeddings (CPU, int8).
+
+Модель один раз экспортируется из HuggingFace в ONNX, затем квантуется
+динамически в int8 (onnxruntime.quantization). Результат кэшируется в
+./data/onnx/<модель>/ и при следующих запусках загружается сразу.
+
+Пулинг повторяет конфигурацию SentenceTransformer для e5:
+mean pooling по attention mask + L2-нормализация.
+
+Зависимости не входят в requirements.txt — бэкенд опциональный:
+    pip install -r requirements-onnx.txt
+
+Точность: косинусная близость к векторам PyTorch-модели должна быть
+не ниже 1 - COSINE_TOLERANCE (проверяется в benchmark_embeddings.py).
+"""
+import logging
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Допустимое отклонение косинусной близости от torch-векторов.
+# Предварительное значение: на реальной модели ещё не замерено — перед
+# включением EMBEDDING_BACKEND=onnx запустите benchmark_embeddings.py
+# и уточните порог по min/mean cosine из отчёта
+COSINE_TOLERANCE = 0.02
+
+
+class OnnxEmbeddingBackend:
+    """Инференс embedding-модели через onnxruntime (int8 dynamic quantization)"""
+
+    def __init__(
+        self,
+        model_name: str,
+        model_dir: str = None,
+        quantize: bool = True,
+        max_length: int = 512,
+        num_threads: int = None
+    ):
+        """
+        Args:
+            model_name: Название модели из HuggingFace
+            model_dir: Папка для экспортированной модели (по умолчанию ./data/onnx/<модель>/)
+            quantize: Использовать int8-квантованный граф
+            max_length: Максимальная длина последовательности в токенах
+            num_threads: Число потоков onnxruntime (None — по числу ядер)
+        """
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "Для ONNX-бэкенда нужны onnxruntime и transformers: "
+                "pip install -r requirements-onnx.txt"
+            ) from e
+
+        if model_dir is None:
+            model_dir = Path(__file__).parent / "data" / "onnx" / model_name.replace("/", "__")
+
+        self.model_name = model_name
+        self.model_dir = Path(model_dir)
+        self.max_length = max_length
+
+        onnx_path = self.model_dir / "model.onnx"
+        quantized_path = self.model_dir / "model_int8.onnx"
+        model_path = quantized_path if quantize else onnx_path
+
+        if not model_path.exists():
+            self._export(onnx_path, quantized_path if quantize else None)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_dir))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(
+            str(model_path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {inp.name for inp in self.session.get_inputs()}
+        self._dimension = None
+
+        logger.info(f"✅ ONNX-модель загружена: {model_path}")
+
+    def _export(self, onnx_path: Path, quantized_path: Path = None) -> None:
+        """Экспортирует модель в ONNX и (опционально) квантует в int8"""
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        logger.info(f"Экспорт {self.model_name} в ONNX (однократно)...")
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        tokenizer.save_pretrained(str(self.model_dir))
+
+        model = AutoModel.from_pretrained(self.model_name)
+        model.eval()
+
+        dummy = tokenizer(["query: пример текста"], return_tensors="pt")
+
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (dummy["input_ids"], dummy["attention_mask"]),
+                str(onnx_path),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"},
+                },
+                opset_version=14,
+            )
+
+        if quantized_path is not None:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            logger.info("Квантование ONNX-модели в int8...")
+            # fp32-граф e5-large больше 2 ГБ, поэтому веса лежат во внешних файлах
+            quantize_dynamic(
+                str(onnx_path),
+                str(quantized_path),
+                weight_type=QuantType.QInt8,
+                use_external_data_format=True,
+            )
+
+        logger.info(f"✅ ONNX-модель сохранена в {self.model_dir}")
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Создаёт нормализованные embeddings
+
+        Args:
+            texts: Список текстов
+            batch_size: Размер батча
+
+        Returns:
+            Матрица (len(texts), dim) float32
+        """
+        if not texts:
+            return np.zeros((0, self.get_dimension()), dtype=np.float32)
+
+        # Сортируем по длине, чтобы в батче было меньше паддинга
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        result = [None] * len(texts)
+
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            vectors = self._encode_batch([texts[i] for i in batch_idx])
+            for i, vector in zip(batch_idx, vectors):
+                result[i] = vector
+
+        return np.stack(result)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Один прогон батча через onnxruntime"""
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np"
+        )
+        inputs = {
+            name: encoded[name].astype(np.int64)
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+            if name in self._input_names and name in encoded
+        }
+
+        hidden = self.session.run(None, inputs)[0]
+
+        # Mean pooling по attention mask
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        summed = (hidden * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled = summed / counts
+
+        # L2-нормализация
+        norms = np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return (pooled / norms).astype(np.float32)
+
+    def get_dimension(self) -> int:
+        """Возвращает размерность вектора"""
+        if self._dimension is None:
+            self._dimension = int(self._encode_batch(["test"]).shape[1])
+        return self._dimension
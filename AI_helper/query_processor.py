@@ -3,7 +3,7 @@
 Расширяет сокращения, исправляет опечатки.
 """
 import re
-from typing import Dict
+from typing import Dict, List
 
 
 class QueryProcessor:
@@ -64,6 +64,32 @@ class QueryProcessor:
         
         return expanded_query
     
+    def variants(self, query: str) -> List[str]:
+        """
+        Формулировки запроса для многозапросного поиска
+        
+        Синонимы не дописываются к основному запросу, а дают отдельный
+        вариант: VectorStore.search_multi кодирует все варианты одним
+        батчем и объединяет результаты через reciprocal rank fusion.
+        
+        Args:
+            query: Исходный запрос
+            
+        Returns:
+            Уникальные варианты: исходный, с расшифровкой сокращений, с синонимами
+        """
+        query_lower = query.lower()
+        expanded_query = self._expand_abbreviations(query_lower)
+        synonym_query = self._add_synonyms(expanded_query)
+        
+        result = []
+        for variant in (query_lower, expanded_query, synonym_query):
+            variant = variant.strip()
+            if variant and variant not in result:
+                result.append(variant)
+        
+        return result
+    
     def _expand_abbreviations(self, query: str) -> str:
         """Расширяет сокращения в запросе"""
         result = query
@@ -108,4 +134,5 @@ if __name__ == "__main__":
         processed = processor.process(query)
         print(f"Исходный:     {query}")
         print(f"Обработанный: {processed}")
+        print(f"Варианты:     {processor.variants(query)}")
         print("-" * 60)
\ No newline at end of file
@@ -0,0 +1,485 @@
+"""
+Офлайн-бенчмарк поиска на реальных вопросах из ai_logs.db.
+
+Вопросы из ai_requests (включая архивы) прогоняются через тот же конвейер,
+что в боте: QueryProcessor → AIAssistant.retrieve (VectorStore.search /
+search_multi) → ContextBuilder → LLM. Вместо YandexGPT используется
+StubLLM с фиксированной задержкой, поэтому замеряется только своя часть
+конвейера, а API не тратится.
+
+Отчёт:
+- задержки по этапам (p50 / p95 / p99) — те же имена, что в ai_request_stages
+- пропускная способность (вопросов в секунду при заданном параллелизме)
+- совпадение с историческими источниками (файл + страница): доля общих
+  источников в top-k и совпадение первого источника, отдельно для ответов
+  с 👍 и 👎
+- максимальная релевантность и доля ответов «не найдено» (< 0.6)
+
+Режим поиска, top_k, бюджет промпта и переранжирование по умолчанию берутся
+из gateway_bot.config (как в боте: AI_SEARCH_MODE, AI_RERANK, ...). Если
+конфиг бота не загружается (например, нет BOT_TOKEN), --mode и
+--rerank / --no-rerank нужно указать явно.
+
+Отчёты сохраняются в JSON и сравниваются между собой:
+    python -m AI_helper.replay_benchmark --days 90 --limit 500 --output before.json
+    python -m AI_helper.replay_benchmark --days 90 --limit 500 --output after.json --persist-dir new_index
+    python -m AI_helper.replay_benchmark --compare before.json after.json
+"""
+import json
+import time
+import random
+import logging
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+
+from AI_helper.llm.base import BaseLLM, Message
+from AI_helper.logger import AILogger, normalize_question, LOW_RELEVANCE_THRESHOLD
+from AI_helper.timing import StageTimer, activate, deactivate, stage
+
+logger = logging.getLogger(__name__)
+
+# Метрики, которые выводит --compare: (ключ в отчёте, подпись, чем меньше — тем лучше)
+COMPARE_METRICS = [
+    ("latency.total.p50_ms", "Задержка p50, мс", True),
+    ("latency.total.p95_ms", "Задержка p95, мс", True),
+    ("latency.total.p99_ms", "Задержка p99, мс", True),
+    ("latency.stages.embed.p95_ms", "embed p95, мс", True),
+    ("latency.stages.vector_query.p95_ms", "vector_query p95, мс", True),
+    ("latency.stages.rerank.p95_ms", "rerank p95, мс", True),
+    ("latency.stages.prompt.p95_ms", "prompt p95, мс", True),
+    ("throughput_qps", "Вопросов в секунду", False),
+    ("agreement.all.source_overlap", "Совпадение источников", False),
+    ("agreement.all.top1_match", "Совпадение 1-го источника", False),
+    ("agreement.positive.source_overlap", "Совпадение (👍)", False),
+    ("agreement.negative.source_overlap", "Совпадение (👎)", False),
+    ("relevance.avg_max_score", "Средняя макс. релевантность", False),
+    ("relevance.low_relevance_rate", "Доля «не найдено»", True),
+]
+
+
+class StubLLM(BaseLLM):
+    """Заглушка LLM: фиксированная задержка и шаблонный ответ"""
+
+    def __init__(self, delay_ms: float = 0.0):
+        self.delay_ms = delay_ms
+
+    def generate(
+        self,
+        messages: List[Message],
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> str:
+        if self.delay_ms:
+            time.sleep(self.delay_ms / 1000)
+        return "[Ответ заглушки]"
+
+    def generate_with_context(
+        self,
+        query: str,
+        context: str,
+        temperature: float = 0.6,
+        max_tokens: int = 2000
+    ) -> str:
+        return self.generate([Message(role="user", content=query)], temperature, max_tokens)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Перцентиль по отсортированному списку"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _distribution(values: List[float]) -> Dict:
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.mean(values), 2),
+        'p50_ms': round(_percentile(values, 50), 2),
+        'p95_ms': round(_percentile(values, 95), 2),
+        'p99_ms': round(_percentile(values, 99), 2),
+        'max_ms': round(max(values), 2),
+    }
+
+
+def _source_key(source: Dict) -> Tuple[str, Optional[int]]:
+    """Источник с точностью до файла и страницы (ID чанков меняются при переиндексации)"""
+    return source.get('file_name') or source.get('source'), source.get('page')
+
+
+def _bot_config():
+    """Конфиг бота (gateway_bot.config) или None, если он не загружается"""
+    try:
+        from gateway_bot.config import config
+        return config
+    except (ImportError, ValueError) as e:
+        logger.warning(f"⚠️ Конфиг бота недоступен ({e}) — настройки поиска берутся только из аргументов")
+        return None
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def load_questions(
+    ai_logger: AILogger,
+    days: Optional[float] = None,
+    limit: Optional[int] = None,
+    feedback: str = "all",
+    unique: bool = False,
+    seed: int = 42
+) -> List[Dict]:
+    """
+    Вопросы из лога (с архивами) с историческими источниками
+
+    Args:
+        days: Окно в днях (None — вся история)
+        limit: Сколько вопросов взять (случайная выборка с фиксированным seed)
+        feedback: "all", "positive", "negative" или "rated" (только с оценкой)
+        unique: Оставить по одной записи на нормализованный вопрос
+    """
+    questions, seen = [], set()
+
+    for row in ai_logger.iter_requests(days=days):
+        if row.get('cache_hit'):
+            continue  # Ответ из кэша — поиск тогда не выполнялся
+        if feedback == "positive" and row.get('feedback') != 1:
+            continue
+        if feedback == "negative" and row.get('feedback') != -1:
+            continue
+        if feedback == "rated" and row.get('feedback') is None:
+            continue
+
+        if unique:
+            key = normalize_question(row['question'])
+            if key in seen:
+                continue
+            seen.add(key)
+
+        try:
+            sources = json.loads(row.get('sources') or "[]")
+        except ValueError:
+            sources = []
+
+        questions.append({
+            'id': row['id'],
+            'question': row['question'],
+            'feedback': row.get('feedback'),
+            'max_relevance': row.get('max_relevance'),
+            'sources': [_source_key(s) for s in sources],
+        })
+
+    if limit and len(questions) > limit:
+        questions = random.Random(seed).sample(questions, limit)
+    return questions
+
+
+class ReplayBenchmark:
+    """Прогон вопросов через конвейер поиска с заглушкой вместо LLM"""
+
+    def __init__(self, assistant, query_processor, context_builder, multi_query: bool = True):
+        self.assistant = assistant
+        self.query_processor = query_processor
+        self.context_builder = context_builder
+        self.multi_query = multi_query
+
+    def run_one(self, item: Dict) -> Dict:
+        """Один вопрос: этапы как в ai_question_handler, без Telegram и кэша ответов"""
+        timer = StageTimer()
+        token = activate(timer)
+        try:
+            with stage("preprocess"):
+                processed = self.query_processor.process(item['question'])
+                variants = self.query_processor.variants(item['question']) if self.multi_query else None
+
+            with stage("retrieve"):
+                results = self.assistant.retrieve(processed, variants=variants)
+
+            with stage("prompt"):
+                packed = self.context_builder.build(item['question'], results)
+
+            with stage("llm"):
+                self.assistant.llm.generate(
+                    [Message(role="user", content=packed.prompt)], max_tokens=packed.max_tokens
+                )
+        finally:
+            deactivate(token)
+
+        return {
+            'id': item['id'],
+            'total_ms': timer.elapsed_ms(),
+            'stages': timer.as_dict(),
+            'max_score': max((r['score'] for r in results), default=0.0),
+            'sources': [_source_key(r) for r in packed.results],
+        }
+
+    def run(self, questions: List[Dict], concurrency: int = 1) -> Tuple[List[Dict], float]:
+        """Прогоняет все вопросы; возвращает результаты и общее время в секундах"""
+        # Прогрев: загрузка модели и открытие коллекции не должны попасть в замеры
+        if questions:
+            self.run_one(questions[0])
+
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(self.run_one, questions))
+        else:
+            results = [self.run_one(item) for item in questions]
+        return results, time.perf_counter() - start
+
+
+def _agreement(pairs: List[Tuple[Dict, Dict]]) -> Dict:
+    """Совпадение новых источников с историческими"""
+    overlaps, top1 = [], []
+    for item, result in pairs:
+        if not item['sources']:
+            continue
+        historical = set(item['sources'])
+        overlaps.append(len(historical & set(result['sources'])) / len(historical))
+        top1.append(float(bool(result['sources']) and result['sources'][0] == item['sources'][0]))
+
+    return {
+        'questions': len(overlaps),
+        'source_overlap': round(statistics.mean(overlaps), 4) if overlaps else None,
+        'top1_match': round(statistics.mean(top1), 4) if top1 else None,
+    }
+
+
+def build_report(questions: List[Dict], results: List[Dict], wall_time: float, config: Dict) -> Dict:
+    """Сводный отчёт по прогону"""
+    stage_names = sorted({name for result in results for name in result['stages']})
+    pairs = list(zip(questions, results))
+    max_scores = [result['max_score'] for result in results]
+
+    return {
+        'created': datetime.now().isoformat(timespec="seconds"),
+        'git_commit': _git_commit(),
+        'config': config,
+        'questions': len(results),
+        'wall_time_s': round(wall_time, 3),
+        'throughput_qps': round(len(results) / wall_time, 2) if wall_time else None,
+        'latency': {
+            'total': _distribution([result['total_ms'] for result in results]),
+            'stages': {
+                name: _distribution([result['stages'][name] for result in results if name in result['stages']])
+                for name in stage_names
+            },
+        },
+        'agreement': {
+            'all': _agreement(pairs),
+            'positive': _agreement([p for p in pairs if p[0]['feedback'] == 1]),
+            'negative': _agreement([p for p in pairs if p[0]['feedback'] == -1]),
+        },
+        'relevance': {
+            'avg_max_score': round(statistics.mean(max_scores), 4) if max_scores else None,
+            'low_relevance_rate': round(
+                sum(score < LOW_RELEVANCE_THRESHOLD for score in max_scores) / len(max_scores), 4
+            ) if max_scores else None,
+            'historical_avg_max_score': round(statistics.mean(
+                q['max_relevance'] for q in questions if q['max_relevance'] is not None
+            ), 4) if any(q['max_relevance'] is not None for q in questions) else None,
+        },
+    }
+
+
+def _get(report: Dict, path: str):
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_reports(base: Dict, new: Dict) -> List[Dict]:
+    """Изменения ключевых метрик между двумя отчётами"""
+    rows = []
+    for path, label, lower_is_better in COMPARE_METRICS:
+        before, after = _get(base, path), _get(new, path)
+        if before is None and after is None:
+            continue
+        change = None
+        if before not in (None, 0) and after is not None:
+            change = (after - before) / abs(before) * 100
+        better = None
+        if before is not None and after is not None and before != after:
+            better = (after < before) == lower_is_better
+        rows.append({'metric': label, 'before': before, 'after': after, 'change_pct': change, 'better': better})
+    return rows
+
+
+def _print_report(report: Dict) -> None:
+    print("\n" + "=" * 70)
+    print("🔁 REPLAY-БЕНЧМАРК ПОИСКА")
+    print("=" * 70)
+    config = report['config']
+    rerank = (f"{config['rerank_candidates']} кандидатов, бюджет {config['rerank_budget_ms']} мс"
+              if config.get('rerank') else "нет")
+    print(f"Вопросов: {report['questions']}, режим: {config['mode']}, top_k: {config['top_k']}, "
+          f"переранжирование: {rerank}, параллелизм: {config['concurrency']}, "
+          f"индекс: {config['persist_dir'] or 'по умолчанию'}")
+    print(f"⚡ {report['throughput_qps']} вопросов/с (всего {report['wall_time_s']} с)\n")
+
+    print(f"{'Этап':<16} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'среднее':>9}")
+    rows = [("total", report['latency']['total'])] + list(report['latency']['stages'].items())
+    for name, d in rows:
+        if d.get('count'):
+            print(f"{name:<16} {d['p50_ms']:>9} {d['p95_ms']:>9} {d['p99_ms']:>9} {d['mean_ms']:>9}")
+
+    print("\n🎯 Совпадение с историческими источниками (файл + страница):")
+    for group, label in (("all", "все"), ("positive", "👍"), ("negative", "👎")):
+        a = report['agreement'][group]
+        if a['questions']:
+            print(f"  {label:<4} n={a['questions']:<5} top-k: {a['source_overlap'] * 100:.1f}%, "
+                  f"первый источник: {a['top1_match'] * 100:.1f}%")
+
+    r = report['relevance']
+    if r['avg_max_score'] is not None:
+        print(f"\n📈 Макс. релевантность: {r['avg_max_score']} (в логе: {r['historical_avg_max_score']}), "
+              f"«не найдено»: {r['low_relevance_rate'] * 100:.1f}%")
+    print("=" * 70)
+
+
+def _print_comparison(rows: List[Dict], base_name: str, new_name: str) -> None:
+    print("\n" + "=" * 70)
+    print(f"⚖️ СРАВНЕНИЕ: {base_name} → {new_name}")
+    print("=" * 70)
+    for row in rows:
+        change = f"{row['change_pct']:+.1f}%" if row['change_pct'] is not None else ""
+        mark = {True: "✅", False: "❌", None: "  "}[row['better']]
+        print(f"{mark} {row['metric']:<30} {str(row['before']):>10} → {str(row['after']):<10} {change}")
+    print("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay-бенчмарк поиска по вопросам из ai_logs.db")
+    parser.add_argument("--logs", help="Путь к ai_logs.db (по умолчанию AI_helper/data/ai_logs.db)")
+    parser.add_argument("--days", type=float, help="Окно в днях (по умолчанию вся история, с архивами)")
+    parser.add_argument("--limit", type=int, default=500, help="Сколько вопросов взять (0 — все)")
+    parser.add_argument("--feedback", choices=["all", "positive", "negative", "rated"], default="all")
+    parser.add_argument("--unique", action="store_true", help="По одному разу на нормализованный вопрос")
+    parser.add_argument("--seed", type=int, default=42, help="Seed случайной выборки")
+    parser.add_argument("--persist-dir", help="Папка индекса (по умолчанию как в боте)")
+    parser.add_argument("--collection", default="ai_knowledge", help="Название коллекции")
+    parser.add_argument("--backend", choices=["chroma", "flat"], help="Бэкенд хранилища")
+    parser.add_argument("--mode", choices=["dense", "hybrid"], help="Режим поиска (по умолчанию AI_SEARCH_MODE бота)")
+    parser.add_argument("--top-k", type=int, help="Сколько документов искать (по умолчанию AI_TOP_K бота)")
+    parser.add_argument("--rerank", action=argparse.BooleanOptionalAction,
+                        help="Переранжирование кросс-энкодером (по умолчанию AI_RERANK бота)")
+    parser.add_argument("--rerank-candidates", type=int, help="Кандидатов для переранжирования")
+    parser.add_argument("--rerank-budget-ms", type=float, help="Бюджет переранжирования, мс")
+    parser.add_argument("--no-multi-query", action="store_true", help="Искать только по обработанному запросу")
+    parser.add_argument("--query-cache", action="store_true",
+                        help="Включить LRU-кэш векторов запросов (по умолчанию выключен для честных замеров)")
+    parser.add_argument("--input-tokens", type=int, help="Бюджет промпта в токенах (по умолчанию AI_INPUT_TOKENS бота)")
+    parser.add_argument("--llm-delay-ms", type=float, default=0.0, help="Задержка заглушки LLM")
+    parser.add_argument("--concurrency", type=int, default=1, help="Сколько вопросов обрабатывать параллельно")
+    parser.add_argument("--output", help="Сохранить отчёт в JSON-файл")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Сравнить два JSON-отчёта")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.compare:
+        base_path, new_path = args.compare
+        with open(base_path, encoding="utf-8") as file:
+            base = json.load(file)
+        with open(new_path, encoding="utf-8") as file:
+            new = json.load(file)
+        _print_comparison(compare_reports(base, new), base_path, new_path)
+        return
+
+    # Без явных аргументов — те же настройки поиска, что у бота
+    bot_config = _bot_config()
+    if bot_config is None and (args.mode is None or args.rerank is None):
+        parser.error("конфиг бота не загрузился — укажите --mode и --rerank / --no-rerank явно")
+
+    def bot_default(value, name: str, fallback):
+        if value is not None:
+            return value
+        return getattr(bot_config, name) if bot_config is not None else fallback
+
+    args.mode = bot_default(args.mode, "AI_SEARCH_MODE", None)
+    args.rerank = bot_default(args.rerank, "AI_RERANK", None)
+    args.top_k = bot_default(args.top_k, "AI_TOP_K", 5)
+    args.rerank_candidates = bot_default(args.rerank_candidates, "AI_RERANK_CANDIDATES", 20)
+    args.rerank_budget_ms = bot_default(args.rerank_budget_ms, "AI_RERANK_BUDGET_MS", 300)
+    args.input_tokens = bot_default(args.input_tokens, "AI_INPUT_TOKENS", 6000)
+
+    from AI_helper.assistant import AIAssistant
+    from AI_helper.vector_store import VectorStore
+    from AI_helper.query_processor import QueryProcessor
+    from AI_helper.context_builder import ContextBuilder
+    from AI_helper.reranker import CrossEncoderReranker
+
+    ai_logger = AILogger(db_path=args.logs)
+    try:
+        questions = load_questions(
+            ai_logger, days=args.days, limit=args.limit or None,
+            feedback=args.feedback, unique=args.unique, seed=args.seed
+        )
+    finally:
+        ai_logger.close()
+
+    if not questions:
+        print("❌ В логе нет подходящих вопросов")
+        return
+
+    vector_store = VectorStore(
+        collection_name=args.collection,
+        persist_directory=args.persist_dir,
+        query_cache_size=256 if args.query_cache else 0,
+        backend=args.backend,
+    )
+    assistant = AIAssistant(
+        vector_store=vector_store,
+        llm=StubLLM(delay_ms=args.llm_delay_ms),
+        top_k=args.top_k,
+        search_mode=args.mode,
+        reranker=CrossEncoderReranker() if args.rerank else None,
+        rerank_candidates=args.rerank_candidates,
+        rerank_budget_ms=args.rerank_budget_ms,
+    )
+    benchmark = ReplayBenchmark(
+        assistant,
+        QueryProcessor(),
+        ContextBuilder(input_budget=args.input_tokens),
+        multi_query=not args.no_multi_query,
+    )
+
+    results, wall_time = benchmark.run(questions, concurrency=args.concurrency)
+
+    config = {
+        'logs': args.logs, 'days': args.days, 'limit': args.limit, 'feedback': args.feedback,
+        'unique': args.unique, 'seed': args.seed, 'persist_dir': args.persist_dir,
+        'collection': args.collection, 'backend': vector_store.backend, 'documents': vector_store.get_count(),
+        'mode': args.mode, 'top_k': args.top_k, 'multi_query': not args.no_multi_query,
+        'rerank': args.rerank, 'rerank_candidates': args.rerank_candidates,
+        'rerank_budget_ms': args.rerank_budget_ms,
+        'query_cache': args.query_cache, 'input_tokens': args.input_tokens,
+        'llm_delay_ms': args.llm_delay_ms, 'concurrency': args.concurrency,
+    }
+    report = build_report(questions, results, wall_time, config)
+    _print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\n💾 Отчёт сохранён в {args.output}")
+
+    vector_store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Переранжирование найденных чанков кросс-энкодером.
+Первый этап (VectorStore.search) отдаёт широкий пул кандидатов,
+кросс-энкодер оценивает пары (запрос, чанк) и оставляет лучшие N.
+"""
+import time
+import logging
+from typing import List, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Переранжирование кандидатов с ограничением по времени"""
+
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+        batch_size: int = 8,
+        max_length: int = 512
+    ):
+        """
+        Args:
+            model_name: Многоязычный кросс-энкодер из HuggingFace
+            batch_size: Сколько пар оценивать за один прогон
+            max_length: Максимальная длина пары в токенах
+        """
+        # Импорт здесь: без переранжирования (AI_RERANK=0) torch не загружается
+        from sentence_transformers import CrossEncoder
+
+        logger.info(f"Загрузка кросс-энкодера: {model_name}")
+        self.model = CrossEncoder(model_name, max_length=max_length)
+        self.batch_size = batch_size
+
+        # Скользящая оценка стоимости одной пары (мс) для прогноза укладывания в бюджет
+        self._ms_per_pair: Optional[float] = None
+        self.last_stats: Dict = {}
+
+        logger.info("✅ Кросс-энкодер загружен")
+
+    def rerank(
+        self,
+        query: str,
+        candidates: List[Dict],
+        top_n: int = 5,
+        budget_ms: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Переранжирует кандидатов
+
+        Если прогноз или фактическое время превышает бюджет,
+        возвращается исходный (векторный) порядок.
+
+        Args:
+            query: Запрос
+            candidates: Результаты VectorStore.search
+            top_n: Сколько лучших оставить
+            budget_ms: Бюджет времени в миллисекундах (None — без ограничения)
+
+        Returns:
+            Лучшие top_n кандидатов (с полем rerank_score, если переранжирование успело)
+        """
+        start = time.perf_counter()
+
+        if len(candidates) <= 1:
+            return candidates[:top_n]
+
+        if budget_ms is not None and self._ms_per_pair is not None:
+            estimate = self._ms_per_pair * len(candidates)
+            if estimate > budget_ms:
+                # Понемногу снижаем оценку, чтобы после разовой перегрузки снова пробовать
+                self._ms_per_pair *= 0.9
+                return self._fallback(candidates, top_n, 0.0, f"прогноз {estimate:.0f} мс")
+
+        scores = []
+        for batch_start in range(0, len(candidates), self.batch_size):
+            batch = candidates[batch_start:batch_start + self.batch_size]
+            pairs = [(query, candidate["text"]) for candidate in batch]
+            scores.extend(float(score) for score in self.model.predict(pairs, batch_size=self.batch_size))
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if budget_ms is not None and elapsed_ms > budget_ms:
+                self._update_cost(elapsed_ms, len(scores))
+                return self._fallback(candidates, top_n, elapsed_ms, f"{elapsed_ms:.0f} мс")
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._update_cost(elapsed_ms, len(scores))
+
+        reranked = [
+            {**candidate, "rerank_score": score}
+            for candidate, score in zip(candidates, scores)
+        ]
+        reranked.sort(key=lambda r: r["rerank_score"], reverse=True)
+
+        self.last_stats = {'elapsed_ms': round(elapsed_ms, 1), 'fallback': False, 'pairs': len(candidates)}
+        logger.info(f"🔀 Переранжировано {len(candidates)} кандидатов за {elapsed_ms:.0f} мс")
+        return reranked[:top_n]
+
+    def _update_cost(self, elapsed_ms: float, pairs: int) -> None:
+        """Обновляет оценку стоимости одной пары (экспоненциальное сглаживание)"""
+        if pairs == 0:
+            return
+        cost = elapsed_ms / pairs
+        self._ms_per_pair = cost if self._ms_per_pair is None else 0.8 * self._ms_per_pair + 0.2 * cost
+
+    def _fallback(self, candidates: List[Dict], top_n: int, elapsed_ms: float, reason: str) -> List[Dict]:
+        """Возвращает исходный порядок первого этапа"""
+        self.last_stats = {'elapsed_ms': round(elapsed_ms, 1), 'fallback': True, 'pairs': len(candidates)}
+        logger.warning(f"⏱ Переранжирование не уложилось в бюджет ({reason}), используется векторный порядок")
+        return candidates[:top_n]
@@ -1,7 +1,15 @@
 """
 Простой скрипт для просмотра статистики
 """
-from logger import AILogger
+import os
+import sys
+
+# Скрипт запускается из папки AI_helper — добавляем родительскую папку для импорта пакета
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from AI_helper.logger import AILogger, LATENCY_BINS_MS
 
 
 def main():
@@ -15,11 +23,34 @@ def main():
     stats = logger.get_stats(days=7)
     print(f"\n📈 За последние 7 дней:")
     print(f"  Всего запросов: {stats['total_requests']}")
-    print(f"  Среднее время ответа: {stats['avg_response_time_ms']} мс")
+    print(f"  Среднее время ответа: {stats['avg_response_time_ms']} мс "
+          f"(p50 ≤ {stats['response_time_p50_ms']} мс, p95 ≤ {stats['response_time_p95_ms']} мс)")
     print(f"  Средняя релевантность: {stats['avg_relevance']}")
     print(f"  👍 Положительных оценок: {stats['positive_feedback']}")
     print(f"  👎 Отрицательных оценок: {stats['negative_feedback']}")
     print(f"  Процент оценок: {stats['feedback_rate']}%")
+    print(f"  💾 Ответов из кэша: {stats['cache_hits']} ({stats['cache_hit_rate']}%), "
+          f"среднее время {stats['avg_cached_response_time_ms']} мс")
+    print(f"  ⚠️ Не найдено (низкая релевантность): {stats['low_relevance']}")
+    
+    # Гистограмма времени ответа
+    print(f"\n⏱ Время ответа:")
+    histogram = stats['latency_histogram']
+    peak = max(histogram) or 1
+    labels = [f"≤ {edge} мс" for edge in LATENCY_BINS_MS] + [f"> {LATENCY_BINS_MS[-1]} мс"]
+    for label, count in zip(labels, histogram):
+        print(f"  {label:>11} | {'█' * round(count / peak * 30):<30} {count}")
+    
+    # Этапы обработки запроса
+    stage_stats = logger.get_stage_stats(days=7)
+    if stage_stats:
+        print(f"\n🔬 Этапы обработки (мс, перцентили — с точностью ~20%):")
+        print(f"  {'Этап':<16} {'n':>6} {'сред.':>9} {'p50 ≤':>9} {'p95 ≤':>9} {'p99 ≤':>9}")
+        for name, s in stage_stats.items():
+            print(
+                f"  {name:<16} {s['count']:>6} {s['avg_ms']:>9} "
+                f"{s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9}"
+            )
     
     # Популярные вопросы
     print(f"\n🔥 Топ-10 вопросов:")
@@ -0,0 +1,98 @@
+"""
+Замер длительности этапов обработки запроса.
+
+Обработчик создаёт StageTimer и делает его текущим (activate); код
+конвейера отмечает этапы через timing.stage("имя") — без таймера это
+пустая операция, поэтому модули можно использовать и вне бота.
+Таймер хранится в contextvars: он виден в корутинах запроса и в потоках
+пула, если задача запущена через contextvars.copy_context().run.
+
+Повторный замер одного этапа в рамках запроса суммируется (например,
+несколько отправок в Telegram).
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+_current_timer: "contextvars.ContextVar[Optional[StageTimer]]" = contextvars.ContextVar(
+    "stage_timer", default=None
+)
+
+
+class StageTimer:
+    """Длительности этапов одного запроса в миллисекундах"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    def add(self, name: str, duration_ms: float) -> None:
+        """Добавляет длительность к этапу"""
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + duration_ms
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Замеряет блок кода как этап name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def elapsed_ms(self) -> float:
+        """Сколько прошло с создания таймера"""
+        return (time.perf_counter() - self._started) * 1000
+
+    def as_dict(self) -> Dict[str, float]:
+        """Снимок замеров {этап: мс}"""
+        with self._lock:
+            return {name: round(duration, 2) for name, duration in self._stages.items()}
+
+
+def activate(timer: StageTimer) -> contextvars.Token:
+    """Делает таймер текущим (до deactivate с полученным токеном)"""
+    return _current_timer.set(timer)
+
+
+def deactivate(token: contextvars.Token) -> None:
+    """Возвращает таймер, который был текущим до activate"""
+    _current_timer.reset(token)
+
+
+def current_timer() -> Optional[StageTimer]:
+    """Текущий таймер запроса (None вне запроса)"""
+    return _current_timer.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Замеряет этап в текущем таймере; без таймера ничего не делает"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+# === ТЕСТИРОВАНИЕ ===
+if __name__ == "__main__":
+    timer = StageTimer()
+    token = activate(timer)
+
+    with stage("embed"):
+        time.sleep(0.02)
+    with stage("vector_query"):
+        time.sleep(0.01)
+    with stage("embed"):
+        time.sleep(0.01)
+
+    deactivate(token)
+    with stage("ignored"):
+        pass
+
+    print(f"⏱ Этапы: {timer.as_dict()}, всего {timer.elapsed_ms():.1f} мс")
@@ -1,35 +1,70 @@
 """
 Векторное хранилище для поиска похожих документов.
-Использует ChromaDB.
+Использует ChromaDB или плоский NumPy-индекс (плотный поиск)
+и BM25 (разреженный поиск по терминам).
 """
+import os
+import hashlib
 import logging
-from typing import List, Dict
+import itertools
+from typing import List, Dict, Optional, Iterable, Iterator
 from pathlib import Path
+import numpy as np
 import chromadb
 from chromadb.config import Settings
 
-from .document_loader import DocumentChunk
+from .document_loader import DocumentChunk, DocumentLoader
 from .embeddings import EmbeddingModel
+from .embedding_cache import QueryEmbeddingCache
+from .embedding_dispatcher import EmbeddingDispatcher
+from .bm25_index import BM25Index
+from .flat_store import FlatClient
+from .timing import stage
 
 logger = logging.getLogger(__name__)
 
 
 class VectorStore:
-    """Векторное хранилище на базе ChromaDB"""
+    """Векторное хранилище на базе ChromaDB (или плоского NumPy-индекса)"""
     
-    def __init__(self, collection_name: str = "ai_knowledge", persist_directory: str = None):
+    def __init__(
+        self,
+        collection_name: str = "ai_knowledge",
+        persist_directory: str = None,
+        query_cache_size: int = 256,
+        query_cache_ttl: Optional[float] = None,
+        backend: str = None,
+        query_batch_size: int = 0,
+        query_batch_wait_ms: float = 5.0
+    ):
         """
         Args:
             collection_name: Название коллекции в ChromaDB
-            persist_directory: Папка для хранения БД (по умолчанию ./data/chroma_db/)
+            persist_directory: Папка для хранения БД
+                               (по умолчанию ./data/chroma_db/ или ./data/flat_index/)
+            query_cache_size: Размер LRU-кэша векторов запросов (0 — отключить)
+            query_cache_ttl: Время жизни векторов запросов в секундах (None — бессрочно)
+            backend: "chroma" или "flat" (memory-mapped NumPy, см. flat_store.py).
+                     По умолчанию берётся из переменной окружения VECTOR_BACKEND
+            query_batch_size: Объединять одновременные запросы в батчи до этого размера
+                              (0 — кодировать каждый запрос отдельно)
+            query_batch_wait_ms: Сколько ждать попутных запросов для батча
         """
+        self.backend = (backend or os.getenv("VECTOR_BACKEND", "chroma")).lower()
+        
         if persist_directory is None:
             current_dir = Path(__file__).parent
-            persist_directory = str(current_dir / "data" / "chroma_db")
+            folder = "flat_index" if self.backend == "flat" else "chroma_db"
+            persist_directory = str(current_dir / "data" / folder)
         
-        logger.info(f"Инициализация ChromaDB в {persist_directory}")
+        logger.info(f"Инициализация хранилища ({self.backend}) в {persist_directory}")
         
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        if self.backend == "flat":
+            self.client = FlatClient(path=persist_directory)
+        elif self.backend == "chroma":
+            self.client = chromadb.PersistentClient(path=persist_directory)
+        else:
+            raise ValueError(f"Неизвестный бэкенд хранилища: {self.backend}")
         
         # Получаем или создаём коллекцию
         try:
@@ -41,117 +76,653 @@ class VectorStore:
         
         # Модель embeddings
         self.embedder = EmbeddingModel()
+        
+        # Кэш векторов повторяющихся запросов
+        self.query_cache = (
+            QueryEmbeddingCache(max_size=query_cache_size, ttl_seconds=query_cache_ttl)
+            if query_cache_size > 0 else None
+        )
+        
+        # Микробатчирование одновременных запросов (см. embedding_dispatcher.py)
+        self.dispatcher = (
+            EmbeddingDispatcher(self.embedder, max_batch=query_batch_size, max_wait_ms=query_batch_wait_ms)
+            if query_batch_size > 1 else None
+        )
+        
+        # Разреженный BM25-индекс по тем же чанкам (строится при индексации)
+        self.sparse_index = BM25Index(path=Path(persist_directory) / f"{collection_name}_bm25.json")
+        if len(self.sparse_index) == 0 and self.collection.count() > 0:
+            self.rebuild_sparse_index()
+        
+        # Версия базы знаний: увеличивается при каждом изменении коллекции,
+        # по ней кэш ответов понимает, что сохранённые ответы устарели
+        self._version_path = Path(persist_directory) / f"{collection_name}_version.txt"
+        self._version = 0
+        self._version_mtime = None
     
-    def add_documents(self, chunks: List[DocumentChunk], batch_size: int = 100) -> None:
+    def add_documents(
+        self,
+        chunks: Iterable[DocumentChunk],
+        batch_size: int = 100,
+        ids: Optional[Iterable[str]] = None
+    ) -> int:
         """
         Добавляет документы в векторное хранилище (батчами)
         
+        Чанки читаются потоково: embeddings считаются и вставляются
+        батч за батчем, поэтому память ограничена размером батча,
+        а не всего корпуса. Можно передать генератор, например
+        loader.iter_chunks().
+        
+        ID чанков стабильные (зависят от файла, страницы и текста),
+        поэтому повторное добавление тех же чанков их перезаписывает, а не дублирует.
+        
         Args:
-            chunks: Список DocumentChunk
+            chunks: Чанки (список или генератор DocumentChunk)
             batch_size: Размер батча (по умолчанию 100, ChromaDB лимит ~166)
+            ids: Готовые ID чанков (по умолчанию вычисляются через make_chunk_id)
+        
+        Returns:
+            Количество добавленных чанков
         """
-        if not chunks:
+        total = self._add_stream(chunks, batch_size, ids)
+        self._persist(changed=total > 0)
+        return total
+    
+    def _add_stream(
+        self,
+        chunks: Iterable[DocumentChunk],
+        batch_size: int,
+        ids: Optional[Iterable[str]] = None
+    ) -> int:
+        """Потоковая вставка чанков в ChromaDB и BM25 (без сохранения BM25 на диск)"""
+        chunk_ids = iter(ids) if ids is not None else None
+        id_tracker = {}
+        total = 0
+        batch_num = 0
+        
+        logger.info("Добавление чанков в ChromaDB...")
+        
+        for batch_chunks in self._iter_batches(chunks, batch_size):
+            if chunk_ids is not None:
+                batch_ids = list(itertools.islice(chunk_ids, len(batch_chunks)))
+            else:
+                batch_ids = [self._next_chunk_id(chunk, id_tracker) for chunk in batch_chunks]
+            
+            texts = [chunk.text for chunk in batch_chunks]
+            batch_embeddings = self.embedder.embed_texts(texts, batch_size=32, show_progress=False)
+            
+            # Добавляем батч в ChromaDB
+            self.collection.upsert(
+                embeddings=batch_embeddings,
+                documents=texts,
+                metadatas=[self._chunk_metadata(chunk) for chunk in batch_chunks],
+                ids=batch_ids
+            )
+            
+            for chunk_id, text in zip(batch_ids, texts):
+                self.sparse_index.add(chunk_id, text)
+            
+            batch_num += 1
+            total += len(batch_chunks)
+            logger.info(f"✅ Добавлен батч {batch_num} ({len(batch_chunks)} документов, всего {total})")
+        
+        if total == 0:
             logger.warning("Нет документов для добавления")
-            return
+        else:
+            logger.info(f"✅ Всего добавлено {total} документов в ChromaDB")
+        
+        return total
+    
+    def sync_documents(
+        self,
+        loader: DocumentLoader,
+        chunk_size: int = 800,
+        chunk_overlap: int = 200,
+        batch_size: int = 100
+    ) -> Dict:
+        """
+        Инкрементально синхронизирует коллекцию с папкой документов
+        
+        Файлы с неизменившимся отпечатком пропускаются без парсинга.
+        Для изменившихся файлов добавляются только новые чанки,
+        исчезнувшие — удаляются. Чанки удалённых файлов удаляются целиком.
+        Изменившиеся файлы обрабатываются потоково, батчами по batch_size.
+        
+        Args:
+            loader: Загрузчик документов
+            chunk_size: Размер чанка в символах
+            chunk_overlap: Перекрытие между чанками
+            batch_size: Размер батча для вставки в ChromaDB
         
-        logger.info(f"Добавление {len(chunks)} чанков в ChromaDB...")
+        Returns:
+            Статистика синхронизации
+        """
+        stats = {
+            'files_unchanged': 0,
+            'files_changed': 0,
+            'files_removed': 0,
+            'chunks_added': 0,
+            'chunks_deleted': 0,
+            'chunks_kept': 0
+        }
         
-        # Создаём embeddings для ВСЕХ чанков сразу
-        texts = [chunk.text for chunk in chunks]
-        logger.info(f"Создание embeddings для {len(texts)} текстов...")
-        all_embeddings = self.embedder.embed_texts(texts, batch_size=32)
-        logger.info(f"✅ Embeddings созданы")
+        # Что уже лежит в коллекции: ID и отпечатки по каждому файлу
+        indexed: Dict[str, Dict] = {}
+        for chunk_id, metadata in self._iter_indexed(batch_size=1000):
+            source = metadata.get("source", "")
+            entry = indexed.setdefault(source, {"ids": set(), "hashes": set()})
+            entry["ids"].add(chunk_id)
+            entry["hashes"].add(metadata.get("file_hash"))
         
-        # Добавляем в ChromaDB батчами
-        total_batches = (len(chunks) + batch_size - 1) // batch_size
+        seen_sources = set()
         
-        for batch_idx in range(0, len(chunks), batch_size):
-            batch_chunks = chunks[batch_idx:batch_idx + batch_size]
-            batch_embeddings = all_embeddings[batch_idx:batch_idx + batch_size]
+        for file_path in loader.iter_files():
+            source = str(file_path)
+            seen_sources.add(source)
+            entry = indexed.get(source, {"ids": set(), "hashes": set()})
             
-            batch_texts = []
-            batch_metadatas = []
-            batch_ids = []
+            try:
+                file_hash = loader.file_fingerprint(file_path)
+            except Exception as e:
+                logger.error(f"Ошибка чтения {file_path}: {e}")
+                continue
             
-            for i, chunk in enumerate(batch_chunks):
-                global_idx = batch_idx + i
-                
-                # Создаём уникальный ID
-                chunk_id = f"{Path(chunk.source).stem}_chunk_{global_idx}"
-                batch_ids.append(chunk_id)
-                
-                # Текст
-                batch_texts.append(chunk.text)
-                
-                # Метаданные
-                metadata = {
-                    "source": chunk.source,
-                    "file_name": Path(chunk.source).name,
-                }
-                if chunk.page:
-                    metadata["page"] = chunk.page
-                if chunk.metadata:
-                    metadata.update(chunk.metadata)
+            if entry["hashes"] == {file_hash}:
+                stats['files_unchanged'] += 1
+                continue
+            
+            stats['files_changed'] += 1
+            file_ids = set()
+            new_pending = []
+            kept_pending = []
+            added = 0
+            id_tracker = {}
+            
+            try:
+                for chunk in loader.iter_file_chunks(file_path, chunk_size, chunk_overlap):
+                    chunk_id = self._next_chunk_id(chunk, id_tracker)
+                    file_ids.add(chunk_id)
+                    
+                    if chunk_id in entry["ids"]:
+                        # Текст в памяти не держим — только ID и метаданные
+                        kept_pending.append((chunk_id, self._chunk_metadata(chunk)))
+                    else:
+                        new_pending.append((chunk, chunk_id))
+                    
+                    if len(new_pending) >= batch_size:
+                        added += self._flush_new(new_pending, batch_size)
                 
-                batch_metadatas.append(metadata)
+                added += self._flush_new(new_pending, batch_size)
+            except Exception as e:
+                # Старые чанки файла не трогаем, чтобы не потерять их из-за ошибки парсинга
+                logger.error(f"Ошибка загрузки {file_path}: {e}")
+                stats['chunks_added'] += added
+                continue
             
-            # Добавляем батч в ChromaDB
-            self.collection.add(
-                embeddings=batch_embeddings,
-                documents=batch_texts,
-                metadatas=batch_metadatas,
-                ids=batch_ids
-            )
+            # Новый отпечаток у старых чанков ставим только после успешного разбора файла,
+            # иначе частично обработанный файл при следующей синхронизации пропустится
+            for batch_idx in range(0, len(kept_pending), batch_size):
+                batch = kept_pending[batch_idx:batch_idx + batch_size]
+                self.collection.update(
+                    ids=[chunk_id for chunk_id, _ in batch],
+                    metadatas=[metadata for _, metadata in batch]
+                )
+            kept = len(kept_pending)
+            
+            removed_ids = list(entry["ids"] - file_ids)
+            self._delete_ids(removed_ids, batch_size)
             
-            current_batch = (batch_idx // batch_size) + 1
-            logger.info(f"✅ Добавлен батч {current_batch}/{total_batches} ({len(batch_chunks)} документов)")
+            stats['chunks_added'] += added
+            stats['chunks_kept'] += kept
+            stats['chunks_deleted'] += len(removed_ids)
+            logger.info(
+                f"🔄 {file_path.name}: +{added} / -{len(removed_ids)} "
+                f"(без изменений {kept})"
+            )
+        
+        # Файлы, которых больше нет в папке
+        for source, entry in indexed.items():
+            if source not in seen_sources:
+                self._delete_ids(list(entry["ids"]), batch_size)
+                stats['files_removed'] += 1
+                stats['chunks_deleted'] += len(entry["ids"])
+                logger.info(f"🗑 Удалены чанки файла {Path(source).name} ({len(entry['ids'])} шт.)")
+        
+        self._persist(changed=any(
+            stats[key] for key in ('chunks_added', 'chunks_deleted', 'files_changed', 'files_removed')
+        ))
+        logger.info(f"✅ Синхронизация завершена: {stats}")
+        return stats
+    
+    def _flush_new(self, pending: List, batch_size: int) -> int:
+        """Добавляет накопленные новые чанки и очищает буфер"""
+        if not pending:
+            return 0
+        count = self._add_stream(
+            [chunk for chunk, _ in pending],
+            batch_size=batch_size,
+            ids=[chunk_id for _, chunk_id in pending]
+        )
+        pending.clear()
+        return count
+    
+    def _iter_indexed(self, batch_size: int = 1000) -> Iterator:
+        """Постранично отдаёт (id, metadata) всех чанков коллекции"""
+        offset = 0
+        while True:
+            page = self.collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+            if not page["ids"]:
+                break
+            for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+                yield chunk_id, metadata or {}
+            offset += len(page["ids"])
+    
+    @staticmethod
+    def _iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+        """Нарезает поток на списки по batch_size элементов"""
+        iterator = iter(items)
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                break
+            yield batch
+    
+    @staticmethod
+    def make_chunk_id(chunk: DocumentChunk, occurrence: int = 0) -> str:
+        """
+        Стабильный ID чанка по содержимому
+        
+        Args:
+            chunk: Чанк документа
+            occurrence: Порядковый номер одинакового чанка на той же странице
+        
+        Returns:
+            Хэш от пути файла, страницы и текста
+        """
+        payload = f"{chunk.source}\x00{chunk.page or 0}\x00{chunk.text}".encode("utf-8")
+        chunk_id = hashlib.sha1(payload).hexdigest()
+        return f"{chunk_id}_{occurrence}" if occurrence else chunk_id
+    
+    def _next_chunk_id(self, chunk: DocumentChunk, tracker: Dict) -> str:
+        """
+        ID очередного чанка в потоке (повторяющиеся тексты получают суффикс)
         
-        logger.info(f"✅ Всего добавлено {len(chunks)} документов в ChromaDB")
+        Счётчик повторов ведётся в пределах одной страницы файла и
+        сбрасывается при переходе к следующей, поэтому не растёт с корпусом.
+        """
+        page_key = (chunk.source, chunk.page)
+        if tracker.get("page") != page_key:
+            tracker["page"] = page_key
+            tracker["seen"] = {}
+        
+        base_id = self.make_chunk_id(chunk)
+        occurrence = tracker["seen"].get(base_id, 0)
+        tracker["seen"][base_id] = occurrence + 1
+        return self.make_chunk_id(chunk, occurrence)
+    
+    @staticmethod
+    def _chunk_metadata(chunk: DocumentChunk) -> Dict:
+        """Метаданные чанка для ChromaDB"""
+        metadata = {
+            "source": chunk.source,
+            "file_name": Path(chunk.source).name,
+        }
+        if chunk.page:
+            metadata["page"] = chunk.page
+        if chunk.metadata:
+            metadata.update(chunk.metadata)
+        return metadata
+    
+    def _delete_ids(self, ids: List[str], batch_size: int = 100) -> None:
+        """Удаляет чанки по ID (батчами)"""
+        for batch_idx in range(0, len(ids), batch_size):
+            self.collection.delete(ids=ids[batch_idx:batch_idx + batch_size])
+        
+        for chunk_id in ids:
+            self.sparse_index.remove(chunk_id)
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+    def _persist(self, changed: bool = True) -> None:
+        """
+        Сохраняет BM25-индекс и (для плоского бэкенда) накопленные изменения коллекции
+        
+        Args:
+            changed: Коллекция изменилась — увеличить версию базы знаний
+        """
+        self.sparse_index.save()
+        if self.backend == "flat":
+            self.collection.persist()
+        if changed:
+            self._bump_index_version()
+    
+    @property
+    def index_version(self) -> int:
+        """Текущая версия базы знаний (перечитывается, если файл обновил другой процесс)"""
+        if not self._version_path.exists():
+            return 0
+        
+        mtime = self._version_path.stat().st_mtime
+        if mtime != self._version_mtime:
+            try:
+                self._version = int(self._version_path.read_text(encoding="utf-8").strip() or 0)
+            except ValueError:
+                self._version = 0
+            self._version_mtime = mtime
+        
+        return self._version
+    
+    def _bump_index_version(self) -> None:
+        """Увеличивает версию базы знаний (атомарно, через временный файл)"""
+        version = self.index_version + 1
+        tmp_path = self._version_path.with_suffix(".tmp")
+        tmp_path.write_text(str(version), encoding="utf-8")
+        os.replace(tmp_path, self._version_path)
+        logger.info(f"🔖 Версия базы знаний: {version}")
+    
+    def rebuild_sparse_index(self, batch_size: int = 1000) -> None:
+        """Строит BM25-индекс заново по текстам, уже лежащим в коллекции"""
+        logger.info("Построение BM25-индекса по коллекции...")
+        self.sparse_index.clear()
+        
+        offset = 0
+        while True:
+            page = self.collection.get(include=["documents"], limit=batch_size, offset=offset)
+            if not page["ids"]:
+                break
+            for chunk_id, text in zip(page["ids"], page["documents"]):
+                self.sparse_index.add(chunk_id, text or "")
+            offset += len(page["ids"])
+        
+        self.sparse_index.save()
+        logger.info(f"✅ BM25-индекс построен ({len(self.sparse_index)} документов)")
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        mode: str = "dense",
+        alpha: float = 0.5,
+        candidates: int = None
+    ) -> List[Dict]:
         """
         Ищет наиболее релевантные документы
         
         Args:
             query: Поисковый запрос
             top_k: Количество результатов
+            mode: "dense" — только векторный поиск,
+                  "hybrid" — векторный + BM25 со слиянием оценок
+            alpha: Вес векторной оценки в гибридном режиме (0..1)
+            candidates: Сколько кандидатов брать с каждой стороны в гибридном режиме
+                        (по умолчанию 3 * top_k)
         
         Returns:
-            Список словарей с полями: text, source, score, metadata
+            Список словарей с полями: text, source, score, metadata.
+            score — всегда векторная близость (пороги релевантности не меняются),
+            в гибридном режиме добавляются sparse_score и fused_score
         """
-        logger.info(f"Поиск по запросу: '{query}'")
-        
-        # Создаём embedding запроса
-        query_embedding = self.embedder.embed_text(query)
-        
-        # Ищем в ChromaDB
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            include=["documents", "metadatas", "distances"]
-        )
+        logger.info(f"Поиск по запросу: '{query}' (режим: {mode})")
         
-        # Форматируем результаты
-        formatted_results = []
+        # Создаём embedding запроса (или берём из кэша)
+        query_embedding = self.embed_query(query)
         
-        for i in range(len(results["documents"][0])):
-            formatted_results.append({
-                "text": results["documents"][0][i],
-                "source": results["metadatas"][0][i].get("source", "Unknown"),
-                "file_name": results["metadatas"][0][i].get("file_name", "Unknown"),
-                "page": results["metadatas"][0][i].get("page"),
-                "score": 1 - results["distances"][0][i],
-                "metadata": results["metadatas"][0][i]
-            })
+        if mode == "hybrid":
+            formatted_results = self._hybrid_search(query, query_embedding, top_k, alpha, candidates)
+        elif mode == "dense":
+            formatted_results = self._dense_search(query_embedding, top_k)
+        else:
+            raise ValueError(f"Неизвестный режим поиска: {mode}")
         
         logger.info(f"✅ Найдено {len(formatted_results)} результатов")
         return formatted_results
     
+    def _dense_search(self, query_embedding: List[float], top_k: int) -> List[Dict]:
+        """Векторный поиск в коллекции (ChromaDB или плоский индекс)"""
+        with stage("vector_query"):
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=top_k,
+                include=["documents", "metadatas", "distances"]
+            )
+        
+        return [
+            self._format_result(
+                results["ids"][0][i],
+                results["documents"][0][i],
+                results["metadatas"][0][i],
+                1 - results["distances"][0][i]
+            )
+            for i in range(len(results["documents"][0]))
+        ]
+    
+    def _hybrid_search(
+        self,
+        query: str,
+        query_embedding: List[float],
+        top_k: int,
+        alpha: float,
+        candidates: Optional[int]
+    ) -> List[Dict]:
+        """Объединяет кандидатов векторного и BM25-поиска и ранжирует по взвешенной оценке"""
+        n_candidates = candidates or top_k * 3
+        
+        with stage("bm25"):
+            self.sparse_index.reload_if_changed()
+            sparse_hits = dict(self.sparse_index.search(query, top_k=n_candidates))
+        
+        dense_hits = {
+            result["id"]: result
+            for result in self._dense_search(query_embedding, n_candidates)
+        }
+        
+        # Найденные только BM25: достаём текст и вектор, считаем ту же векторную оценку
+        missing_ids = [doc_id for doc_id in sparse_hits if doc_id not in dense_hits]
+        dense_hits.update(self._score_by_ids(missing_ids, [query_embedding]))
+        
+        if not dense_hits:
+            return []
+        
+        dense_scores = {doc_id: result["score"] for doc_id, result in dense_hits.items()}
+        dense_norm = self._min_max(dense_scores)
+        sparse_norm = self._min_max({doc_id: sparse_hits.get(doc_id, 0.0) for doc_id in dense_hits})
+        
+        for doc_id, result in dense_hits.items():
+            result["sparse_score"] = sparse_hits.get(doc_id, 0.0)
+            result["fused_score"] = alpha * dense_norm[doc_id] + (1 - alpha) * sparse_norm[doc_id]
+        
+        ranked = sorted(dense_hits.values(), key=lambda r: r["fused_score"], reverse=True)
+        return ranked[:top_k]
+    
+    def _score_by_ids(self, ids: List[str], query_embeddings: List[List[float]]) -> Dict[str, Dict]:
+        """
+        Результаты для документов, найденных не векторным поиском (например, BM25)
+        
+        score — лучшая векторная близость среди запросов, в той же шкале,
+        что у ChromaDB (квадрат L2-расстояния): score = 1 - distance
+        """
+        if not ids:
+            return {}
+        
+        extra = self.collection.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+        query_matrix = np.asarray(query_embeddings, dtype=np.float32)
+        results = {}
+        
+        for doc_id, text, metadata, embedding in zip(
+            extra["ids"], extra["documents"], extra["metadatas"], extra["embeddings"]
+        ):
+            distances = np.sum((np.asarray(embedding, dtype=np.float32) - query_matrix) ** 2, axis=1)
+            results[doc_id] = self._format_result(doc_id, text, metadata, 1 - float(distances.min()))
+        
+        return results
+    
+    def search_multi(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        mode: str = "dense",
+        candidates: int = None,
+        rrf_k: int = 60
+    ) -> List[Dict]:
+        """
+        Поиск по нескольким формулировкам запроса с reciprocal rank fusion
+        
+        Все варианты кодируются одним батчем и отправляются одним
+        запросом к коллекции, списки результатов объединяются по RRF:
+        fused = Σ 1 / (rrf_k + rank).
+        
+        Args:
+            queries: Варианты запроса (см. QueryProcessor.variants)
+            top_k: Количество результатов
+            mode: "dense" — только векторные списки,
+                  "hybrid" — плюс BM25-список для каждого варианта
+            candidates: Длина каждого списка перед слиянием (по умолчанию 3 * top_k)
+            rrf_k: Константа сглаживания RRF
+        
+        Returns:
+            Список в формате search(); score — лучшая векторная близость
+            среди вариантов, добавляется rrf_score
+        """
+        if mode not in ("dense", "hybrid"):
+            raise ValueError(f"Неизвестный режим поиска: {mode}")
+        
+        if len(queries) == 1:
+            return self.search(queries[0], top_k=top_k, mode=mode, candidates=candidates)
+        
+        logger.info(f"Поиск по {len(queries)} вариантам запроса (режим: {mode})")
+        n_candidates = candidates or top_k * 3
+        
+        query_embeddings = self._embed_queries(queries)
+        
+        with stage("vector_query"):
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_candidates,
+                include=["documents", "metadatas", "distances"]
+            )
+        
+        hits: Dict[str, Dict] = {}
+        rrf_scores: Dict[str, float] = {}
+        
+        for q in range(len(queries)):
+            for rank, doc_id in enumerate(results["ids"][q], 1):
+                score = 1 - results["distances"][q][rank - 1]
+                rrf_scores[doc_id] = rrf_scores.get(doc_id, 0.0) + 1 / (rrf_k + rank)
+                
+                if doc_id not in hits or score > hits[doc_id]["score"]:
+                    hits[doc_id] = self._format_result(
+                        doc_id,
+                        results["documents"][q][rank - 1],
+                        results["metadatas"][q][rank - 1],
+                        score
+                    )
+        
+        if mode == "hybrid":
+            with stage("bm25"):
+                self.sparse_index.reload_if_changed()
+                for query in queries:
+                    for rank, (doc_id, _) in enumerate(self.sparse_index.search(query, top_k=n_candidates), 1):
+                        rrf_scores[doc_id] = rrf_scores.get(doc_id, 0.0) + 1 / (rrf_k + rank)
+            
+            missing_ids = [doc_id for doc_id in rrf_scores if doc_id not in hits]
+            hits.update(self._score_by_ids(missing_ids, query_embeddings))
+        
+        for doc_id, result in hits.items():
+            result["rrf_score"] = rrf_scores[doc_id]
+        
+        ranked = sorted(hits.values(), key=lambda r: r["rrf_score"], reverse=True)[:top_k]
+        logger.info(f"✅ Найдено {len(ranked)} результатов")
+        return ranked
+    
+    @staticmethod
+    def _min_max(scores: Dict[str, float]) -> Dict[str, float]:
+        """Нормализует оценки в диапазон 0..1"""
+        if not scores:
+            return {}
+        low, high = min(scores.values()), max(scores.values())
+        if high - low < 1e-9:
+            return {key: 1.0 if high > 0 else 0.0 for key in scores}
+        return {key: (value - low) / (high - low) for key, value in scores.items()}
+    
+    @staticmethod
+    def _format_result(doc_id: str, text: str, metadata: Dict, score: float) -> Dict:
+        """Результат поиска в общем формате"""
+        metadata = metadata or {}
+        return {
+            "id": doc_id,
+            "text": text,
+            "source": metadata.get("source", "Unknown"),
+            "file_name": metadata.get("file_name", "Unknown"),
+            "page": metadata.get("page"),
+            "score": score,
+            "metadata": metadata
+        }
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Возвращает embedding запроса, используя LRU-кэш"""
+        with stage("embed"):
+            if self.query_cache is None:
+                return self._encode_query(query)
+            
+            query_embedding = self.query_cache.get(query)
+            if query_embedding is None:
+                query_embedding = self._encode_query(query)
+                self.query_cache.put(query, query_embedding)
+            
+            return query_embedding
+    
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embeddings нескольких запросов: промахи LRU-кэша кодируются одним батчем"""
+        if self.query_cache is not None:
+            cached = [self.query_cache.get(query) for query in queries]
+        else:
+            cached = [None] * len(queries)
+        missing = [query for query, vector in zip(queries, cached) if vector is None]
+        
+        if missing:
+            with stage("embed"):
+                if self.dispatcher is not None:
+                    vectors = self.dispatcher.embed_many(missing)
+                else:
+                    vectors = self.embedder.embed_texts(
+                        missing,
+                        batch_size=len(missing),
+                        show_progress=False,
+                        use_cache=False
+                    )
+            computed = dict(zip(missing, vectors))
+            if self.query_cache is not None:
+                for query, vector in computed.items():
+                    self.query_cache.put(query, vector)
+            cached = [vector if vector is not None else computed[query] for query, vector in zip(queries, cached)]
+        
+        return cached
+    
+    def _encode_query(self, query: str) -> List[float]:
+        """Кодирует запрос моделью (через диспетчер батчей, если он включён)"""
+        if self.dispatcher is not None:
+            return self.dispatcher.embed(query)
+        return self.embedder.embed_text(query)
+    
+    def get_cache_stats(self) -> Dict:
+        """Статистика кэшей embeddings (запросов и чанков) и батчирования запросов"""
+        return {
+            'query_cache': self.query_cache.get_stats() if self.query_cache else None,
+            'embedding_cache': self.embedder.get_cache_stats(),
+            'query_batching': self.dispatcher.get_stats() if self.dispatcher else None
+        }
+    
+    def close(self) -> None:
+        """Останавливает фоновые потоки хранилища"""
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+    
     def clear_collection(self) -> None:
         """Очищает всю коллекцию"""
         logger.warning(f"Очистка коллекции '{self.collection.name}'")
         self.client.delete_collection(name=self.collection.name)
         self.collection = self.client.create_collection(name=self.collection.name)
+        self.sparse_index.clear()
+        self._persist()
         logger.info("✅ Коллекция очищена")
     
     def get_count(self) -> int:
@@ -165,11 +736,9 @@ if __name__ == "__main__":
     
     from AI_helper.document_loader import DocumentLoader
     
-    # Загружаем документы
     loader = DocumentLoader()
-    documents = loader.load_all_documents(chunk_size=500, chunk_overlap=50)
     
-    if not documents:
+    if not loader.iter_files():
         print("❌ Нет документов для индексации!")
         print("Положите PDF/DOCX/TXT файлы в AI_helper/data/ai_knowledge/")
         exit(1)
@@ -177,11 +746,15 @@ if __name__ == "__main__":
     # Создаём векторное хранилище
     vector_store = VectorStore()
     
-    # Очищаем старые данные (если нужно)
+    # Полная переиндексация (если нужно):
     # vector_store.clear_collection()
     
-    # Добавляем документы
-    vector_store.add_documents(documents)
+    # Инкрементальная синхронизация: парсим и добавляем только изменившееся
+    vector_store.sync_documents(loader)
+    
+    # Полная потоковая загрузка (после clear_collection),
+    # документы разбираются параллельно на всех ядрах:
+    # vector_store.add_documents(loader.iter_chunks(workers=os.cpu_count()))
     
     # Тестовый поиск
     print("\n" + "="*50)
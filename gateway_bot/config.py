@@ -44,6 +44,66 @@ class Config:
     # Для обратной совместимости с Tabel_service
     ADMIN_TELEGRAM_IDS = ADMIN_USERS  # ← ДОБАВИЛИ!
     
+    # === AI-ПОМОЩНИК ===
+    # Потоков для поиска и генерации (вне event loop)
+    AI_MAX_WORKERS = int(os.getenv("AI_MAX_WORKERS", 4))
+    # Загружать модель и индекс при старте бота, а не на первом вопросе
+    AI_WARMUP = os.getenv("AI_WARMUP", "1") == "1"
+    # Поиск: "hybrid" (векторный + BM25) находит точные термины и номера пунктов,
+    # поэтому в промпт достаточно отдавать меньше документов
+    AI_SEARCH_MODE = os.getenv("AI_SEARCH_MODE", "hybrid")
+    AI_TOP_K = int(os.getenv("AI_TOP_K", 5))
+    # Поиск по нескольким формулировкам (исходная, с расшифровкой сокращений, с синонимами)
+    AI_MULTI_QUERY = os.getenv("AI_MULTI_QUERY", "1") == "1"
+    # Переранжирование кросс-энкодером: из AI_RERANK_CANDIDATES кандидатов
+    # оставляем AI_TOP_K лучших, если укладываемся в AI_RERANK_BUDGET_MS
+    AI_RERANK = os.getenv("AI_RERANK", "0") == "1"
+    AI_RERANK_CANDIDATES = int(os.getenv("AI_RERANK_CANDIDATES", 20))
+    AI_RERANK_BUDGET_MS = float(os.getenv("AI_RERANK_BUDGET_MS", 300))
+    # Одновременные вопросы кодируются одним батчем: до AI_EMBED_BATCH запросов,
+    # ожидание попутных — не дольше AI_EMBED_WAIT_MS (AI_EMBED_BATCH=1 — отключить)
+    AI_EMBED_BATCH = int(os.getenv("AI_EMBED_BATCH", 16))
+    AI_EMBED_WAIT_MS = float(os.getenv("AI_EMBED_WAIT_MS", 5))
+    # Семантический кэш ответов: вопрос, близкий к уже отвеченному (косинус ≥ порога
+    # и те же числа / уровень, форма, основа обучения — answer_cache.key_terms),
+    # получает сохранённый ответ без поиска и LLM, пока база знаний не изменилась
+    AI_ANSWER_CACHE = os.getenv("AI_ANSWER_CACHE", "1") == "1"
+    AI_ANSWER_CACHE_THRESHOLD = float(os.getenv("AI_ANSWER_CACHE_THRESHOLD", 0.95))
+    AI_ANSWER_CACHE_SIZE = int(os.getenv("AI_ANSWER_CACHE_SIZE", 1000))
+    AI_ANSWER_CACHE_TTL = float(os.getenv("AI_ANSWER_CACHE_TTL", 6 * 3600))
+    # Показывать ответ по мере генерации, редактируя сообщение не чаще раза
+    # в AI_STREAM_EDIT_INTERVAL секунд (лимит Telegram на редактирование)
+    AI_STREAM = os.getenv("AI_STREAM", "1") == "1"
+    AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", 1.0))
+    # Устойчивость вызовов YandexGPT: таймаут запроса (для потока — паузы между
+    # фрагментами, а не всего ответа), повторы при 429/5xx,
+    # дублирующий запрос (для потока — дублирующий поток) после p95 времени ответа
+    # или первого фрагмента, обрыв потока без первого фрагмента за
+    # AI_LLM_FIRST_CHUNK_TIMEOUT секунд, размыкание цепи после серии ошибок
+    AI_LLM_TIMEOUT = float(os.getenv("AI_LLM_TIMEOUT", 20))
+    AI_LLM_FIRST_CHUNK_TIMEOUT = float(os.getenv("AI_LLM_FIRST_CHUNK_TIMEOUT", 8))
+    AI_LLM_RETRIES = int(os.getenv("AI_LLM_RETRIES", 2))
+    AI_LLM_HEDGE = os.getenv("AI_LLM_HEDGE", "1") == "1"
+    AI_LLM_BREAKER_FAILURES = int(os.getenv("AI_LLM_BREAKER_FAILURES", 5))
+    AI_LLM_BREAKER_COOLDOWN = float(os.getenv("AI_LLM_BREAKER_COOLDOWN", 30))
+    # Бюджет промпта в токенах: документы добавляются, пока помещаются в
+    # AI_INPUT_TOKENS (с учётом системного промпта и до AI_HISTORY_TOKENS истории),
+    # на ответ запрашивается AI_OUTPUT_TOKENS
+    AI_INPUT_TOKENS = int(os.getenv("AI_INPUT_TOKENS", 6000))
+    AI_OUTPUT_TOKENS = int(os.getenv("AI_OUTPUT_TOKENS", 1500))
+    AI_HISTORY_TOKENS = int(os.getenv("AI_HISTORY_TOKENS", 1000))
+    # Сколько последних пар «вопрос — ответ» хранить дословно; более старые
+    # сворачиваются в короткие факты в пределах AI_HISTORY_TOKENS
+    AI_HISTORY_RECENT_TURNS = int(os.getenv("AI_HISTORY_RECENT_TURNS", 2))
+    # Хранение логов AI: записи старше AI_LOG_RETENTION_DAYS (0 — не архивировать)
+    # раз в AI_LOG_ARCHIVE_INTERVAL_HOURS переносятся в помесячные архивы
+    # формата AI_LOG_ARCHIVE_FORMAT ("sqlite" или "jsonl.gz")
+    AI_LOG_RETENTION_DAYS = int(os.getenv("AI_LOG_RETENTION_DAYS", 90))
+    AI_LOG_ARCHIVE_INTERVAL_HOURS = float(os.getenv("AI_LOG_ARCHIVE_INTERVAL_HOURS", 24))
+    AI_LOG_ARCHIVE_FORMAT = os.getenv("AI_LOG_ARCHIVE_FORMAT", "sqlite")
+    # Сколько секунд обработчик ждёт записи запроса в лог (ради ID для кнопок оценки)
+    AI_LOG_WRITE_TIMEOUT = float(os.getenv("AI_LOG_WRITE_TIMEOUT", 2))
+    
     # === ПУТИ ===
     BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     DOCUMENTS_DIR = os.path.join(BASE_DIR, "gateway_bot", "data", "documents")
@@ -3,11 +3,19 @@
 """
 import sys
 import os
+import html
 import time
+import asyncio
 import logging
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
 from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter, TelegramAPIError
 
 # Добавляем путь к AI_helper
 parent_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -15,8 +23,16 @@ if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
 from AI_helper.assistant import AIAssistant
+from AI_helper.vector_store import VectorStore
+from AI_helper.reranker import CrossEncoderReranker
+from AI_helper.answer_cache import SemanticAnswerCache
+from AI_helper.llm import YandexGPT, ResilientLLM, CircuitBreaker, LLMUnavailableError
 from AI_helper.query_processor import QueryProcessor
+from AI_helper.context_builder import ContextBuilder
+from AI_helper.history_manager import HistoryManager
 from AI_helper.logger import AILogger
+from AI_helper.timing import StageTimer, activate, deactivate, current_timer, stage
+from config import config
 from states import BotStates
 from keyboards import get_ai_menu
 
@@ -24,25 +40,259 @@ logger = logging.getLogger(__name__)
 
 # Создаём один экземпляр AI Assistant
 ai_assistant = None
+_ai_assistant_lock = threading.Lock()
 
 query_processor = QueryProcessor()
+context_builder = ContextBuilder(
+    input_budget=config.AI_INPUT_TOKENS,
+    output_tokens=config.AI_OUTPUT_TOKENS,
+    history_tokens=config.AI_HISTORY_TOKENS
+)
+history_manager = HistoryManager(
+    max_tokens=config.AI_HISTORY_TOKENS,
+    recent_turns=config.AI_HISTORY_RECENT_TURNS,
+    counter=context_builder.counter
+)
 
 # Создаём экземпляр логгера
-ai_logger = AILogger()
+ai_logger = AILogger(archive_format=config.AI_LOG_ARCHIVE_FORMAT)
+
+# Ограниченный пул потоков для поиска и генерации,
+# чтобы долгие запросы к AI не блокировали event loop бота
+ai_executor = ThreadPoolExecutor(max_workers=config.AI_MAX_WORKERS, thread_name_prefix="ai")
+
+# Текущий этап AI-запроса каждого пользователя (для отмены)
+active_requests: Dict[int, asyncio.Future] = {}
+
+# Состояние прогрева: "idle" → "loading" → "ready" / "failed"
+ai_status = "idle"
 
 
 def get_ai_assistant():
     """Ленивая инициализация AI Assistant"""
     global ai_assistant
-    if ai_assistant is None:
-        logger.info("🤖 Инициализация AI Assistant...")
-        print("🤖 Инициализация AI Assistant...")
-        ai_assistant = AIAssistant(top_k=10)
-        logger.info("✅ AI Assistant готов!")
-        print("✅ AI Assistant готов!")
+    # Может вызываться из нескольких потоков пула одновременно
+    with _ai_assistant_lock:
+        if ai_assistant is None:
+            logger.info("🤖 Инициализация AI Assistant...")
+            print("🤖 Инициализация AI Assistant...")
+            llm = ResilientLLM(
+                YandexGPT(timeout=config.AI_LLM_TIMEOUT),
+                max_retries=config.AI_LLM_RETRIES,
+                hedge=config.AI_LLM_HEDGE,
+                first_chunk_timeout=config.AI_LLM_FIRST_CHUNK_TIMEOUT,
+                breaker=CircuitBreaker(
+                    failure_threshold=config.AI_LLM_BREAKER_FAILURES,
+                    recovery_timeout=config.AI_LLM_BREAKER_COOLDOWN
+                )
+            )
+            ai_assistant = AIAssistant(
+                llm=llm,
+                vector_store=VectorStore(
+                    query_batch_size=config.AI_EMBED_BATCH,
+                    query_batch_wait_ms=config.AI_EMBED_WAIT_MS
+                ),
+                top_k=config.AI_TOP_K,
+                search_mode=config.AI_SEARCH_MODE,
+                reranker=CrossEncoderReranker() if config.AI_RERANK else None,
+                rerank_candidates=config.AI_RERANK_CANDIDATES,
+                rerank_budget_ms=config.AI_RERANK_BUDGET_MS,
+                answer_cache=SemanticAnswerCache(
+                    threshold=config.AI_ANSWER_CACHE_THRESHOLD,
+                    max_size=config.AI_ANSWER_CACHE_SIZE,
+                    ttl_seconds=config.AI_ANSWER_CACHE_TTL
+                ) if config.AI_ANSWER_CACHE else None
+            )
+            logger.info("✅ AI Assistant готов!")
+            print("✅ AI Assistant готов!")
     return ai_assistant
 
 
+async def run_ai_stage(user_id: int, func, *args, **kwargs):
+    """
+    Выполняет блокирующий этап AI-конвейера в пуле потоков
+    
+    Этап можно отменить через cancel_ai_request(user_id):
+    ожидание прерывается с asyncio.CancelledError, результат отбрасывается.
+    Контекст (таймер этапов запроса) передаётся в поток пула.
+    """
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(ai_executor, functools.partial(context.run, func, *args, **kwargs))
+    active_requests[user_id] = future
+    
+    try:
+        return await future
+    finally:
+        if active_requests.get(user_id) is future:
+            del active_requests[user_id]
+
+
+async def run_ai_coroutine(user_id: int, coroutine):
+    """
+    Выполняет асинхронный этап AI-конвейера (например, llm.agenerate)
+    
+    Отменяется так же, как run_ai_stage, через cancel_ai_request(user_id);
+    отмена прерывает и сам HTTP-запрос.
+    """
+    task = asyncio.ensure_future(coroutine)
+    active_requests[user_id] = task
+    
+    try:
+        return await task
+    finally:
+        if active_requests.get(user_id) is task:
+            del active_requests[user_id]
+
+
+async def stream_ai_answer(user_id: int, status_msg: types.Message, llm, messages, **kwargs) -> str:
+    """
+    Генерирует ответ потоково и показывает его по мере готовности
+    
+    Поток ответа читается отдельной задачей, а обработчик раз в
+    AI_STREAM_EDIT_INTERVAL секунд редактирует статусное сообщение
+    последним накопленным текстом. Отмена — как у run_ai_stage.
+    
+    Returns:
+        Полный текст ответа
+    """
+    latest = {'text': ""}
+    timer = current_timer()
+    
+    async def consume() -> str:
+        started = time.perf_counter()
+        async for text in llm.agenerate_stream(messages, **kwargs):
+            if not latest['text'] and timer is not None:
+                timer.add("llm_first_token", (time.perf_counter() - started) * 1000)
+            latest['text'] = text
+        return latest['text']
+    
+    loop = asyncio.get_event_loop()
+    future = asyncio.ensure_future(consume())
+    active_requests[user_id] = future
+    
+    shown = ""
+    next_edit = 0.0
+    
+    try:
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=config.AI_STREAM_EDIT_INTERVAL)
+            if done:
+                return future.result()
+            
+            text = latest['text']
+            if not text or text == shown or loop.time() < next_edit:
+                continue
+            
+            # Без parse_mode: незавершённый текст может содержать незакрытую разметку
+            preview = text if len(text) <= 4000 else "…" + text[-4000:]
+            try:
+                await status_msg.edit_text(f"{preview} ▌")
+                shown = text
+            except MessageNotModified:
+                shown = text
+            except RetryAfter as e:
+                next_edit = loop.time() + e.timeout
+            except TelegramAPIError as e:
+                logger.warning(f"Не удалось обновить сообщение с ответом: {e}")
+    finally:
+        if not future.done():
+            future.cancel()
+        if active_requests.get(user_id) is future:
+            del active_requests[user_id]
+
+
+def cancel_ai_request(user_id: int) -> bool:
+    """Отменяет выполняющийся AI-запрос пользователя"""
+    future = active_requests.pop(user_id, None)
+    if future is None or future.done():
+        return False
+    
+    future.cancel()
+    logger.info(f"⛔ AI-запрос пользователя {user_id} отменён")
+    return True
+
+
+def warm_up_ai_assistant() -> float:
+    """
+    Загружает модель, открывает коллекцию и делает пробный поиск
+    
+    Returns:
+        Время прогрева в секундах
+    """
+    start = time.perf_counter()
+    assistant = get_ai_assistant()
+    assistant.vector_store.search(query_processor.process("какие документы нужны"), top_k=1)
+    return time.perf_counter() - start
+
+
+async def start_warm_up():
+    """Фоновый прогрев AI-помощника при запуске бота"""
+    global ai_status
+    ai_status = "loading"
+    logger.info("🔥 Прогрев AI-помощника...")
+    
+    try:
+        loop = asyncio.get_event_loop()
+        elapsed = await loop.run_in_executor(ai_executor, warm_up_ai_assistant)
+    except Exception as e:
+        # Не критично: помощник попробует инициализироваться на первом вопросе
+        ai_status = "failed"
+        logger.error(f"❌ Ошибка прогрева AI-помощника: {e}", exc_info=True)
+        return
+    
+    ai_status = "ready"
+    logger.info(f"⏱ [startup] AI-помощник прогрет за {elapsed:.1f} с")
+
+
+async def log_retention_loop():
+    """Периодически переносит старые записи лога AI в архив"""
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            await loop.run_in_executor(
+                None, functools.partial(ai_logger.archive_old_requests, config.AI_LOG_RETENTION_DAYS)
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка архивации лога AI: {e}", exc_info=True)
+        await asyncio.sleep(config.AI_LOG_ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+async def log_ai_request(**kwargs):
+    """
+    Записывает запрос в лог и возвращает его ID для кнопок оценки
+    
+    Ожидание ограничено AI_LOG_WRITE_TIMEOUT: при медленном диске или
+    ошибке записи ответ пользователю не задерживается (возвращается None).
+    """
+    try:
+        return await asyncio.wait_for(
+            asyncio.wrap_future(ai_logger.submit_request(**kwargs)),
+            timeout=config.AI_LOG_WRITE_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"⚠️ Запись в лог AI не успела за {config.AI_LOG_WRITE_TIMEOUT} с")
+    except Exception as e:
+        logger.error(f"❌ Не удалось залогировать запрос: {e}")
+    return None
+
+
+async def shutdown_ai() -> None:
+    """Останавливает пул потоков, фоновые потоки, лог запросов и HTTP-сессии AI-помощника"""
+    # Не ждём зависшие запросы к AI — их результаты уже никому не нужны
+    ai_executor.shutdown(wait=False)
+    # Дописываем очередь логов на диск
+    ai_logger.close()
+    if ai_assistant is not None:
+        ai_assistant.vector_store.close()
+        await ai_assistant.llm.aclose()
+
+
+def is_ai_ready() -> bool:
+    """Готов ли AI-помощник отвечать без задержки на загрузку"""
+    return ai_status == "ready" or ai_assistant is not None
+
+
 def get_dialog_keyboard():
     """Клавиатура для диалога с AI"""
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
@@ -58,8 +308,18 @@ async def ai_menu_handler(message: types.Message, state: FSMContext):
     text = message.text
     
     if text == "❓ Задать вопрос":
+        if ai_status == "loading" and not is_ai_ready():
+            await message.answer(
+                "⏳ <b>Помощник загружается…</b>\n\n"
+                "Модель и база знаний ещё загружаются после запуска бота. "
+                "Попробуйте через минуту.",
+                parse_mode="HTML",
+                reply_markup=get_ai_menu()
+            )
+            return
+        
         # Очищаем историю при начале нового диалога
-        await state.update_data(ai_history=[])
+        await state.update_data(ai_history=[], ai_history_facts=[])
         
         await message.answer(
             "🤖 <b>Диалог начат!</b>\n\n"
@@ -75,7 +335,7 @@ async def ai_menu_handler(message: types.Message, state: FSMContext):
         await BotStates.ai_asking.set()
     
     elif text == "🧹 Очистить историю":
-        await state.update_data(ai_history=[], ai_questions_count=0)
+        await state.update_data(ai_history=[], ai_history_facts=[], ai_questions_count=0)
         await message.answer(
             "✅ История диалога очищена!",
             reply_markup=get_ai_menu()
@@ -85,13 +345,35 @@ async def ai_menu_handler(message: types.Message, state: FSMContext):
         data = await state.get_data()
         questions_count = data.get('ai_questions_count', 0)
         history_count = len(data.get('ai_history', []))
+        facts_count = len(data.get('ai_history_facts', []))
+        
+        cache_info = ""
+        if ai_assistant is not None and ai_assistant.vector_store.query_cache is not None:
+            cache_stats = ai_assistant.vector_store.query_cache.get_stats()
+            cache_info = (
+                f"\nКэш запросов: {cache_stats['hit_rate'] * 100:.1f}% попаданий "
+                f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']})"
+            )
+        if ai_assistant is not None and ai_assistant.answer_cache is not None:
+            answer_stats = ai_assistant.answer_cache.get_stats()
+            cache_info += (
+                f"\nКэш ответов: {answer_stats['hit_rate'] * 100:.1f}% попаданий, "
+                f"отсеяно по ключевым словам: {answer_stats['key_rejects']}"
+            )
+        if ai_assistant is not None and ai_assistant.vector_store.dispatcher is not None:
+            batch_stats = ai_assistant.vector_store.dispatcher.get_stats()
+            cache_info += (
+                f"\nБатчи запросов: в среднем {batch_stats['avg_batch_size']}, "
+                f"ожидание p95 {batch_stats['queue_wait_p95_ms']} мс"
+            )
         
         await message.answer(
             f"📊 <b>Ваша статистика:</b>\n\n"
             f"Всего вопросов: {questions_count}\n"
-            f"Сообщений в текущей истории: {history_count}\n"
+            f"Сообщений в текущей истории: {history_count} (+ {facts_count} в сжатом виде)\n"
             f"База знаний: 645 документов\n"
-            f"Модель: YandexGPT Lite",
+            f"Модель: YandexGPT Lite"
+            f"{cache_info}",
             parse_mode="HTML",
             reply_markup=get_ai_menu()
         )
@@ -103,11 +385,89 @@ async def ai_menu_handler(message: types.Message, state: FSMContext):
         )
 
 
+async def send_ai_answer(
+    message: types.Message,
+    state: FSMContext,
+    data: Dict,
+    history: list,
+    question: str,
+    result: Dict,
+    start_time: float,
+    context_length: int = 0,
+    cache_hit: bool = False
+):
+    """Отправляет ответ с источниками, логирует запрос и обновляет историю диалога"""
+    # Форматируем ответ
+    answer_text = f"💬 <b>Ответ:</b>\n\n{result['answer']}"
+    
+    # Добавляем источники
+    if result['sources']:
+        answer_text += "\n\n📚 <b>Источники:</b>\n"
+        for i, source in enumerate(result['sources'][:3], 1):
+            page_info = f", стр. {source['page']}" if source['page'] else ""
+            answer_text += f"{i}. {source['file_name']}{page_info}\n"
+    
+    # Отправляем ответ
+    with stage("telegram"):
+        if len(answer_text) > 4000:
+            parts = [answer_text[i:i+4000] for i in range(0, len(answer_text), 4000)]
+            for part in parts:
+                await message.answer(part, parse_mode="HTML", reply_markup=get_dialog_keyboard())
+        else:
+            await message.answer(answer_text, parse_mode="HTML", reply_markup=get_dialog_keyboard())
+    
+    # ✅ ЛОГИРОВАНИЕ
+    response_time_ms = int((time.time() - start_time) * 1000)
+    timer = current_timer()
+    
+    request_id = await log_ai_request(
+        user_id=message.from_user.id,
+        username=message.from_user.username or message.from_user.first_name,
+        question=question,
+        answer=result['answer'],
+        sources=result['sources'],
+        response_time_ms=response_time_ms,
+        context_length=context_length,
+        cache_hit=cache_hit,
+        stages=timer.as_dict() if timer is not None else None
+    )
+    
+    # ✅ КНОПКИ ОЦЕНКИ (без ID запроса оценку не к чему привязать)
+    if request_id is not None:
+        logger.info(f"✅ Запрос #{request_id} залогирован")
+        
+        feedback_keyboard = InlineKeyboardMarkup(row_width=2)
+        feedback_keyboard.add(
+            InlineKeyboardButton("👍 Полезно", callback_data=f"fb_pos_{request_id}"),
+            InlineKeyboardButton("👎 Не помогло", callback_data=f"fb_neg_{request_id}")
+        )
+        
+        await message.answer(
+            "Был ли ответ полезен?",
+            reply_markup=feedback_keyboard
+        )
+    
+    # Сохраняем в историю: последние реплики дословно, старые — сжатыми фактами
+    history, facts = history_manager.add_turn(
+        history, data.get('ai_history_facts', []), question, result['answer']
+    )
+    
+    # Обновляем FSM
+    questions_count = data.get('ai_questions_count', 0)
+    await state.update_data(
+        ai_history=history,
+        ai_history_facts=facts,
+        ai_questions_count=questions_count + 1
+    )
+
+
 async def ai_question_handler(message: types.Message, state: FSMContext):
     """Обработка вопроса к AI с контекстом"""
     
     # Проверка на кнопку "Закончить диалог"
     if message.text == "✅ Закончить диалог":
+        cancel_ai_request(message.from_user.id)
+        
         data = await state.get_data()
         questions_count = data.get('ai_questions_count', 0)
         
@@ -122,36 +482,57 @@ async def ai_question_handler(message: types.Message, state: FSMContext):
         return
     
     question = message.text.strip()
+    user_id = message.from_user.id
     start_time = time.time()
+    status_msg = None
+    
+    # Замер этапов запроса (embed, vector_query, rerank — внутри retrieve и cache_lookup)
+    timer = StageTimer()
+    timer_token = activate(timer)
     
     # Отправляем индикатор "печатает..."
-    await message.bot.send_chat_action(message.chat.id, "typing")
+    with stage("telegram"):
+        await message.bot.send_chat_action(message.chat.id, "typing")
     
     try:
-        # Получаем AI Assistant
-        assistant = get_ai_assistant()
+        # Получаем AI Assistant (первая инициализация долгая — тоже вне event loop)
+        assistant = await run_ai_stage(user_id, get_ai_assistant)
         
         # Загружаем историю диалога
         data = await state.get_data()
         history = data.get('ai_history', [])
+        history_facts = data.get('ai_history_facts', [])
+        
+        # 0. Предобработка запроса
+        with stage("preprocess"):
+            processed_query = query_processor.process(question)
+        logger.info(f"🔄 Обработанный запрос: {processed_query}")
+        
+        # Семантический кэш: тот же вопрос другими словами (только вне диалога —
+        # ответ с историей зависит от контекста разговора)
+        if not history and assistant.answer_cache is not None:
+            with stage("cache_lookup"):
+                cached = await run_ai_stage(user_id, assistant.get_cached_answer, processed_query)
+            if cached is not None:
+                result = {'answer': cached['answer'], 'sources': cached['sources']}
+                await send_ai_answer(message, state, data, history, question, result, start_time, cache_hit=True)
+                return
         
         # Отправляем сообщение "Ищу информацию..."
-        status_msg = await message.answer("🔍 Ищу информацию в документах...")
+        with stage("telegram"):
+            status_msg = await message.answer("🔍 Ищу информацию в документах...")
         
-        # Формируем контекст истории
-        conversation_context = ""
-        if history:
-            conversation_context = "ИСТОРИЯ ДИАЛОГА:\n"
-            for msg in history[-6:]:  # Последние 3 пары
-                role = "Пользователь" if msg['role'] == 'user' else "Ассистент"
-                conversation_context += f"{role}: {msg['content']}\n"
+        # Формируем контекст истории (в пределах бюджета токенов)
+        with stage("prompt"):
+            conversation_context = history_manager.render(history, history_facts)
         
-        # 1. Предобработка запроса
-        processed_query = query_processor.process(question)
-        logger.info(f"🔄 Обработанный запрос: {processed_query}")
+        # 1. Варианты запроса для многозапросного поиска
+        with stage("preprocess"):
+            query_variants = query_processor.variants(question) if config.AI_MULTI_QUERY else None
 
         # 2. Поиск документов
-        search_results = assistant.vector_store.search(processed_query, top_k=10)
+        with stage("retrieve"):
+            search_results = await run_ai_stage(user_id, assistant.retrieve, processed_query, variants=query_variants)
 
         # 3. Фильтрация по релевантности
         max_relevance = max([s['score'] for s in search_results]) if search_results else 0
@@ -159,7 +540,8 @@ async def ai_question_handler(message: types.Message, state: FSMContext):
 
         if max_relevance < 0.6:
             # Релевантность слишком низкая - информации нет
-            await status_msg.delete()
+            with stage("telegram"):
+                await status_msg.delete()
             
             no_info_text = (
                 "🤔 <b>К сожалению, я не нашёл информацию по вашему вопросу в документах.</b>\n\n"
@@ -172,19 +554,22 @@ async def ai_question_handler(message: types.Message, state: FSMContext):
                 "<i>Попробуйте задать более конкретный вопрос или использовать другие формулировки.</i>"
             )
             
-            await message.answer(no_info_text, parse_mode="HTML", reply_markup=get_dialog_keyboard())
+            with stage("telegram"):
+                await message.answer(no_info_text, parse_mode="HTML", reply_markup=get_dialog_keyboard())
             
             # Логируем низкую релевантность
             response_time_ms = int((time.time() - start_time) * 1000)
             
-            request_id = ai_logger.log_request(
+            # ID не нужен (кнопок оценки нет) — не ждём записи
+            ai_logger.submit_request(
                 user_id=message.from_user.id,
                 username=message.from_user.username or message.from_user.first_name,
                 question=question,
                 answer="[Информация не найдена - низкая релевантность]",
                 sources=search_results,
                 response_time_ms=response_time_ms,
-                context_length=0
+                context_length=0,
+                stages=timer.as_dict()
             )
             
             logger.warning(f"⚠️ Низкая релевантность ({max_relevance:.3f}) для запроса: {question}")
@@ -198,31 +583,28 @@ async def ai_question_handler(message: types.Message, state: FSMContext):
             
             return  # ✅ ВАЖНО! Выходим из функции
         
-        # 4. Формируем контекст из документов
-        context_parts = []
-        for idx, result_doc in enumerate(search_results, 1):
-            context_parts.append(
-                f"[ДОКУМЕНТ {idx}]\n"
-                f"Источник: {result_doc['file_name']}\n"
-                f"Страница: {result_doc.get('page', 'N/A')}\n"
-                f"Текст:\n{result_doc['text']}\n"
+        # 4-5. Промпт в пределах бюджета токенов: лучшие документы, пока помещаются
+        with stage("prompt"):
+            packed = context_builder.build(
+                question=question,
+                results=search_results,
+                conversation_history=conversation_context
             )
-        
-        doc_context = "\n".join(context_parts)
-        
-        # 5. Формируем полный промпт
-        from AI_helper.prompts import build_full_prompt
-        
-        full_prompt = build_full_prompt(
-            question=question,
-            doc_context=doc_context,
-            conversation_history=conversation_context if history else None
-        )
+        doc_context = packed.doc_context
         
         # 6. Генерируем ответ
         from AI_helper.llm import Message
-        messages = [Message(role="user", content=full_prompt)]
-        answer = assistant.llm.generate(messages, temperature=0.6)
+        messages = [Message(role="user", content=packed.prompt)]
+        with stage("llm"):
+            if config.AI_STREAM:
+                answer = await stream_ai_answer(
+                    user_id, status_msg, assistant.llm, messages,
+                    temperature=0.6, max_tokens=packed.max_tokens
+                )
+            else:
+                answer = await run_ai_coroutine(
+                    user_id, assistant.llm.agenerate(messages, temperature=0.6, max_tokens=packed.max_tokens)
+                )
         
         # 7. Формируем результат
         result = {
@@ -234,72 +616,41 @@ async def ai_question_handler(message: types.Message, state: FSMContext):
                     'score': s['score'],
                     'text_preview': s['text'][:200] + "..."
                 }
-                for s in search_results
+                for s in packed.results
             ]
         }
         
-        # Удаляем статус
-        await status_msg.delete()
-        
-        # Форматируем ответ
-        answer_text = f"💬 <b>Ответ:</b>\n\n{result['answer']}"
-        
-        # Добавляем источники
-        if result['sources']:
-            answer_text += "\n\n📚 <b>Источники:</b>\n"
-            for i, source in enumerate(result['sources'][:3], 1):
-                page_info = f", стр. {source['page']}" if source['page'] else ""
-                answer_text += f"{i}. {source['file_name']}{page_info}\n"
+        if not history:
+            with stage("cache_store"):
+                await run_ai_stage(user_id, assistant.cache_answer, processed_query, answer, result['sources'])
         
-        # Отправляем ответ
-        if len(answer_text) > 4000:
-            parts = [answer_text[i:i+4000] for i in range(0, len(answer_text), 4000)]
-            for part in parts:
-                await message.answer(part, parse_mode="HTML", reply_markup=get_dialog_keyboard())
-        else:
-            await message.answer(answer_text, parse_mode="HTML", reply_markup=get_dialog_keyboard())
-        
-        # ✅ ЛОГИРОВАНИЕ
-        response_time_ms = int((time.time() - start_time) * 1000)
+        # Удаляем статус
+        with stage("telegram"):
+            await status_msg.delete()
         
-        request_id = ai_logger.log_request(
-            user_id=message.from_user.id,
-            username=message.from_user.username or message.from_user.first_name,
-            question=question,
-            answer=result['answer'],
-            sources=result['sources'],
-            response_time_ms=response_time_ms,
+        await send_ai_answer(
+            message, state, data, history, question, result, start_time,
             context_length=len(doc_context)
         )
         
-        logger.info(f"✅ Запрос #{request_id} залогирован")
-        
-        # ✅ КНОПКИ ОЦЕНКИ
-        feedback_keyboard = InlineKeyboardMarkup(row_width=2)
-        feedback_keyboard.add(
-            InlineKeyboardButton("👍 Полезно", callback_data=f"fb_pos_{request_id}"),
-            InlineKeyboardButton("👎 Не помогло", callback_data=f"fb_neg_{request_id}")
-        )
-        
-        await message.answer(
-            "Был ли ответ полезен?",
-            reply_markup=feedback_keyboard
-        )
-        
-        # Сохраняем в историю
-        history.append({"role": "user", "content": question})
-        history.append({"role": "assistant", "content": result['answer']})
+    except asyncio.CancelledError:
+        # Пользователь завершил диалог, пока шёл поиск или генерация
+        logger.info(f"AI-запрос пользователя {user_id} прерван: '{question}'")
+        if status_msg is not None:
+            try:
+                await status_msg.delete()
+            except Exception:
+                pass
         
-        # Ограничиваем историю
-        if len(history) > 10:
-            history = history[-10:]
-        
-        # Обновляем FSM
-        questions_count = data.get('ai_questions_count', 0)
-        await state.update_data(
-            ai_history=history,
-            ai_questions_count=questions_count + 1
-        )
+    except LLMUnavailableError as e:
+        # Провайдер перегружен или недоступен — не показываем пользователю трассировку
+        logger.error(f"LLM недоступна: {e}")
+        if status_msg is not None:
+            try:
+                await status_msg.delete()
+            except Exception:
+                pass
+        await message.answer(LLMUnavailableError.USER_MESSAGE, reply_markup=get_dialog_keyboard())
         
     except Exception as e:
         logger.error(f"Ошибка AI: {e}", exc_info=True)
@@ -308,6 +659,9 @@ async def ai_question_handler(message: types.Message, state: FSMContext):
             parse_mode="HTML",
             reply_markup=get_dialog_keyboard()
         )
+    
+    finally:
+        deactivate(timer_token)
 
 
 async def feedback_handler(callback_query: types.CallbackQuery):
@@ -338,17 +692,58 @@ async def feedback_handler(callback_query: types.CallbackQuery):
         logger.error(f"❌ Ошибка обработки feedback: {e}", exc_info=True)  # ✅ ДОБАВЛЕНО
         await callback_query.answer("Ошибка сохранения оценки")
 
+async def ai_stats_command(message: types.Message):
+    """/ai_stats [дни] — сводка по AI-помощнику для администраторов"""
+    if message.from_user.id not in config.ADMIN_USERS:
+        await message.answer("❌ Эта команда доступна только администраторам.")
+        return
+    
+    args = message.get_args()
+    days = int(args) if args and args.isdigit() and int(args) > 0 else 7
+    
+    # Статистика читается из агрегатов — запрос быстрый при любом размере лога
+    stats = ai_logger.get_stats(days=days)
+    popular = ai_logger.get_popular_questions(limit=5, days=days)
+    stage_stats = ai_logger.get_stage_stats(days=days)
+    
+    text = (
+        f"📊 <b>AI-помощник за {days} дн.</b>\n\n"
+        f"Запросов: {stats['total_requests']}\n"
+        f"Время ответа: среднее {stats['avg_response_time_ms']:.0f} мс, "
+        f"p50 ≤ {stats['response_time_p50_ms']} мс, p95 ≤ {stats['response_time_p95_ms']} мс\n"
+        f"Средняя релевантность: {stats['avg_relevance']}\n"
+        f"Не найдено: {stats['low_relevance']}\n"
+        f"Из кэша: {stats['cache_hits']} ({stats['cache_hit_rate']}%)\n"
+        f"Оценки: 👍 {stats['positive_feedback']} / 👎 {stats['negative_feedback']} "
+        f"({stats['feedback_rate']}% ответов)\n"
+    )
+    if stage_stats:
+        text += "\n🔬 <b>Самые долгие этапы (p95):</b>\n"
+        for name, s in list(stage_stats.items())[:4]:
+            text += f"{name}: ≤ {s['p95_ms']:.0f} мс\n"
+    if popular:
+        text += "\n🔥 <b>Частые вопросы:</b>\n"
+        for i, q in enumerate(popular, 1):
+            text += f"{i}. ({q['count']}×) {html.escape(q['question'][:80])}\n"
+    
+    await message.answer(text, parse_mode="HTML")
+
+
 async def cancel_ai_question(message: types.Message, state: FSMContext):
     """Отмена вопроса к AI"""
+    cancel_ai_request(message.from_user.id)
     await message.answer("❌ Диалог отменён", reply_markup=get_ai_menu())
     await BotStates.ai_menu.set()
 
 
 def register_handlers(dp: Dispatcher):
     """Регистрация обработчиков AI"""
+    # Команда администратора — в любом состоянии, раньше обработчиков меню и вопросов
+    dp.register_message_handler(ai_stats_command, commands=['ai_stats'], state="*")
     dp.register_message_handler(ai_menu_handler, state=BotStates.ai_menu)
-    dp.register_message_handler(ai_question_handler, state=BotStates.ai_asking)
+    # /cancel регистрируем раньше, иначе его перехватит обработчик вопросов
     dp.register_message_handler(cancel_ai_question, commands=['cancel'], state=BotStates.ai_asking)
+    dp.register_message_handler(ai_question_handler, state=BotStates.ai_asking)
     
     dp.register_callback_query_handler(
         feedback_handler, 
@@ -1,6 +1,7 @@
 """
 Главный файл запуска Gateway Bot.
 """
+import asyncio
 import logging
 import sys
 import os
@@ -43,11 +44,20 @@ async def on_startup(dp: Dispatcher):
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации БД табеля: {e}")
     
+    # Прогреваем AI-помощника в фоне, чтобы первый вопрос не ждал загрузки модели
+    if config.AI_WARMUP:
+        asyncio.create_task(ai_assistant.start_warm_up())
+    
+    # Перенос старых логов AI в архив (первый проход — сразу после запуска)
+    if config.AI_LOG_RETENTION_DAYS > 0:
+        asyncio.create_task(ai_assistant.log_retention_loop())
+    
     logger.info("✅ Gateway Bot запущен!")
 
 
 async def on_shutdown(dp: Dispatcher):
     """Действия при остановке бота."""
+    await ai_assistant.shutdown_ai()
     logger.info("🛑 Gateway Bot остановлен!")
 
 